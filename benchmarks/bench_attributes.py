@@ -0,0 +1,46 @@
+''' Class-based rules over synthetic documents, with and without an attribute index.
+
+    python -m benchmarks.bench_attributes --elements 10000 100000 --classes 100
+
+Each rule is run on a fresh document: scanning visits every element; the index only
+visits the elements in the intersection of the postings of the rule's tag, attributes and classes.
+'''
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+from runtime import matcher
+from runtime.index import build_index
+from benchmarks.synthetic import generate_html
+
+RULES = {
+    'class': '(_,{"class": {"c7", ...}},Children) = (mark,{},Children)',
+    'tag+class': '(span,{"class": {"item", "c7"}},Children) = (b,{},Children)',
+    'common class': '(_,{"class": {"item", ...}},Children) = (section,{},Children)',
+}
+
+def run(html: str, rule: str, indexed: bool):
+    soup = BeautifulSoup(html, 'html.parser')
+    program = matcher.compile(parse.parse_program(rule)[0])
+
+    start = time.perf_counter()
+    index = build_index(soup, attributes=True) if indexed else None
+    built = time.perf_counter()
+    matcher.unify_tree(program, root=soup, soup=soup, index=index)
+    return built - start, time.perf_counter() - built
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--elements', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--classes', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f'{"elements":>9} {"rule":>13} {"scan ms":>9} {"index ms":>9} {"build ms":>9}')
+    for elements in args.elements:
+        html = generate_html(elements, classes=args.classes)
+        for name, rule in RULES.items():
+            _, scan = run(html, rule, indexed=False)
+            build, indexed = run(html, rule, indexed=True)
+            print(f'{elements:>9} {name:>13} {1000 * scan:>9.1f} {1000 * indexed:>9.1f} {1000 * build:>9.1f}')
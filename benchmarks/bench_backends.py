@@ -0,0 +1,54 @@
+''' Parse, rewrite and serialize tests/data/ask-hn-oct-24.html on every available backend.
+
+    python -m benchmarks.bench_backends
+'''
+import argparse
+import time
+
+import lexer.lex as lex
+import parser.parse as parse
+from runtime import matcher
+from runtime.backend import BACKENDS, BackendException
+
+PROGRAM = '(img,A,C) = (); (span,{},Children) = (b,{},[(span,{},Children)]); (font,{},Children) = (p,{},Children)'
+
+def bench(backend_name: str, html: str, program: str, repeat: int):
+    backend = BACKENDS[backend_name]
+    rules = matcher.compile_rules(parse.parse_rules(lex.lex(program)), backend)
+
+    timings = { 'parse': [], 'rewrite': [], 'serialize': [] }
+    for _ in range(repeat):
+        start = time.perf_counter()
+        document = backend.parse(html)
+        parsed = time.perf_counter()
+        matcher.unify_tree(rules, root=document, soup=document)
+        rewritten = time.perf_counter()
+        backend.serialize(document, pretty=False)
+        serialized = time.perf_counter()
+
+        timings['parse'].append(parsed - start)
+        timings['rewrite'].append(rewritten - parsed)
+        timings['serialize'].append(serialized - rewritten)
+
+    return { phase: min(times) for phase, times in timings.items() }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--html', type=str, default='tests/data/ask-hn-oct-24.html')
+    parser.add_argument('--program', type=str, default=PROGRAM)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.html, 'r') as f:
+        html = f.read()
+
+    print(f'{"backend":<12} {"parse":>8} {"rewrite":>8} {"serialize":>10} {"total":>8}')
+    for name in BACKENDS:
+        try:
+            timings = bench(name, html, args.program, args.repeat)
+        except BackendException as e:
+            print(f'{name:<12} skipped: {e}')
+            continue
+
+        total = sum(timings.values())
+        print(f'{name:<12} {timings["parse"]:>8.3f} {timings["rewrite"]:>8.3f} {timings["serialize"]:>10.3f} {total:>8.3f}')
@@ -0,0 +1,43 @@
+''' Batch throughput (files/second) for increasing --jobs over copies of a document.
+
+    python -m benchmarks.bench_batch --files 64 --jobs 1 2 4 8
+'''
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import lexer.lex as lex
+import parser.parse as parse
+from tpml.batch import run_batch
+
+PROGRAM = '(img,A,C) = (); (span,{},Children) = (b,{},[(span,{},Children)])'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--html', type=str, default='tests/data/ask-hn-oct-24.html')
+    parser.add_argument('--program', type=str, default=PROGRAM)
+    parser.add_argument('--files', type=int, default=32)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--backend', type=str, default='html.parser')
+    args = parser.parse_args()
+
+    rules = parse.parse_rules(lex.lex(args.program))
+    with tempfile.TemporaryDirectory() as root:
+        input_dir = Path(root) / 'in'
+        input_dir.mkdir()
+        for i in range(args.files):
+            shutil.copy(args.html, input_dir / f'{i}.html')
+
+        print(f'{"jobs":>5} {"seconds":>9} {"files/s":>9} {"speedup":>8}')
+        baseline = None
+        for jobs in args.jobs:
+            output_dir = Path(root) / f'out-{jobs}'
+            start = time.perf_counter()
+            summary = run_batch(rules, input_dir=str(input_dir), output_dir=str(output_dir), jobs=jobs, backend_name=args.backend)
+            seconds = time.perf_counter() - start
+            assert summary.failed == 0
+
+            baseline = baseline or seconds
+            print(f'{jobs:>5} {seconds:>9.2f} {args.files / seconds:>9.1f} {baseline / seconds:>8.2f}')
@@ -0,0 +1,48 @@
+''' Growing rule sets on the Ask HN page, dispatched by tag only or through the decision tree.
+
+    python -m benchmarks.bench_decision --rules 1 10 100 500
+
+Every rule has the left side tag 'tr' and differs in the tag it expects as the row's last child. Dispatching
+by tag tries each of them on every row; the decision tree looks the row's children up once and tries none.
+'''
+import argparse
+import itertools
+import string
+import time
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+from runtime import matcher
+
+ASK_HN = 'tests/data/ask-hn-oct-24.html'
+
+RULE = '(tr,{},[(td,{},C),(%s,{},D)]) = (section,{},C)'
+
+def rules_source(count: int) -> str:
+    names = (''.join(letters) for length in itertools.count(2) for letters in itertools.product(string.ascii_lowercase, repeat=length))
+    return '; '.join(RULE % name for name in itertools.islice(names, count))
+
+def run(html: str, rules: matcher.RuleSet) -> float:
+    soup = BeautifulSoup(html, 'html.parser')
+    start = time.perf_counter()
+    matcher.unify_tree(rules, root=soup, soup=soup)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', type=int, nargs='+', default=[1, 10, 100, 500])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with open(ASK_HN, 'r') as f:
+        html = f.read()
+
+    print(f'{"rules":>6} {"tag ms":>9} {"tree ms":>9}')
+    for count in args.rules:
+        unifications = parse.parse_program(rules_source(count))
+        by_tag = matcher.compile_rules(unifications, decision_tree=False)
+        tree = matcher.compile_rules(unifications)
+        dispatched = min(run(html, by_tag) for _ in range(args.repeat))
+        decided = min(run(html, tree) for _ in range(args.repeat))
+        print(f'{count:>6} {1000 * dispatched:>9.1f} {1000 * decided:>9.1f}')
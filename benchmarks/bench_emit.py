@@ -0,0 +1,47 @@
+''' Time to emit N distinct rules with one esbuild run per rule (emit) vs. batched runs (emit_many).
+Requires esbuild (npm install in runtime/js); the emit cache is bypassed.
+
+    python -m benchmarks.bench_emit --rules 100
+'''
+import argparse
+import time
+
+from runtime.js import emitter
+
+TAGS = [ 'b', 'i', 'em', 'strong', 'span', 'p', 'li', 'td', 'div', 'a' ]
+
+def generate_rules(count: int):
+    # Distinct rules: vary the nesting of the replacement
+    rules = []
+    for i in range(count):
+        tag = TAGS[i % len(TAGS)]
+        wrappers = TAGS[:1 + i // len(TAGS) % len(TAGS)]
+        right = 'C'
+        for wrapper in wrappers:
+            right = f'[({wrapper},{{}},{right})]'
+        rules.append(f'({tag},{{}},C) = (mark,{{}},{right})')
+    return rules
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', type=int, default=100)
+    parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+
+    if not emitter.ESBUILD_PATH.exists():
+        raise SystemExit(f'esbuild not found at {emitter.ESBUILD_PATH}')
+
+    rules = generate_rules(args.rules)
+
+    start = time.perf_counter()
+    for rule in rules:
+        emitter.emit(rule, cache=None)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    emitter.emit_many(rules, cache=None, jobs=args.jobs)
+    many = time.perf_counter() - start
+
+    print(f'{"mode":>10} {"seconds":>9} {"rules/s":>9}')
+    print(f'{"emit":>10} {single:>9.3f} {args.rules / single:>9.1f}')
+    print(f'{"emit_many":>10} {many:>9.3f} {args.rules / many:>9.1f}')
@@ -0,0 +1,50 @@
+''' '..>' filters on deep synthetic documents: searching subtrees versus the pre-order numbering.
+
+    python -m benchmarks.bench_filters --elements 10000 100000 --fanout 2
+
+Searching is O(subtree) per candidate, so O(n * depth) over a document; with the numbering a
+tag-only filter is a binary search and other filters only try the descendants with the right tag.
+'adaptive' is the default: search until that has cost about as much as numbering the document would.
+'''
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+from runtime import matcher
+from benchmarks.synthetic import generate_html
+
+RULES = {
+    # No <img> anywhere: every candidate's whole subtree is searched
+    'absent tag': '(div,{},C) ..> (img,A,C) = (section,{},C)',
+    'pattern': '(div,{},C) ..> (b,{},[(i,{},C)]) = (div,{},C)',
+}
+
+FACTORS = {
+    'search': float('inf'),
+    'numbered': 0.0,
+    'adaptive': matcher.NUMBERING_FACTOR,
+}
+
+def run(html: str, rule: str, factor: float) -> float:
+    soup = BeautifulSoup(html, 'html.parser')
+    program = matcher.compile(parse.parse_program(rule)[0])
+
+    matcher.NUMBERING_FACTOR = factor
+    start = time.perf_counter()
+    matcher.unify_tree(program, root=soup, soup=soup)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--elements', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--fanout', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f'{"elements":>9} {"rule":>11} ' + ' '.join(f'{name + " ms":>12}' for name in FACTORS))
+    for elements in args.elements:
+        html = generate_html(elements, fanout=args.fanout)
+        for name, rule in RULES.items():
+            times = [ run(html, rule, factor) for factor in FACTORS.values() ]
+            print(f'{elements:>9} {name:>11} ' + ' '.join(f'{1000 * seconds:>12.1f}' for seconds in times))
@@ -0,0 +1,45 @@
+''' Rename and attribute rewrites applied in place versus rebuilt, in time and allocated memory.
+
+    python -m benchmarks.bench_inplace --elements 10000 100000
+'''
+import argparse
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+from runtime import matcher
+from benchmarks.synthetic import generate_html
+
+RULES = {
+    'rename': '(span,{},Children) = (b,{},Children)',
+    'attributes': '(div,Attrs,Children) = (div,{Attrs, "class": "x"},Children)',
+}
+
+def measure(html: str, rules: str, inplace: bool):
+    unifications = parse.parse_program(rules)
+    soup = BeautifulSoup(html, 'html.parser')
+    program = matcher.compile_rules([ matcher.compile(unification, inplace=inplace) for unification in unifications ])
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    matcher.unify_tree(program, root=soup, soup=soup)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--elements', type=int, nargs='+', default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    # Times are taken under tracemalloc, so compare them with each other rather than with other benchmarks
+    print(f'{"elements":>9} {"rule":>11} {"inplace ms":>11} {"rebuild ms":>11} {"inplace KiB":>12} {"rebuild KiB":>12}')
+    for elements in args.elements:
+        html = generate_html(elements)
+        for name, rules in RULES.items():
+            inplace_seconds, inplace_peak = measure(html, rules, inplace=True)
+            rebuild_seconds, rebuild_peak = measure(html, rules, inplace=False)
+            print(f'{elements:>9} {name:>11} {1000 * inplace_seconds:>11.1f} {1000 * rebuild_seconds:>11.1f} {inplace_peak / 1024:>12.0f} {rebuild_peak / 1024:>12.0f}')
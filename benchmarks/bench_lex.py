@@ -0,0 +1,32 @@
+''' Lexing time for rule files of increasing size; time per KB should stay flat.
+
+    python -m benchmarks.bench_lex --sizes 10 100 1000
+'''
+import argparse
+import time
+
+import lexer.lex as lex
+
+RULE = '(div,{"class": "x"},[(Tag,{},Children), (img,{ ... },[])]) = (section,{},[(Tag,{},Children)]);\n'
+
+def generate_rules(kilobytes: int) -> str:
+    return RULE * (kilobytes * 1024 // len(RULE) + 1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Rule file sizes in KB.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"KB":>8} {"tokens":>10} {"seconds":>9} {"ms/KB":>8}')
+    for size in args.sizes:
+        source = generate_rules(size)
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            tokens = lex.lex(source)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+
+        kilobytes = len(source) / 1024
+        print(f'{kilobytes:>8.0f} {len(tokens):>10} {best:>9.4f} {1000 * best / kilobytes:>8.3f}')
@@ -0,0 +1,57 @@
+''' Rule sets of deep patterns on the Ask HN page, with and without memoized matching.
+
+    python -m benchmarks.bench_memo --rules 1 10 50 100
+
+Every rule looks at the same comment rows and differs only in the class it expects seven levels down.
+Without the memo each rule walks each row until it fails; with it each row is shaped once and every
+rule looks its shape up. Shaping costs more than a failing match, so the memo only pays off once there
+are enough rules: on this page, somewhere over a hundred.
+'''
+import argparse
+import itertools
+import string
+import time
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+from runtime import matcher, memo
+
+ASK_HN = 'tests/data/ask-hn-oct-24.html'
+
+RULE = '(tr,{"class": {"athing", "comtr"}},[(td,{},[(table,{},[(tbody,{},[(tr,{},[(td,{"class": {"ind"}},[(img,A,C)]),(td,{"class": {"votelinks"}},C),(td,{"class": {"%s"}},C)])])])])]) = (section,{},[])'
+
+def rules_source(count: int) -> str:
+    # Class names without digits, which the lexer doesn't take in this position
+    names = (''.join(letters) for length in itertools.count(2) for letters in itertools.product(string.ascii_lowercase, repeat=length))
+    return '; '.join(RULE % name for name in itertools.islice(names, count))
+
+def run(html: str, rules: matcher.RuleSet, memoized) -> float:
+    soup = BeautifulSoup(html, 'html.parser')
+    start = time.perf_counter()
+    if memoized is None:
+        matcher.unify_tree(rules, root=soup, soup=soup)
+    else:
+        memo.unify_tree(memoized, root=soup, soup=soup)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', type=int, nargs='+', default=[1, 10, 50, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with open(ASK_HN, 'r') as f:
+        html = f.read()
+
+    print(f'{"rules":>6} {"plain ms":>9} {"memo ms":>9} {"hits":>9} {"misses":>9}')
+    for count in args.rules:
+        rules = matcher.compile_rules(parse.parse_program(rules_source(count)))
+        plain = min(run(html, rules, None) for _ in range(args.repeat))
+
+        # A fresh memo per document, so hits don't carry over between runs
+        memoized_runs = []
+        for _ in range(args.repeat):
+            memoized = memo.memoize(rules)
+            memoized_runs.append(run(html, rules, memoized))
+        print(f'{count:>6} {1000 * plain:>9.1f} {1000 * min(memoized_runs):>9.1f} {memoized.memo.hits:>9} {memoized.memo.misses:>9}')
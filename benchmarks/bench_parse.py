@@ -0,0 +1,39 @@
+''' Parse time for programs of increasing rule counts; time per rule should stay flat.
+
+    python -m benchmarks.bench_parse --rules 100 1000 10000
+    python -m benchmarks.bench_parse --no-gc    # without the cyclic GC passes allocating the AST triggers
+'''
+import argparse
+import gc
+import time
+
+import lexer.lex as lex
+import parser.parse as parse
+from benchmarks.bench_lex import RULE
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-gc', action='store_true', help='Disable the cyclic garbage collector for the whole run.')
+    args = parser.parse_args()
+
+    if args.no_gc:
+        gc.disable()
+
+    print(f'{"rules":>8} {"lex ms":>9} {"parse ms":>9} {"us/rule":>8}')
+    for count in args.rules:
+        source = RULE * count
+        lex_best = parse_best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            tokens = lex.lex(source)
+            lexed = time.perf_counter()
+            rules = parse.parse_rules(tokens)
+            parsed = time.perf_counter()
+            assert len(rules) == count
+
+            lex_best = lexed - start if lex_best is None else min(lex_best, lexed - start)
+            parse_best = parsed - lexed if parse_best is None else min(parse_best, parsed - lexed)
+
+        print(f'{count:>8} {1000 * lex_best:>9.2f} {1000 * parse_best:>9.2f} {1e6 * parse_best / count:>8.2f}')
@@ -0,0 +1,60 @@
+''' Per page latency of a small page rewritten by starting the command line, and by a daemon.
+
+    python -m benchmarks.bench_serve --requests 200 --jobs 0 2
+
+The daemon is started in this process and the requests sent to it over a Unix socket, one at a time, with the
+same program each time, so only the first one per worker compiles it.
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from tpml import serve
+
+PROGRAM = '(img,A,C) = (); (span,{"class": {"age"}},C) = (b,{},C)'
+
+HTML = '<table>' + '<tr><td><img src="s.gif"/><span class="age"><a href="item">1 hour ago</a></span></td></tr>' * 20 + '</table>'
+
+def run_command(path: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([ sys.executable, '-m', 'tpml.main', PROGRAM, '--html', path, '--compact' ], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def run_daemon(address: str, requests: int) -> float:
+    with serve.Client(address) as client:
+        start = time.perf_counter()
+        for _ in range(requests):
+            assert client.rewrite(PROGRAM, HTML)['ok']
+        return (time.perf_counter() - start) / requests
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--commands', type=int, default=5)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[0, 2])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'page.html')
+        with open(path, 'w') as f:
+            f.write(HTML)
+
+        print(f'{"":>12} {"ms":>9}')
+        print(f'{"command":>12} {1000 * min(run_command(path) for _ in range(args.commands)):>9.2f}')
+
+        for jobs in args.jobs:
+            daemon = serve.Daemon(jobs=jobs)
+            server = serve.make_server(os.path.join(directory, f'tpml-{jobs}.sock'), daemon)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                # Workers start and compile the program on their first requests
+                run_daemon(serve.server_address(server), 2 * max(jobs, 1))
+                print(f'{f"jobs={jobs}":>12} {1000 * run_daemon(serve.server_address(server), args.requests):>9.2f}')
+            finally:
+                server.shutdown()
+                server.server_close()
+                daemon.shutdown()
@@ -0,0 +1,38 @@
+''' Scaling of unify_tree with document size: time per element should stay flat.
+
+    python -m benchmarks.bench_traversal --sizes 10000 100000 1000000
+'''
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+
+import lexer.lex as lex
+import parser.parse as parse
+from runtime import matcher
+from runtime.traversal import Order
+from benchmarks.synthetic import generate_html
+
+RULE = '(span,{},Children) = (b,{},Children)'
+
+def bench(elements: int, fanout: int, order: Order, rule: str = RULE) -> float:
+    soup = BeautifulSoup(generate_html(elements, fanout=fanout), 'html.parser')
+    program = matcher.compile(parse.parse_unification(lex.lex(rule)))
+
+    start = time.perf_counter()
+    matcher.unify_tree(program, root=soup, soup=soup, order=order)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--order', type=Order, choices=list(Order), nargs='+', default=list(Order))
+    parser.add_argument('--rule', type=str, default=RULE)
+    args = parser.parse_args()
+
+    print(f'{"order":<14} {"elements":>10} {"seconds":>10} {"us/element":>11}')
+    for order in args.order:
+        for elements in args.sizes:
+            seconds = bench(elements, fanout=args.fanout, order=order, rule=args.rule)
+            print(f'{order:<14} {elements:>10} {seconds:>10.3f} {seconds / elements * 1e6:>11.2f}')
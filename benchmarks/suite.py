@@ -0,0 +1,179 @@
+''' The benchmark suite: times every case, writes the results as JSON and compares them with a baseline.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json --threshold 0.2
+    python -m benchmarks.suite --output benchmarks/baseline.json    # update the baseline
+
+Each case is timed 'repeat' times on fresh input; the minimum is compared (it is the least noisy).
+The Javascript runtime's benchmarks (runtime/js/tests/matcher.bench.js) are run by vitest, if it is installed
+in runtime/js, and reported as 'js/...' cases with vitest's own sample count.
+The exit status is 1 if any case is slower than the baseline by more than 'threshold'.
+'''
+from typing import Callable, Dict, List
+from dataclasses import dataclass
+import argparse
+import io
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import orjson
+from bs4 import BeautifulSoup
+
+import lexer.lex as lex
+import parser.parse as parse
+from runtime import matcher
+from runtime.index import build_index
+from runtime.stream import compile_stream, rewrite_stream
+from benchmarks.bench_lex import RULE
+from benchmarks.synthetic import generate_html
+
+ASK_HN = 'tests/data/ask-hn-oct-24.html'
+JS_DIR = 'runtime/js'
+VITEST = os.path.join(JS_DIR, 'node_modules', '.bin', 'vitest')
+RULES = '(img,A,C) = (); (span,{},Children) = (b,{},[(span,{},Children)]); (font,{},C) = (em,{},C)'
+
+# A case returns a fresh run: setup happens outside the timed call.
+Case = Callable[[], Callable[[], object]]
+
+@dataclass
+class Result:
+    min: float
+    median: float
+    runs: List[float]
+
+def read_ask_hn() -> str:
+    with open(ASK_HN, 'r') as f:
+        return f.read()
+
+def cases(elements: int) -> Dict[str, Case]:
+    ask_hn = read_ask_hn()
+    synthetic = generate_html(elements)
+    rules_source = RULE * 1000
+    rules_tokens = lex.lex(rules_source)
+    rules = parse.parse_program(RULES)
+
+    def unify(html: str, index: bool):
+        def setup():
+            soup = BeautifulSoup(html, 'html.parser')
+            program = matcher.compile_rules(rules)
+            tag_index = build_index(soup) if index else None
+            return lambda: matcher.unify_tree(program, root=soup, soup=soup, index=tag_index)
+        return setup
+
+    def stream(html: str):
+        def setup():
+            program = compile_stream(rules)
+            return lambda: rewrite_stream(program, input=io.StringIO(html), output=io.StringIO())
+        return setup
+
+    return {
+        'lex/1000-rules': lambda: lambda: lex.lex(rules_source),
+        'parse/1000-rules': lambda: lambda: parse.parse_rules(rules_tokens),
+        'parse-html/ask-hn': lambda: lambda: BeautifulSoup(ask_hn, 'html.parser'),
+        'unify_tree/ask-hn': unify(ask_hn, index=False),
+        'unify_tree/ask-hn/index': unify(ask_hn, index=True),
+        f'unify_tree/synthetic-{elements}': unify(synthetic, index=False),
+        'stream/ask-hn': stream(ask_hn),
+    }
+
+def run(case: Case, repeat: int) -> Result:
+    runs = []
+    for _ in range(repeat):
+        fn = case()
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+
+    return Result(min=min(runs), median=statistics.median(runs), runs=runs)
+
+def run_js() -> Dict[str, Result]:
+    ''' Run the vitest benchmarks of the Javascript runtime; vitest reports milliseconds. '''
+    if not os.path.exists(VITEST):
+        print(f'Skipping the js/ cases: vitest is not installed in {JS_DIR} (npm install there).', file=sys.stderr)
+        return {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'bench.json')
+        subprocess.run([ os.path.abspath(VITEST), 'bench', '--run', '--outputJson', output ], cwd=JS_DIR, check=True, stdout=subprocess.DEVNULL)
+        with open(output, 'rb') as f:
+            report = orjson.loads(f.read())
+
+    results = {}
+    for file in report['files']:
+        for group in file['groups']:
+            # 'tests/matcher.bench.js > unify_tree'
+            group_name = group['fullName'].split(' > ')[-1]
+            for benchmark in group['benchmarks']:
+                # vitest keeps no samples in its JSON, only their statistics
+                results[f'js/{group_name}/{benchmark["name"]}'] = Result(
+                    min=benchmark['min'] / 1000, median=benchmark['median'] / 1000, runs=[])
+    return results
+
+def compare(results: Dict[str, Result], baseline: Dict, threshold: float) -> List[str]:
+    ''' Print each case against the baseline; return the names of the cases that regressed. '''
+    regressions = []
+    print(f'{"case":<32} {"baseline":>10} {"current":>10} {"change":>8}')
+    for name, result in results.items():
+        if name not in baseline['results']:
+            print(f'{name:<32} {"-":>10} {result.min:>10.4f} {"new":>8}')
+            continue
+
+        previous = baseline['results'][name]['min']
+        change = result.min / previous - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<32} {previous:>10.4f} {result.min:>10.4f} {change:>+8.1%}{flag}')
+
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, help='Write the results here as JSON.')
+    parser.add_argument('--baseline', type=str, help='Compare against these results (from --output).')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown per case, as a fraction of the baseline.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--elements', type=int, default=100_000, help='Size of the synthetic document.')
+    parser.add_argument('--filter', type=str, default='', help='Only run cases whose name contains this.')
+    parser.add_argument('--no-js', action='store_true', help='Skip the js/ cases (vitest benchmarks of the Javascript runtime).')
+    args = parser.parse_args()
+
+    results = {}
+    for name, case in cases(args.elements).items():
+        if args.filter in name:
+            results[name] = run(case, args.repeat)
+            if args.baseline is None:
+                print(f'{name:<32} {results[name].min:>10.4f}s', file=sys.stderr)
+
+    if not args.no_js:
+        for name, result in run_js().items():
+            if args.filter in name:
+                results[name] = result
+                if args.baseline is None:
+                    print(f'{name:<32} {result.min:>10.4f}s', file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'rb') as f:
+            baseline = orjson.loads(f.read())
+        regressions = compare(results, baseline, args.threshold)
+
+    if args.output:
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.output, 'wb') as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+
+    if regressions != []:
+        print(f'{len(regressions)} regression(s) above {args.threshold:.0%}: {", ".join(regressions)}', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,71 @@
+from typing import Iterator, Optional, Sequence
+import argparse
+import sys
+
+DEFAULT_TAGS = ('div', 'span', 'p', 'b', 'i', 'section')
+
+def default_depth(elements: int, fanout: int) -> int:
+    ''' The depth of the smallest complete 'fanout'-ary tree holding 'elements' elements. '''
+    if fanout <= 1:
+        return elements
+
+    depth, capacity, level = 1, 1, 1
+    while capacity < elements:
+        level *= fanout
+        capacity += level
+        depth += 1
+
+    return depth
+
+def iter_html(elements: int, fanout: int = 8, depth: Optional[int] = None, tags: Sequence[str] = DEFAULT_TAGS, classes: int = 0) -> Iterator[str]:
+    ''' A synthetic document of exactly 'elements' elements below <body>, as a sequence of tags.
+
+    Subtrees are complete 'fanout'-ary trees of at most 'depth' levels, laid out in
+    pre-order; <body> takes as many of them as needed. Tags cycle through 'tags'.
+    With 'classes', elements also get class="item cN" with N cycling through 0 .. classes - 1. '''
+    if depth is None:
+        depth = default_depth(elements, fanout)
+
+    yield '<html><body>'
+    # Open elements: (tag, children opened so far)
+    stack = []
+    count = 0
+    while count < elements:
+        if stack != [] and (len(stack) >= depth or stack[-1][1] >= fanout):
+            yield f'</{stack.pop()[0]}>'
+            continue
+
+        tag = tags[count % len(tags)]
+        if stack != []:
+            stack[-1][1] += 1
+        stack.append([tag, 0])
+        yield f'<{tag} class="item c{count % classes}">' if classes else f'<{tag}>'
+        count += 1
+
+    while stack != []:
+        yield f'</{stack.pop()[0]}>'
+    yield '</body></html>'
+
+def generate_html(elements: int, fanout: int = 8, depth: Optional[int] = None, tags: Sequence[str] = DEFAULT_TAGS, classes: int = 0) -> str:
+    ''' The document of 'iter_html' as a string. '''
+    return ''.join(iter_html(elements, fanout=fanout, depth=depth, tags=tags, classes=classes))
+
+if __name__ == '__main__':
+    # Write a document to a file (for very large documents, eg. to feed --stream), e.g.
+    #   python -m benchmarks.synthetic --elements 10000000 --fanout 4 -o big.html
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--elements', type=int, default=10_000)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--depth', type=int)
+    parser.add_argument('--tags', type=str, nargs='+', default=list(DEFAULT_TAGS))
+    parser.add_argument('--classes', type=int, default=0)
+    parser.add_argument('-o', '--output', type=str, help='Output file (default: stdout).')
+    args = parser.parse_args()
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for part in iter_html(args.elements, fanout=args.fanout, depth=args.depth, tags=args.tags, classes=args.classes):
+            output.write(part)
+    finally:
+        if args.output:
+            output.close()
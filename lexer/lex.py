@@ -1,5 +1,5 @@
-from typing import List, Tuple
-from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from itertools import accumulate
 import re
 
 import lexer.token as token
@@ -7,192 +7,91 @@ import lexer.token as token
 class LexError(Exception):
     ...
 
-@dataclass
-class LexResult():
-    remaining_input: str
-    token: token.Token
-
-def unpack(input: str) -> bool:
-    return input[:1] == '*'
-
-def colon(input: str) -> bool:
-    return input[:1] == ':'
-
-def ellipsis(input: str) -> bool:
-    return input[:3] == '...'
-
-def brace(input: str) -> bool:
-    match list(input):
-        case [ '{', *_ ]:
-            return True
-        case [ '}', *_ ]:
-            return True
-    
-    return False
-
-def filter(input: str) -> bool:
-    return input[:len(token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH)] == token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH
-
-def string(input: str) -> bool:
-    assert len(input) > 0
-    return input[0] == '"'
-
-def tag(input: str) -> bool:
-    return (re.match('[a-z]', input) is not None)
-
-def bracket(input: str) -> bool:
-    assert len(input) > 0
-    return input[0] == '[' or input[0] == ']'
-
-def unification(input: str) -> bool:
-    assert len(input) > 0
-    return input[0] == '='
-
-def variable(input: str) -> bool:
-    assert len(input) > 0
-    return (re.match('[A-Z]', input) is not None)
-
-def consume_filter(input: str) -> Tuple[str, token.Token]:
-    if (filter := input[:len(token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH)]) == token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH:
-        return (input[len(filter):], token.Filter(filterType=token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH))
-
-    assert False, f'Unsupported filter: {input}'
-
-def consume_colon(input: str) -> Tuple[str, token.Token]:
-    assert len(input) >= 1
-    return (input[1:], token.Colon())
-
-def consume_ellipsis(input: str) -> Tuple[str, token.Token]:
-    assert len(input) >= 3
-    return (input[3:], token.Ellipsis())
-
-def consume_brace(input: str) -> Tuple[str, token.Token]:
-    match list(input):
-        case [ '{', *_ ]:
-            return (input[1:], token.LeftBrace())
-        case [ '}', *_ ]:
-            return (input[1:], token.RightBrace())
-    
-    raise LexError()
-
-def consume_string(input: str) -> Tuple[str, token.Token]:
-    # 'input' must at least be an empty string
-    assert len(input) >= 2
-    # TODO: Handle escaped quotes 
-    match = re.match(r'"(.*?)"', input)
-    if match is None:
-        raise LexError()
-    
-    remainder = input[match.end(0):]
-    string = token.String(value=match.group(0)[1:-1])
-
-    return (remainder, string)
-
-def consume_unification(input: str) -> Tuple[str, token.Token]:
-    assert len(input) > 0
-    assert input[0] == '='
-
-    return (input[1:], token.Unification())
-
-def consume_paren(input: str) -> Tuple[str, token.Token]:
-    assert len(input) > 0
-    ch = input[0]
-
-    if ch == '(':
-        return (input[1:], token.LeftParen())
-    elif ch == ')':
-        return (input[1:], token.RightParen())
-    else:
-        assert False, "'ch' is not a parenthesis."
-
-def consume_wildcard(input: str) -> Tuple[str, token.Token]:
-    assert len(input) > 0
-    assert input[0] == '_'
-
-    return (input[1:], token.Wildcard())
-
-def consume_tag(input: str) -> Tuple[str, token.Token]:
-    assert len(input) > 0
-
-    idx = 0
-    while tag(input[idx:]):
-        idx += 1
-    
-    tag_str = input[:idx]
-    assert tag_str != ''
-
-    return (input[idx:], token.TagName(name=tag_str))
-
-def consume_variable(input: str) -> Tuple[str, token.Token]:
-    assert len(input) > 0
-
-    remainder, tag = consume_tag(input[0].lower() + input[1:])
-    var = token.Variable(name=tag.name.title())
-
-    return remainder, var
-
-def consume_comma(input: str) -> Tuple[str, token.Token]:
-    assert len(input) > 0
-    assert input[0] == ','
-
-    return (input[1:], token.CommaDelimiter())
-
-def consume_bracket(input: str) -> Tuple[str, token.Token]:
-    assert len(input) > 0
-    ch = input[0]
-
-    if ch == '[':
-        return (input[1:], token.LeftBracket())
-    elif ch == ']':
-        return (input[1:], token.RightBracket())
-    else:
-        assert False, "'ch' is not a bracket."
-
-def consume_unpack(input: str) -> Tuple[str, token.Token]:
-    assert len(input) > 0
-    if input[0] == '*':
-        return (input[1:], token.UnpackOperator())
-    else:
-        raise LexError('Expected unpack symbol.')
+class Span(NamedTuple):
+    ''' Offsets of a token in the lexed input: input[start:end] '''
+    start: int
+    end: int
+
+# Tokens that carry no value (or always the same one), so every occurrence shares one token instance.
+PUNCTUATION: Dict[str, token.Token] = {
+    '(': token.LeftParen(),
+    ')': token.RightParen(),
+    '[': token.LeftBracket(),
+    ']': token.RightBracket(),
+    '{': token.LeftBrace(),
+    '}': token.RightBrace(),
+    ',': token.CommaDelimiter(),
+    '=': token.Unification(),
+    ';': token.Semicolon(),
+    ':': token.Colon(),
+    '*': token.UnpackOperator(),
+    '_': token.Wildcard(),
+    '...': token.Ellipsis(),
+    '..>': token.Filter(filterType=token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH),
+}
+
+# The text of every token, and any other non-space character (an error), in one alternation; whitespace
+# between them is skipped. Tag names are lowercase letters; variables are a capital letter followed by
+# lowercase letters ("TagName" is two variables).
+# TODO: Handle escaped quotes
+TOKEN_PATTERN = re.compile(r'''
+    [a-z]+
+  | [A-Z][a-z]*
+  | "[^"\n]*"
+  | \.\.>
+  | \.\.\.
+  | [()\[\]{},=;:*_]
+  | \S
+''', re.VERBOSE)
+
+# The same, capturing each token so splitting on it keeps them
+SPLIT_PATTERN = re.compile(f'({TOKEN_PATTERN.pattern})', re.VERBOSE)
+
+def line_column(input: str, offset: int) -> Tuple[int, int]:
+    ''' 1-based line and column of 'offset' in 'input', for error messages. '''
+    line = input.count('\n', 0, offset) + 1
+    column = offset - (input.rfind('\n', 0, offset) + 1) + 1
+    return (line, column)
+
+def new_token(text: str) -> Optional[token.Token]:
+    ''' The token of a text matched by TOKEN_PATTERN (other than punctuation), or None if it isn't one. '''
+    first = text[0]
+    if 'a' <= first <= 'z':
+        return token.TagName(name=text)
+    if 'A' <= first <= 'Z':
+        return token.Variable(name=text)
+    if first == '"' and len(text) > 1:
+        return token.String(value=text[1:-1])
+    return None
+
+def lex_error(input: str, offset: int) -> LexError:
+    line, column = line_column(input, offset)
+    return LexError(f'Unexpected {input[offset]!r} at line {line}, column {column}.')
+
+def lex_offsets(input: str) -> Tuple[List[token.Token], List[int], List[int]]:
+    ''' Lex 'input' in a single pass, returning the tokens and where each starts and ends (input[start:end]).
+
+    Tokens with the same text are one instance, like punctuation, so offsets are kept in parallel lists. '''
+    # Split into [ space, token, space, token, ..., space ]: the running total of their lengths is every offset
+    parts = SPLIT_PATTERN.split(input)
+    offsets = list(accumulate(map(len, parts)))
+    texts = parts[1::2]
+
+    known = dict(PUNCTUATION)
+    for text in set(texts).difference(known):
+        known[text] = new_token(text)
+    tokens = list(map(known.__getitem__, texts))
+
+    starts, ends = offsets[0:-1:2], offsets[1::2]
+    if None in known.values():
+        raise lex_error(input, starts[tokens.index(None)])
+
+    return (tokens, starts, ends)
 
 def lex(input: str) -> List[token.Token]:
-    tokens = []
-    while input != '':
-        token = None
-        ch = input[0]
-
-        if ch == '(' or ch == ')':
-            input, token = consume_paren(input)
-        elif ch == ' ':
-            input = input[1:]
-        elif ch == '_':
-            input, token = consume_wildcard(input)
-        elif ch == ',':
-            input, token = consume_comma(input)
-        elif tag(input):
-            input, token = consume_tag(input)
-        elif bracket(input):
-            input, token = consume_bracket(input)
-        elif unification(input):
-            input, token = consume_unification(input)
-        elif variable(input):
-            input, token = consume_variable(input)
-        elif string(input):
-            input, token = consume_string(input)
-        elif brace(input):
-            input, token = consume_brace(input)
-        elif ellipsis(input):
-            input, token = consume_ellipsis(input)
-        elif colon(input):
-            input, token = consume_colon(input)
-        elif filter(input):
-            input, token = consume_filter(input)
-        elif unpack(input):
-            input, token = consume_unpack(input)
-        else:
-            raise LexError()
-        
-        if token:
-            tokens.append(token)
-
-    return tokens
\ No newline at end of file
+    return lex_offsets(input)[0]
+
+def lex_spans(input: str) -> Tuple[List[token.Token], List[Span]]:
+    ''' Lex 'input', returning the tokens and the span of each. '''
+    tokens, starts, ends = lex_offsets(input)
+    return (tokens, list(map(Span, starts, ends)))
@@ -57,6 +57,11 @@ class RightBracket(Token):
 class Unification(Token):
     ...
 
+@dataclass
+class Semicolon(Token):
+    ''' Optional delimiter between the unifications of a rule set. '''
+    ...
+
 @dataclass
 class Variable(Token):
     name: str
@@ -27,7 +27,7 @@ class Ellipsis:
 
 @dataclass
 class Set:
-    members: List[Union[String, Ellipsis]]
+    members: List[Union[String, Ellipsis, Wildcard]]
     nodeType: str = ASTNodeType.SET.value
 
 @dataclass
@@ -45,6 +45,8 @@ class HTMLNode:
     attrs: List[HTMLAttribute]
     children: List['HTMLNode']
     nodeType: str = ASTNodeType.NODE.value
+    # (...) ..> (...): further conditions on the subtree of the element (left sides only)
+    filters: List['BinaryFilter'] = field(default_factory=list)
 
     @property
     def variable(self) -> bool:
@@ -1,4 +1,5 @@
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Type, Union
+from dataclasses import dataclass, field
 
 from parser import ast
 from lexer import lex
@@ -6,289 +7,295 @@ from lexer import token
 
 DictValue = Union[ast.String, ast.Wildcard, ast.Set]
 DictKey = ast.String
-DictEntry = Union[ast.Ellipsis, Tuple[DictKey, DictValue]]
+DictEntry = Union[ast.Ellipsis, ast.UnpackNode, ast.HTMLNode, Tuple[DictKey, DictValue]]
 
 class ParseError(Exception):
     ...
 
-def consume_balanced_token(left_match: token.Token, right_match: token.Token, tokens: List[token.Token]) -> Tuple[List[token.Token], List[token.Token]]:
-    ''' Return the body of a balanced token and the remainder after it. '''
-
-    assert len(tokens) >= 2
-    if tokens[0] != left_match:
-        raise ParseError()
-
-    stack = 0
-    body = None
-    for i in range(len(tokens)):
-        tok = tokens[i]
-        if isinstance(tok, type(left_match)):
-            stack += 1
-        elif isinstance(tok, type(right_match)):
-            stack -= 1
-            if stack == 0:
-                body = tokens[1:i]
-                break
-    
-    if body is None:
-        raise ParseError()
-    
-    return (body, tokens[i+1:])
+@dataclass(slots=True)
+class Cursor:
+    ''' A position in a token stream. Parsing advances it with one token of lookahead; nothing is copied. '''
+    tokens: List[token.Token]
+    pos: int = 0
+    # Where each token starts in the source it was lexed from, if known; used to locate errors
+    starts: Optional[List[int]] = None
+    source: Optional[str] = None
+    # The type of each token, then None for the end of input (see 'at')
+    types: List[Optional[Type[token.Token]]] = field(init=False)
 
-def parse_ellipsis(tokens: List[token.Token]) -> Tuple[ast.Ellipsis, List[token.Token]]:
-    if len(tokens) == 0:
-        raise ParseError()
+    def __post_init__(self):
+        self.types = list(map(type, self.tokens))
+        self.types.append(None)
 
-    if isinstance(tokens[0], token.Ellipsis):
-        return [ast.Ellipsis(), tokens[1:]]
-    
-    raise ParseError()
+    def peek(self) -> Optional[token.Token]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
 
-def parse_string(tokens: List[token.Token]) -> Tuple[ast.String, List[token.Token]]:
-    if len(tokens) == 0:
-        raise ParseError()
+    def at(self, token_type: Type[token.Token]) -> bool:
+        # Token classes don't subclass each other, so an exact type check suffices.
+        return self.types[self.pos] is token_type
 
-    if isinstance(tokens[0], token.String):
-        return [ast.String(value=tokens[0].value), tokens[1:]]
+    def advance(self) -> token.Token:
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
 
-    raise ParseError()
+    def expect(self, token_type: Type[token.Token], expected: str) -> token.Token:
+        if self.types[self.pos] is not token_type:
+            raise self.error(f'Expected {expected}')
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
 
-def parse_tag(tokens: List[token.Token]) -> Tuple[str, List[token.Token]]:
-    if len(tokens) == 0:
-        raise ParseError()
-    
-    if isinstance(tokens[0], token.TagName) or isinstance(tokens[0], token.Wildcard):
-        return (tokens[0].name, tokens[1:])
+    def remainder(self) -> List[token.Token]:
+        return self.tokens[self.pos:]
 
-    raise ParseError()
+    def location(self) -> str:
+        if self.source is None:
+            return f'token {self.pos}'
 
-def parse_variable(tokens: List[token.Token]) -> Tuple[str, List[token.Token]]:
-    if len(tokens) == 0:
-        raise ParseError()
-    
-    if isinstance(tokens[0], token.Variable):
-        return (tokens[0].name, tokens[1:])
-
-    raise ParseError()
-
-def parse_comma_delim(tokens: List[token.Token]) -> List[token.Token]:
-    if len(tokens) == 0:
-        raise ParseError()
-    if not isinstance(tokens[0], token.CommaDelimiter):
-        raise ParseError()
-    
-    return tokens[1:]
-
-def parse_colon(tokens: List[token.Token]) -> List[token.Token]:
-    if len(tokens) == 0:
-        raise ParseError('Expected colon')
-    if not isinstance(tokens[0], token.Colon):
-        raise ParseError('Expected colon')
-    
-    return tokens[1:]
+        offset = self.starts[self.pos] if self.pos < len(self.starts) else len(self.source)
+        line, column = lex.line_column(self.source, offset)
+        return f'line {line}, column {column}'
 
-def parse_wildcard(tokens: List[token.Token]) -> Tuple[ast.Wildcard, List[token.Token]]:
-    if tokens == []:
-        raise ParseError('Failed to parse wildcard: empty token list.')
-    
-    if type(tokens[0]) != token.Wildcard:
-        raise ParseError(f'Failed to parse wildcard: bad token {tokens[0]}')
-    
-    return (ast.Wildcard(), tokens[1:])
-
-def consume_unification(tokens: List[token.Token]) -> List[token.Token]:
-    if len(tokens) == 0:
-        raise ParseError()
-    if not isinstance(tokens[0], token.Unification):
-        raise ParseError()
-    
-    return tokens[1:]
+    def error(self, message: str) -> ParseError:
+        tok = self.peek()
+        found = 'end of input' if tok is None else repr(tok)
+        return ParseError(f'{message} at {self.location()}; got {found}.')
 
-def parse_set(tokens: List[token.Token]) -> Tuple[ast.Set, List[token.Token]]:
-    body, remainder = consume_balanced_token(left_match=token.LeftBrace(), right_match=token.RightBrace(), tokens=tokens)
+def source_cursor(input: str) -> Cursor:
+    tokens, starts, _ = lex.lex_offsets(input)
+    return Cursor(tokens=tokens, starts=starts, source=input)
 
-    body_types = [ type(token) for token in body ]
-    members = []
-    while body_types != []:
-        match body_types:
-            case [ token.String ]:
-                string, body = parse_string(body)
-                body_types = [ type(tok) for tok in body ]
-                members.append(string)
-            case [ token.Ellipsis ]:
-                ellipsis, body = parse_ellipsis(body)
-                body_types = [ type(tok) for tok in body ]
-                members.append(ellipsis)
-            case [ token.String, token.CommaDelimiter, *_ ]:
-                string, body = parse_string(body)
-                body = parse_comma_delim(body)
-                body_types = [ type(tok) for tok in body ]
-                members.append(string)
-            case [ token.Ellipsis, token.CommaDelimiter, *_ ]:
-                ellipsis, body = parse_ellipsis(body)
-                body = parse_comma_delim(body)
-                body_types = [ type(tok) for tok in body ]
-                members.append(ellipsis)
-            case _:
-                raise ParseError(f'Unexpected sequence when parsing set: {body}')
-
-    return [ast.Set(members=members), remainder]
-
-def parse_dict_key(tokens: List[token.Token]) -> Tuple[DictKey, List[token.Token]]:
-    return parse_string(tokens)
+# Grammar rules over a cursor
 
-def parse_dict_value(tokens: List[token.Token]) -> Tuple[DictValue, List[token.Token]]:
-    try:
-        return parse_string(tokens)
-    except ParseError:
-        ...
-    
-    try:
-        return parse_wildcard(tokens)
-    except ParseError:
-        ...
-    
-    try:
-        return parse_set(tokens)
-    except ParseError:
-        ...
-    
-    raise ParseError(f'Failed to parse dict value from tokens {tokens}')
+def read_ellipsis(cursor: Cursor) -> ast.Ellipsis:
+    cursor.expect(token.Ellipsis, 'ellipsis')
+    return ast.Ellipsis()
 
-def parse_dict_entry(tokens: List[token.Token]) -> Tuple[DictEntry, List[token.Token]]:
-    try:
-        return parse_ellipsis(tokens)
-    except:
-        ...
-
-    # WIP: Attempt unpack parsing here
-    try:
-        return parse_unpack_operator(tokens)
-    except:
-        ...
-
-    try:
-        var, tokens = parse_variable(tokens)
-        return (ast.HTMLNode(tag=var,attrs=[],children=[]), tokens)
-    except:
-        ...
-
-    try:
-        key, tokens = parse_dict_key(tokens)
-        tokens = parse_colon(tokens)
-        value, tokens = parse_dict_value(tokens)
-        return ((key,value), tokens)
-    except:
-        ...
-
-    raise ParseError(f'Failed to parse dict entry from tokens {tokens}')
+def read_string(cursor: Cursor) -> ast.String:
+    return ast.String(value=cursor.expect(token.String, 'string').value)
 
-def parse_dict(tokens: List[token.Token]) -> Tuple[ast.Dict, List[token.Token]]:
-    body, remainder = consume_balanced_token(left_match=token.LeftBrace(), right_match=token.RightBrace(), tokens=tokens)
-    values = []
+def read_tag(cursor: Cursor) -> str:
+    if cursor.at(token.TagName) or cursor.at(token.Wildcard):
+        return cursor.advance().name
 
-    while body != []:
-        val, body = parse_dict_entry(body)
-        values.append(val)
-
-        if body != []:
-            body = parse_comma_delim(body)
-            if body == []:
-                raise ParseError('Failed to parse dict: trailing comma')
-    
-    return (ast.Dict(members=values), remainder)
-    
-def parse_attributes(tokens: List[token.Token]) -> Tuple[List[ast.HTMLAttribute], List[token.Token]]:
-    # TODO: Correctly parse
-    try:
-        _,tokens = parse_wildcard(tokens)
-        return [[ast.Wildcard()],tokens]
-    except ParseError:
-        ...
+    raise cursor.error('Expected tag name')
 
-    body, tokens = consume_balanced_token(token.LeftBrace(), token.RightBrace(), tokens)
-    return body, tokens
+def read_variable(cursor: Cursor) -> str:
+    return cursor.expect(token.Variable, 'variable').name
 
-def parse_children(tokens: List[token.Token]) -> Tuple[List[ast.HTMLNode], List[token.Token]]:
-    assert len(tokens) > 0
+def read_wildcard(cursor: Cursor) -> ast.Wildcard:
+    cursor.expect(token.Wildcard, 'wildcard')
+    return ast.Wildcard()
+
+def read_set(cursor: Cursor) -> ast.Set:
+    cursor.expect(token.LeftBrace, "'{'")
+    members = []
+    while not cursor.at(token.RightBrace):
+        if cursor.at(token.String):
+            members.append(read_string(cursor))
+        elif cursor.at(token.Ellipsis):
+            members.append(read_ellipsis(cursor))
+        elif cursor.at(token.Wildcard):
+            members.append(read_wildcard(cursor))
+        else:
+            raise cursor.error('Expected string, wildcard or ellipsis in set')
+
+        if not cursor.at(token.RightBrace):
+            cursor.expect(token.CommaDelimiter, "',' or '}'")
+
+    cursor.advance()
+    return ast.Set(members=members)
+
+def read_dict_value(cursor: Cursor) -> DictValue:
+    if cursor.at(token.String):
+        return read_string(cursor)
+    if cursor.at(token.Wildcard):
+        return read_wildcard(cursor)
+    if cursor.at(token.LeftBrace):
+        return read_set(cursor)
+
+    raise cursor.error('Expected string, wildcard or set as dict value')
+
+def read_unpack_operator(cursor: Cursor) -> ast.UnpackNode:
+    cursor.expect(token.UnpackOperator, "'*'")
+    name = read_variable(cursor)
+    return ast.UnpackNode(variable=ast.HTMLNode(tag=name, attrs=[], children=[]))
+
+def read_dict_entry(cursor: Cursor) -> DictEntry:
+    if cursor.at(token.Ellipsis):
+        return read_ellipsis(cursor)
+    if cursor.at(token.UnpackOperator):
+        return read_unpack_operator(cursor)
+    if cursor.at(token.Variable):
+        return ast.HTMLNode(tag=read_variable(cursor), attrs=[], children=[])
+    if cursor.at(token.String):
+        key = read_string(cursor)
+        cursor.expect(token.Colon, "':'")
+        return (key, read_dict_value(cursor))
+
+    raise cursor.error('Expected dict entry')
+
+def read_dict(cursor: Cursor) -> ast.Dict:
+    cursor.expect(token.LeftBrace, "'{'")
+    values = []
+    while not cursor.at(token.RightBrace):
+        values.append(read_dict_entry(cursor))
 
-    if isinstance(tokens[0], token.Variable):
+        if not cursor.at(token.RightBrace):
+            cursor.expect(token.CommaDelimiter, "',' or '}'")
+            if cursor.at(token.RightBrace):
+                raise cursor.error('Failed to parse dict: trailing comma')
+
+    cursor.advance()
+    return ast.Dict(members=values)
+
+def read_children(cursor: Cursor) -> List[ast.HTMLNode]:
+    if cursor.at(token.Variable):
         # TODO: Should really return the var ast here
-        name, remainder = parse_variable(tokens)
-        return [ast.HTMLNode(tag=name, attrs=[], children=[])], remainder
+        return [ast.HTMLNode(tag=read_variable(cursor), attrs=[], children=[])]
     # TODO: Should really treat wildcard as a variable
-    elif isinstance(tokens[0], token.Wildcard):
-        name, remainder = parse_tag(tokens)
-        return [ast.HTMLNode(tag=name, attrs=[], children=[])], remainder
+    if cursor.at(token.Wildcard):
+        return [ast.HTMLNode(tag=read_tag(cursor), attrs=[], children=[])]
 
-    body, remainder = consume_balanced_token(token.LeftBracket(), token.RightBracket(), tokens)
+    cursor.expect(token.LeftBracket, "'[', variable or wildcard as children")
     nodes = []
-    # In this body, parse all nodes.
-    while body != []:
-        node, body = parse_node(body)
-        nodes.append(node)
-        if body != []:
-            body = parse_comma_delim(body)
+    while not cursor.at(token.RightBracket):
+        nodes.append(read_node(cursor))
+        if not cursor.at(token.RightBracket):
+            cursor.expect(token.CommaDelimiter, "',' or ']'")
+
+    cursor.advance()
+    return nodes
+
+def read_node(cursor: Cursor) -> ast.HTMLNode:
+    cursor.expect(token.LeftParen, "'('")
+    if cursor.at(token.RightParen):
+        cursor.advance()
+        return ast.HTMLNode(tag=None, attrs=[], children=[])
+
+    if cursor.at(token.Variable):
+        tag = read_variable(cursor)
+    elif cursor.at(token.TagName) or cursor.at(token.Wildcard):
+        tag = read_tag(cursor)
+    else:
+        raise cursor.error('Expected tag name or variable')
 
-    return nodes, remainder
+    cursor.expect(token.CommaDelimiter, "','")
 
-def parse_node(tokens: List[token.Token]) -> Tuple[ast.HTMLNode, List[token.Token]]:
-    body, remainder = consume_balanced_token(token.LeftParen(), token.RightParen(), tokens)
+    # TODO: Consider serialized form of dict more carefully...
+    if cursor.at(token.Variable):
+        attrs = [ast.HTMLNode(tag=read_variable(cursor), attrs=[], children=[])]
+    else:
+        attrs = read_dict(cursor).members
 
-    if body == []:
-        return ast.HTMLNode(tag=None, attrs=[], children=[]), remainder
+    cursor.expect(token.CommaDelimiter, "','")
+    children = read_children(cursor)
+    cursor.expect(token.RightParen, "')'")
 
-    if isinstance(body[0], token.Variable):
-        tag, body = parse_variable(body)
-    elif isinstance(body[0], token.TagName) or isinstance(body[0], token.Wildcard):
-        tag, body = parse_tag(body)
-    else:
-        raise ParseError(f'Expected tag name or variable; got {body[0]}')
+    # (...) ..> (...) ..> (...): each filter's node may have filters of its own, so the chain nests to the right
+    filters = []
+    if cursor.at(token.Filter):
+        filters.append(read_binary_op(cursor))
 
-    body = parse_comma_delim(body)
-    attrs = []
+    return ast.HTMLNode(tag=tag, attrs=attrs, children=children, filters=filters)
 
-    try:
-        #attrs, body = parse_attributes(body)    # [] literal for now.
-        # TODO: Attempt to parse attributes as a _variable_ first!
-        var, body = parse_variable(body)
-        attrs = [ast.HTMLNode(tag=var,attrs=[],children=[])]
-    except:
-        attrs, body = parse_dict(body)    # [] literal for now.
-        attrs = attrs.members
+def read_binary_op(cursor: Cursor) -> ast.BinaryFilter:
+    filter_type = cursor.expect(token.Filter, 'filter').filterType
+    return ast.BinaryFilter(filter_type=filter_type, right_arg=read_node(cursor))
 
-    body = parse_comma_delim(body)
-    children, body = parse_children(body)
+def read_unification(cursor: Cursor) -> ast.NodeUnification:
+    left_node = read_node(cursor)
+    cursor.expect(token.Unification, "'='")
+    right_node = read_node(cursor)
 
-    # TODO: Consider serialized form of dict more carefully...
-    return ast.HTMLNode(tag=tag, attrs=attrs, children=children), remainder
+    return ast.NodeUnification(left=left_node, right=right_node)
+
+def read_rules(cursor: Cursor) -> List[ast.NodeUnification]:
+    rules = []
+    while cursor.peek() is not None:
+        if cursor.at(token.Semicolon):
+            cursor.advance()
+            continue
+
+        rules.append(read_unification(cursor))
+
+    return rules
+
+# Token list API: each function parses from the start of 'tokens' and returns the unparsed remainder.
+
+def parse_ellipsis(tokens: List[token.Token]) -> Tuple[ast.Ellipsis, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_ellipsis(cursor), cursor.remainder())
+
+def parse_string(tokens: List[token.Token]) -> Tuple[ast.String, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_string(cursor), cursor.remainder())
+
+def parse_tag(tokens: List[token.Token]) -> Tuple[str, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_tag(cursor), cursor.remainder())
+
+def parse_variable(tokens: List[token.Token]) -> Tuple[str, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_variable(cursor), cursor.remainder())
+
+def parse_wildcard(tokens: List[token.Token]) -> Tuple[ast.Wildcard, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_wildcard(cursor), cursor.remainder())
+
+def parse_set(tokens: List[token.Token]) -> Tuple[ast.Set, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_set(cursor), cursor.remainder())
+
+def parse_dict_value(tokens: List[token.Token]) -> Tuple[DictValue, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_dict_value(cursor), cursor.remainder())
+
+def parse_dict_entry(tokens: List[token.Token]) -> Tuple[DictEntry, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_dict_entry(cursor), cursor.remainder())
+
+def parse_dict(tokens: List[token.Token]) -> Tuple[ast.Dict, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_dict(cursor), cursor.remainder())
+
+def parse_attributes(tokens: List[token.Token]) -> Tuple[List[ast.HTMLAttribute], List[token.Token]]:
+    cursor = Cursor(tokens)
+    if cursor.at(token.Wildcard):
+        return ([read_wildcard(cursor)], cursor.remainder())
+
+    return (read_dict(cursor).members, cursor.remainder())
+
+def parse_children(tokens: List[token.Token]) -> Tuple[List[ast.HTMLNode], List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_children(cursor), cursor.remainder())
+
+def parse_node(tokens: List[token.Token]) -> Tuple[ast.HTMLNode, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_node(cursor), cursor.remainder())
 
 def parse_binary_op(tokens: List[token.Token]) -> Tuple[ast.BinaryFilter, List[token.Token]]:
-    if not isinstance(tokens[0], token.Filter):
-        raise ParseError(f'Expected filter; got {tokens[0]}')
-    
-    node_pattern, remainder = parse_node(tokens[1:])
-    filter_ast = ast.BinaryFilter(filter_type=tokens[0].filterType, right_arg=node_pattern)
-
-    return (filter_ast, remainder)
-    
+    cursor = Cursor(tokens)
+    return (read_binary_op(cursor), cursor.remainder())
+
+def parse_unpack_operator(tokens: List[token.Token]) -> Tuple[ast.UnpackNode, List[token.Token]]:
+    cursor = Cursor(tokens)
+    return (read_unpack_operator(cursor), cursor.remainder())
+
 def parse_unification(tokens: List[token.Token]) -> ast.NodeUnification:
-    left_node, tokens = parse_node(tokens)
-    tokens = consume_unification(tokens)
-    right_node, tokens = parse_node(tokens)
+    return read_unification(Cursor(tokens))
 
-    return ast.NodeUnification(left=left_node, right=right_node)
+def parse_rules(tokens: List[token.Token]) -> List[ast.NodeUnification]:
+    ''' Parse a rule set: unifications delimited by whitespace or ';'. '''
+    return read_rules(Cursor(tokens))
+
+# Source API: errors report the line and column
+
+def parse_program(input: str) -> List[ast.NodeUnification]:
+    ''' Lex and parse the rule set in 'input'. '''
+    return read_rules(source_cursor(input))
 
 def parse(input: str) -> ast.HTMLNode:
-    tokens = lex.lex(input)
     # Initially, _only_ parse nodes of the form (tag,[],[])
-    node, _ = parse_node(tokens)
-    return node
-
-def parse_unpack_operator(tokens: List[token.Token]) -> Tuple[ast.UnpackNode, List[token.Token]]:
-    token_types = [ type(t) for t in tokens ]
-    match token_types:
-        case [token.UnpackOperator, token.Variable, *_]:
-            return [ast.UnpackNode(variable=ast.HTMLNode(tag=tokens[1].name, attrs=[], children=[])), tokens[2:]]
-    
-    raise ParseError(f'Failed to parse unpack operator: {tokens}')
+    return read_node(source_cursor(input))
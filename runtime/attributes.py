@@ -0,0 +1,97 @@
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+from dataclasses import dataclass
+
+import parser.ast as ast
+
+# Attributes whose whitespace separated tokens are indexed (see runtime.index)
+TOKEN_ATTRIBUTES = frozenset(['class'])
+
+@dataclass(frozen=True)
+class SetPattern:
+    ''' A compiled set pattern, e.g. {"foo", _, ...} (see "Set patterns" in the README). '''
+    members: FrozenSet[str]
+    # Each _ requires one more value than 'members' accounts for
+    wildcards: int = 0
+    # Whether the pattern contains ..., ie the set may have other values too
+    fuzzy: bool = False
+
+    def matches(self, values: FrozenSet[str]) -> bool:
+        if not self.members <= values:
+            return False
+
+        size = len(self.members) + self.wildcards
+        return len(values) >= size if self.fuzzy else len(values) == size
+
+@dataclass(frozen=True)
+class AttributePattern:
+    ''' The constraints of a left side dict on an element's attributes.
+
+    Every key in the dict must be set. Dicts are open: attributes not in the dict are ignored. '''
+    # "name": "value" (multi-valued attributes are compared space separated)
+    values: Tuple[Tuple[str, str], ...] = ()
+    # "name": _
+    present: FrozenSet[str] = frozenset()
+    # "name": {...}
+    sets: Tuple[Tuple[str, SetPattern], ...] = ()
+
+    @property
+    def names(self) -> FrozenSet[str]:
+        return self.present | { name for name, _ in self.values } | { name for name, _ in self.sets }
+
+    @property
+    def tokens(self) -> FrozenSet[Tuple[str, str]]:
+        ''' (name, token) pairs every match has, for the attributes in TOKEN_ATTRIBUTES. '''
+        return frozenset(
+            (name, member)
+            for name, pattern in self.sets if name in TOKEN_ATTRIBUTES
+            for member in pattern.members)
+
+    def matches(self, attrs: Mapping[str, Any]) -> bool:
+        ''' Match attribute values as found in a tree (strings or lists of strings) or in markup. '''
+        for name, value in self.values:
+            if name not in attrs or value_string(attrs[name]) != value:
+                return False
+        for name in self.present:
+            if name not in attrs:
+                return False
+        for name, pattern in self.sets:
+            if name not in attrs or not pattern.matches(value_tokens(attrs[name])):
+                return False
+        return True
+
+def value_string(value: Any) -> str:
+    return ' '.join(value) if isinstance(value, list) else value
+
+def value_tokens(value: Any) -> FrozenSet[str]:
+    return frozenset(value) if isinstance(value, list) else frozenset(value.split())
+
+def compile_set(pattern: ast.Set) -> SetPattern:
+    members = [ member.value for member in pattern.members if isinstance(member, ast.String) ]
+    return SetPattern(
+        members=frozenset(members),
+        wildcards=sum(1 for member in pattern.members if isinstance(member, ast.Wildcard)),
+        fuzzy=any(isinstance(member, ast.Ellipsis) for member in pattern.members))
+
+def compile_attribute_pattern(attrs: List) -> Optional[AttributePattern]:
+    ''' The constraints in the left side dict 'attrs', or None if it has none (eg {} or a variable). '''
+    values: Dict[str, str] = {}
+    present = set()
+    sets: Dict[str, SetPattern] = {}
+
+    for entry in attrs:
+        # Variables, unpacks and ellipses don't constrain anything
+        if not isinstance(entry, (tuple, list)):
+            continue
+
+        key, value = entry
+        if isinstance(value, ast.String):
+            values[key.value] = value.value
+        elif isinstance(value, ast.Wildcard):
+            present.add(key.value)
+        elif isinstance(value, ast.Set):
+            sets[key.value] = compile_set(value)
+
+    if values == {} and present == set() and sets == {}:
+        return None
+
+    return AttributePattern(values=tuple(values.items()), present=frozenset(present), sets=tuple(sets.items()))
@@ -0,0 +1,298 @@
+from typing import Any, BinaryIO, Dict, FrozenSet, Iterable, List, Optional
+
+from bs4 import BeautifulSoup, Tag
+
+from runtime import splice
+
+# A parsed document (BeautifulSoup, lxml ElementTree, ...) and its elements
+Document = Any
+Element = Any
+
+class BackendException(Exception):
+    ...
+
+class Backend:
+    ''' The tree operations the runtime needs, implemented for one kind of HTML tree. '''
+    name: str
+
+    def parse(self, html: str) -> Document:
+        ''' Parse 'html'; the result is the root passed to unify_tree. '''
+        raise NotImplementedError()
+
+    def serialize(self, document: Document, pretty: bool = True) -> str:
+        raise NotImplementedError()
+
+    def write(self, document: Document, output: BinaryIO):
+        ''' Write 'document' to 'output' as UTF-8, not prettified. '''
+        output.write(self.serialize(document, pretty=False).encode('utf-8'))
+
+    def tag(self, node: Element) -> str:
+        raise NotImplementedError()
+
+    def element_children(self, node: Element) -> List[Element]:
+        raise NotImplementedError()
+
+    def parent(self, node: Element) -> Optional[Element]:
+        ''' The element or document 'node' is an element child of, or None for the document. '''
+        raise NotImplementedError()
+
+    def has_element_children(self, node: Element) -> bool:
+        raise NotImplementedError()
+
+    def descendants(self, node: Element) -> Iterable[Element]:
+        ''' Elements below 'node' in document order. '''
+        raise NotImplementedError()
+
+    def new_element(self, document: Document, tag: str) -> Element:
+        raise NotImplementedError()
+
+    def attributes(self, node: Element) -> Dict[str, Any]:
+        raise NotImplementedError()
+
+    def attribute(self, node: Element, name: str) -> Optional[str]:
+        ''' The value of attribute 'name' (multi-valued attributes space separated), or None if it isn't set. '''
+        raise NotImplementedError()
+
+    def attribute_tokens(self, node: Element, name: str) -> Optional[FrozenSet[str]]:
+        ''' The whitespace separated values of attribute 'name', or None if it isn't set. '''
+        raise NotImplementedError()
+
+    def set_attributes(self, node: Element, attributes: Dict[str, Any]):
+        ''' Replace all attributes of 'node'. '''
+        raise NotImplementedError()
+
+    def rename(self, document: Document, node: Element, tag: str):
+        raise NotImplementedError()
+
+    def drop_text(self, node: Element):
+        ''' Remove everything directly below 'node' that isn't an element (text, comments, ...). '''
+        raise NotImplementedError()
+
+    def append(self, parent: Element, child: Element):
+        raise NotImplementedError()
+
+    def extend(self, parent: Element, children: List[Element]):
+        ''' Move 'children' below 'parent'. Text between them stays behind. '''
+        raise NotImplementedError()
+
+    def replace(self, node: Element, new_node: Element):
+        raise NotImplementedError()
+
+    def delete(self, node: Element):
+        raise NotImplementedError()
+
+    def compatible(self, other: 'Backend') -> bool:
+        ''' Whether programs compiled for 'other' run on this backend's trees. '''
+        return type(self) == type(other)
+
+class BS4Backend(Backend):
+    ''' BeautifulSoup trees, built by any of the parsers bs4 supports. '''
+
+    def __init__(self, parser: str = 'html.parser'):
+        self.parser = parser
+        self.name = parser
+
+    def parse(self, html: str) -> BeautifulSoup:
+        try:
+            return BeautifulSoup(html, self.parser)
+        except Exception as e:
+            # bs4 raises FeatureNotFound when the parser isn't installed
+            raise BackendException(f'Backend {self.name} is unavailable: {e}')
+
+    def serialize(self, document: BeautifulSoup, pretty: bool = True) -> str:
+        return document.prettify() if pretty else str(document)
+
+    def write(self, document: BeautifulSoup, output: BinaryIO):
+        # In chunks rather than as one string
+        splice.write(document, output)
+
+    def tag(self, node: Tag) -> str:
+        return node.name
+
+    def element_children(self, node: Tag) -> List[Tag]:
+        return [ child for child in node.contents if isinstance(child, Tag) ]
+
+    def parent(self, node: Tag) -> Optional[Tag]:
+        return node.parent
+
+    def has_element_children(self, node: Tag) -> bool:
+        for child in node.contents:
+            if isinstance(child, Tag):
+                return True
+        return False
+
+    def descendants(self, node: Tag) -> Iterable[Tag]:
+        return ( child for child in node.descendants if isinstance(child, Tag) )
+
+    def new_element(self, document: BeautifulSoup, tag: str) -> Tag:
+        return document.new_tag(tag)
+
+    def attributes(self, node: Tag) -> Dict[str, Any]:
+        return dict(node.attrs)
+
+    def attribute(self, node: Tag, name: str) -> Optional[str]:
+        value = node.attrs.get(name)
+        # The tree builder splits multi-valued attributes (class, rel, ...) into lists
+        return ' '.join(value) if isinstance(value, list) else value
+
+    def attribute_tokens(self, node: Tag, name: str) -> Optional[FrozenSet[str]]:
+        value = node.attrs.get(name)
+        if value is None:
+            return None
+        return frozenset(value) if isinstance(value, list) else frozenset(value.split())
+
+    def set_attributes(self, node: Tag, attributes: Dict[str, Any]):
+        node.attrs = dict(attributes)
+
+    def rename(self, document: BeautifulSoup, node: Tag, tag: str):
+        node.name = tag
+        # Decided by the tree builder when a tag is created (<br/> vs <b></b>)
+        node.can_be_empty_element = document.builder.can_be_empty_element(tag)
+
+    def drop_text(self, node: Tag):
+        for child in [ child for child in node.contents if not isinstance(child, Tag) ]:
+            child.extract()
+
+    def append(self, parent: Tag, child: Tag):
+        parent.append(child)
+
+    def extend(self, parent: Tag, children: List[Tag]):
+        parent.extend(children)
+
+    def replace(self, node: Tag, new_node: Tag):
+        node.replace_with(new_node)
+
+    def delete(self, node: Tag):
+        node.decompose()
+
+class LXMLBackend(Backend):
+    ''' Native lxml.html trees (requires lxml). The document root is the ElementTree. '''
+    name = 'lxml'
+
+    def __init__(self):
+        try:
+            from lxml import etree, html
+        except ImportError:
+            self.etree = self.html = None
+        else:
+            self.etree, self.html = etree, html
+
+    def require(self):
+        if self.etree is None:
+            raise BackendException('Backend lxml is unavailable: lxml is not installed.')
+
+    def parse(self, html: str) -> Document:
+        self.require()
+        return self.html.document_fromstring(html).getroottree()
+
+    def serialize(self, document: Document, pretty: bool = True) -> str:
+        return self.html.tostring(document, pretty_print=pretty, encoding='unicode')
+
+    def tag(self, node: Element) -> str:
+        return node.tag
+
+    def element_children(self, node: Element) -> List[Element]:
+        if isinstance(node, self.etree._ElementTree):
+            return [ node.getroot() ]
+        # Comments and processing instructions have a non-string tag
+        return [ child for child in node if isinstance(child.tag, str) ]
+
+    def parent(self, node: Element) -> Optional[Element]:
+        if isinstance(node, self.etree._ElementTree):
+            return None
+        parent = node.getparent()
+        # The root element is the only element child of its tree
+        return node.getroottree() if parent is None else parent
+
+    def has_element_children(self, node: Element) -> bool:
+        for child in node:
+            if isinstance(child.tag, str):
+                return True
+        return False
+
+    def descendants(self, node: Element) -> Iterable[Element]:
+        if isinstance(node, self.etree._ElementTree):
+            return node.getroot().iter(self.etree.Element)
+        return node.iterdescendants(self.etree.Element)
+
+    def new_element(self, document: Document, tag: str) -> Element:
+        return self.html.Element(tag)
+
+    def attributes(self, node: Element) -> Dict[str, Any]:
+        return dict(node.attrib)
+
+    def attribute(self, node: Element, name: str) -> Optional[str]:
+        return node.get(name)
+
+    def attribute_tokens(self, node: Element, name: str) -> Optional[FrozenSet[str]]:
+        value = node.get(name)
+        return None if value is None else frozenset(value.split())
+
+    def set_attributes(self, node: Element, attributes: Dict[str, Any]):
+        node.attrib.clear()
+        for name, value in attributes.items():
+            node.set(name, ' '.join(value) if isinstance(value, list) else value)
+
+    def rename(self, document: Document, node: Element, tag: str):
+        node.tag = tag
+
+    def drop_text(self, node: Element):
+        node.text = None
+        for child in list(node):
+            # Tails are text of 'node'
+            child.tail = None
+            if not isinstance(child.tag, str):
+                node.remove(child)
+
+    def append(self, parent: Element, child: Element):
+        parent.append(child)
+
+    def extend(self, parent: Element, children: List[Element]):
+        for child in children:
+            # The tail is text of the old parent; bs4 trees leave it behind too.
+            child.tail = None
+            parent.append(child)
+
+    def replace(self, node: Element, new_node: Element):
+        new_node.tail = node.tail
+        parent = node.getparent()
+        if parent is None:
+            node.getroottree()._setroot(new_node)
+        else:
+            parent.replace(node, new_node)
+
+    def delete(self, node: Element):
+        parent = node.getparent()
+        if parent is None:
+            raise BackendException('The document root cannot be deleted.')
+
+        # lxml drops an element's tail with it; keep the text that follows it.
+        if node.tail:
+            previous = node.getprevious()
+            if previous is None:
+                parent.text = (parent.text or '') + node.tail
+            else:
+                previous.tail = (previous.tail or '') + node.tail
+        parent.remove(node)
+
+BS4 = BS4Backend()
+LXML = LXMLBackend()
+
+BACKENDS: Dict[str, Backend] = {
+    'html.parser': BS4,
+    'html5lib': BS4Backend('html5lib'),
+    'lxml': LXML,
+}
+
+def get_backend(name: str) -> Backend:
+    if name not in BACKENDS:
+        raise BackendException(f'Unknown backend {name}; expected one of {", ".join(BACKENDS)}.')
+    return BACKENDS[name]
+
+def backend_for(node: Any) -> Backend:
+    ''' The backend that operates on the tree 'node' belongs to. '''
+    if isinstance(node, Tag):
+        return BS4
+    if LXML.etree is not None and isinstance(node, (LXML.etree._Element, LXML.etree._ElementTree)):
+        return LXML
+    raise BackendException(f'No backend for {type(node).__name__} trees.')
@@ -0,0 +1,266 @@
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import dataclasses
+
+import orjson
+
+import parser.ast as ast
+from runtime.backend import BS4, Backend, Document, Element, backend_for
+from runtime.matcher import Program, RuleSet, compile_rules
+
+# Edit scripts: what a rule set changed in a document, instead of the rewritten document.
+#
+# A recorded rule set (see 'record') reports every rewrite as it makes it, in the order it makes them:
+#
+#   {"op": "delete", "rule": 0, "path": [0, 1, 3]}
+#   {"op": "update", "rule": 1, "path": [0, 1, 2], "tag": "em", "attrs": {"class": ["x"]}}
+#   {"op": "replace", "rule": 2, "path": [0, 1, 0], "node": {"tag": "section", "attrs": {}, "children": [{"moved": [0]}]}}
+#
+# A path gives the position of an element among the element children of its parent, from the document down, in
+# the document as it was when the edit was made; so edits have to be applied in order (see 'apply'). 'update'
+# renames the element, replaces its attributes and drops the text directly below it, like an in-place rewrite.
+# 'replace' puts a new element in its place, built as described by 'node'; {"moved": path} stands for an element
+# of the replaced one (by its path below it), moved there with its subtree. Nothing else of the replaced element
+# is kept. The size of a script is proportional to the rewrites it records, not to the document.
+
+Edit = Dict[str, Any]
+# Called with each edit as it is made
+Emit = Callable[[Edit], None]
+
+class EditException(Exception):
+    ...
+
+class Siblings:
+    ''' The element children of a parent, numbered once. Deleting or replacing one of them updates the numbering. '''
+
+    def __init__(self, children: List[Element]):
+        self.children = children
+        self.numbers = { id(child): number for number, child in enumerate(children) }
+        # A Fenwick tree over the numbers of the deleted children, so a position is log(children) steps away
+        self.deleted = [ 0 ] * (len(children) + 1)
+
+    def position(self, node: Element) -> Optional[int]:
+        ''' The position of 'node' among the current children, or None if it isn't one of the numbered ones. '''
+        number = self.numbers.get(id(node))
+        if number is None or self.children[number] is not node:
+            return None
+
+        position, i = number, number
+        while i > 0:
+            position -= self.deleted[i]
+            i &= i - 1
+        return position
+
+    def delete(self, node: Element):
+        number = self.numbers.pop(id(node))
+        i = number + 1
+        while i < len(self.deleted):
+            self.deleted[i] += 1
+            i += i & -i
+
+    def replace(self, node: Element, new_node: Element):
+        number = self.numbers.pop(id(node))
+        self.children[number] = new_node
+        self.numbers[id(new_node)] = number
+
+class Positions:
+    ''' The sibling numbering of every parent 'paths' has seen, kept current by reporting deletes and replacements.
+
+    A recorded rule set keeps one across its edits, so each parent is numbered once rather than once per edit. '''
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        # id(parent) -> (parent, its numbered children)
+        self.parents: Dict[int, Tuple[Element, Siblings]] = {}
+
+    def position(self, parent: Element, node: Element) -> int:
+        entry = self.parents.get(id(parent))
+        position = entry[1].position(node) if entry is not None and entry[0] is parent else None
+        if position is None:
+            # Not numbered yet, or changed by something that wasn't reported
+            entry = self.parents[id(parent)] = (parent, Siblings(self.backend.element_children(parent)))
+            position = entry[1].position(node)
+        return position
+
+    def siblings(self, node: Element) -> Optional[Siblings]:
+        parent = self.backend.parent(node)
+        entry = self.parents.get(id(parent)) if parent is not None else None
+        if entry is None or entry[0] is not parent or entry[1].position(node) is None:
+            return None
+        return entry[1]
+
+    def deleted(self, node: Element):
+        ''' Report that 'node' is about to be deleted. '''
+        siblings = self.siblings(node)
+        if siblings is not None:
+            siblings.delete(node)
+
+    def replaced(self, node: Element, new_node: Element):
+        ''' Report that 'node' is about to be replaced by 'new_node'. '''
+        siblings = self.siblings(node)
+        if siblings is not None:
+            siblings.replace(node, new_node)
+
+def paths(backend: Backend, elements: Iterable[Element], root: Optional[Element] = None, positions: Optional[Positions] = None) -> List[List[int]]:
+    ''' The path of each of 'elements' below 'root', or below the document if 'root' is None. '''
+    # Siblings number their parent once
+    positions = positions or Positions(backend)
+    result = []
+    for element in elements:
+        path = []
+        node = element
+        while node is not root:
+            parent = backend.parent(node)
+            if parent is None:
+                if root is not None:
+                    raise EditException(f'Element {backend.tag(element)} is not below {backend.tag(root)}.')
+                break
+
+            path.append(positions.position(parent, node))
+            node = parent
+
+        path.reverse()
+        result.append(path)
+    return result
+
+def resolve(backend: Backend, root: Element, path: List[int]) -> Element:
+    ''' The element at 'path' below 'root'. '''
+    node = root
+    for position in path:
+        children = backend.element_children(node)
+        if not isinstance(position, int) or not 0 <= position < len(children):
+            raise EditException(f'No element at {path}.')
+        node = children[position]
+    return node
+
+def describe(backend: Backend, node: Element, moved: Dict[int, List[int]]) -> Dict:
+    ''' The 'node' of a 'replace' edit: built elements in full, moved ones by their path. '''
+    if id(node) in moved:
+        return { 'moved': moved[id(node)] }
+    children = [ describe(backend, child, moved) for child in backend.element_children(node) ]
+    return { 'tag': backend.tag(node), 'attrs': backend.attributes(node), 'children': children }
+
+class RecordingBackend:
+    ''' Delegates to 'backend', recording the elements one rule deletes. '''
+
+    def __init__(self, backend: Backend, emit: Emit, position: int, positions: Positions):
+        self.backend = backend
+        self.emit = emit
+        self.position = position
+        self.positions = positions
+
+    def __getattr__(self, name: str):
+        return getattr(self.backend, name)
+
+    def delete(self, node: Element):
+        path, = paths(self.backend, [ node ], positions=self.positions)
+        self.emit({ 'op': 'delete', 'rule': self.position, 'path': path })
+        self.positions.deleted(node)
+        self.backend.delete(node)
+
+    def compatible(self, other: Backend) -> bool:
+        return self.backend.compatible(other)
+
+def record_program(program: Program, emit: Emit, position: int, positions: Positions) -> Program:
+    backend = program.backend
+    bind, build, inplace = program.bind, program.build, program.inplace
+    tag, attributes = backend.tag, backend.attributes
+    recorded = dataclasses.replace(program, backend=RecordingBackend(backend, emit, position, positions))
+
+    if inplace is not None:
+        def recorded_inplace(node: Element, variables: Dict, soup: Document):
+            path, = paths(backend, [ node ], positions=positions)
+            inplace(node, variables, soup)
+            emit({ 'op': 'update', 'rule': position, 'path': path, 'tag': tag(node), 'attrs': attributes(node) })
+
+        recorded.inplace = recorded_inplace
+    elif build is not None:
+        # The element being replaced, from binding its variables until its replacement is built
+        matched = [ None ]
+
+        def recorded_bind(node: Element, variables: Dict):
+            bind(node, variables)
+            matched[0] = node
+
+        def recorded_build(variables: Dict, soup: Document):
+            node, matched[0] = matched[0], None
+            path, = paths(backend, [ node ], positions=positions)
+            # Children variables are lists of elements below 'node'; where they are is lost once they're moved
+            elements = [ element for value in variables.values() if isinstance(value, list) for element in value ]
+            moved = { id(element): element_path for element, element_path in zip(elements, paths(backend, elements, node, positions)) }
+
+            new_node, remainder = build(variables, soup)
+            if new_node is not None and new_node is not node:
+                # The caller puts it in the place of 'node' next
+                positions.replaced(node, new_node)
+            emit({ 'op': 'replace', 'rule': position, 'path': path, 'node': describe(backend, new_node, moved) })
+            return new_node, remainder
+
+        recorded.bind = recorded_bind
+        recorded.build = recorded_build
+
+    return recorded
+
+def record(rules: Union[RuleSet, List[Union[ast.NodeUnification, Program]]], emit: Emit, backend: Backend = BS4) -> RuleSet:
+    ''' A copy of 'rules' that calls 'emit' with an edit for every rewrite it makes. '''
+    if not isinstance(rules, RuleSet):
+        rules = compile_rules(rules, backend)
+
+    positions = Positions(rules.backend)
+    programs = [ record_program(program, emit, position, positions) for position, program in enumerate(rules.programs) ]
+    return compile_rules(programs, rules.backend, decision_tree=rules.tree is not None)
+
+def ndjson(output: BinaryIO) -> Emit:
+    ''' Write each edit to 'output' as a line of JSON. '''
+    def emit(edit: Edit):
+        output.write(orjson.dumps(edit) + b'\n')
+
+    return emit
+
+def read(lines: Iterable[Union[str, bytes]]) -> Iterator[Edit]:
+    ''' The edits of an NDJSON edit script. '''
+    for line in lines:
+        if line.strip():
+            yield orjson.loads(line)
+
+def build_node(backend: Backend, document: Document, node: Dict, moved: Dict[str, Element]) -> Element:
+    new_node = backend.new_element(document, node['tag'])
+    if node['attrs'] != {}:
+        backend.set_attributes(new_node, node['attrs'])
+
+    for child in node['children']:
+        if 'moved' in child:
+            # Moved the way rewrites move children, which leaves their surrounding text behind
+            backend.extend(new_node, [ moved[str(child['moved'])] ])
+        else:
+            backend.append(new_node, build_node(backend, document, child, moved))
+    return new_node
+
+def moved_paths(node: Dict) -> Iterator[List[int]]:
+    stack = [ node ]
+    while stack != []:
+        node = stack.pop()
+        if 'moved' in node:
+            yield node['moved']
+        else:
+            stack.extend(node['children'])
+
+def apply(document: Document, edits: Iterable[Edit], backend: Optional[Backend] = None) -> Document:
+    ''' Make the 'edits' recorded while rewriting a document to 'document', parsed from the same source. '''
+    backend = backend or backend_for(document)
+    for edit in edits:
+        node = resolve(backend, document, edit['path'])
+        match edit['op']:
+            case 'delete':
+                backend.delete(node)
+            case 'update':
+                if backend.tag(node) != edit['tag']:
+                    backend.rename(document, node, edit['tag'])
+                backend.set_attributes(node, edit['attrs'])
+                backend.drop_text(node)
+            case 'replace':
+                # Found before any of them is moved
+                moved = { str(path): resolve(backend, node, path) for path in moved_paths(edit['node']) }
+                backend.replace(node, build_node(backend, document, edit['node'], moved))
+            case op:
+                raise EditException(f'Unknown edit {op}.')
+    return document
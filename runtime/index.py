@@ -0,0 +1,227 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field
+from bisect import bisect_right
+from itertools import count
+
+from runtime.attributes import TOKEN_ATTRIBUTES, AttributePattern, value_tokens
+from runtime.backend import BS4, Backend, Element, backend_for
+
+Postings = Dict[int, Element]
+
+@dataclass
+class TagIndex:
+    ''' Tag name -> elements under a root, in document order. Optionally also indexes attributes (see 'build_index'). '''
+    # Elements are keyed by id() so removal is O(1) and iteration keeps insertion order.
+    # Elements added after the index is built are appended (ie not in document order).
+    elements: Dict[str, Postings] = field(default_factory=dict)
+    backend: Backend = BS4
+    # Attribute name -> elements that have it, and (attribute name, token) -> elements whose attribute contains the
+    # token for the attributes in TOKEN_ATTRIBUTES. None if attributes aren't indexed.
+    names: Optional[Dict[str, Postings]] = None
+    tokens: Optional[Dict[Tuple[str, str], Postings]] = None
+    # id() -> the order in which elements were indexed (document order, then appended ones), to merge postings
+    positions: Dict[int, int] = field(default_factory=dict)
+    numbers: Iterator[int] = field(default_factory=count)
+
+    def __contains__(self, node: Element) -> bool:
+        return self.elements.get(self.backend.tag(node), {}).get(id(node)) is node
+
+    @property
+    def indexes_attributes(self) -> bool:
+        return self.names is not None
+
+    def covers(self, tag: Optional[str], pattern: Optional[AttributePattern] = None) -> bool:
+        ''' Whether 'candidates' can narrow down the elements matching 'tag' (None for any) and 'pattern'. '''
+        return tag is not None or (pattern is not None and self.indexes_attributes)
+
+    def candidates(self, tag: Optional[str], pattern: Optional[AttributePattern] = None) -> List[Element]:
+        ''' A snapshot of the elements named 'tag' that may match 'pattern'; safe to iterate while the tree is rewritten.
+
+        With attributes indexed, this is the intersection of the postings of the tag, the attribute names and
+        the class tokens the pattern requires. Candidates still have to be matched against the pattern. '''
+        postings = []
+        if tag is not None:
+            postings.append(self.elements.get(tag, {}))
+        if pattern is not None and self.indexes_attributes:
+            postings.extend(self.names.get(name, {}) for name in pattern.names)
+            postings.extend(self.tokens.get(token, {}) for token in pattern.tokens)
+
+        if postings == []:
+            raise ValueError('Candidates need a tag or an indexed attribute pattern.')
+
+        # Walk the shortest list (it's in document order too) and probe the others
+        postings.sort(key=len)
+        shortest, others = postings[0], postings[1:]
+        return [ node for key, node in shortest.items() if all(key in other for other in others) ]
+
+    def union(self, keys: Iterable[Tuple[Optional[str], Optional[AttributePattern]]]) -> List[Element]:
+        ''' The candidates of any of the (tag, pattern) 'keys', each once and in the order they were indexed. '''
+        nodes = {}
+        for tag, pattern in keys:
+            for node in self.candidates(tag, pattern):
+                nodes[id(node)] = node
+        return sorted(nodes.values(), key=lambda node: self.positions[id(node)])
+
+    def add(self, node: Element, moved: Iterable[Element] = ()):
+        ''' Index 'node' and its descendants, skipping the subtrees in 'moved' (they are already indexed). '''
+        moved = { id(child) for child in moved }
+        stack = [ node ]
+        while stack != []:
+            node = stack.pop()
+            if id(node) in moved:
+                continue
+            self.insert(node)
+            children = self.backend.element_children(node)
+            children.reverse()
+            stack.extend(children)
+
+    def insert(self, node: Element):
+        ''' Index 'node' only. '''
+        self.elements.setdefault(self.backend.tag(node), {})[id(node)] = node
+        self.positions[id(node)] = next(self.numbers)
+        if self.names is not None:
+            self.insert_attributes(node, self.backend.attributes(node))
+
+    def insert_attributes(self, node: Element, attributes: Dict[str, Any]):
+        for name, value in attributes.items():
+            self.names.setdefault(name, {})[id(node)] = node
+            if name in TOKEN_ATTRIBUTES:
+                for token in value_tokens(value):
+                    self.tokens.setdefault((name, token), {})[id(node)] = node
+
+    def discard_attributes(self, node: Element, attributes: Dict[str, Any]):
+        for name, value in attributes.items():
+            self.names.get(name, {}).pop(id(node), None)
+            if name in TOKEN_ATTRIBUTES:
+                for token in value_tokens(value):
+                    self.tokens.get((name, token), {}).pop(id(node), None)
+
+    def rename(self, node: Element, old_tag: str):
+        ''' Move 'node', renamed in place, from the elements named 'old_tag' to those of its new tag. '''
+        nodes = self.elements.get(old_tag)
+        if nodes is not None and nodes.get(id(node)) is node:
+            del nodes[id(node)]
+            self.elements.setdefault(self.backend.tag(node), {})[id(node)] = node
+
+    def update_attributes(self, node: Element, old_attributes: Dict[str, Any]):
+        ''' Reindex the attributes of 'node', changed in place from 'old_attributes'. '''
+        if self.names is not None:
+            self.discard_attributes(node, old_attributes)
+            self.insert_attributes(node, self.backend.attributes(node))
+
+    def remove(self, node: Element):
+        ''' Drop 'node' and all of its (current) descendants from the index. '''
+        self.discard(node)
+        for child in self.backend.descendants(node):
+            self.discard(child)
+
+    def discard(self, node: Element):
+        ''' Drop 'node' only. '''
+        nodes = self.elements.get(self.backend.tag(node))
+        if nodes is not None and nodes.get(id(node)) is node:
+            del nodes[id(node)]
+            del self.positions[id(node)]
+            if self.names is not None:
+                self.discard_attributes(node, self.backend.attributes(node))
+
+def build_index(root: Element, attributes: bool = False) -> TagIndex:
+    ''' Index every element below 'root' in a single pass; with 'attributes', also their attribute names and classes. '''
+    backend = backend_for(root)
+    index = TagIndex(backend=backend)
+    if attributes:
+        index.names, index.tokens = {}, {}
+        for node in backend.descendants(root):
+            index.insert(node)
+        return index
+
+    positions, numbers = index.positions, index.numbers
+    for node in backend.descendants(root):
+        index.elements.setdefault(backend.tag(node), {})[id(node)] = node
+        positions[id(node)] = next(numbers)
+
+    return index
+
+@dataclass
+class SubtreeIndex:
+    ''' Pre-order interval numbering of the elements below a root, for queries about the descendants of an element.
+
+    The elements below an element numbered 'pre' are those numbered pre + 1 .. last. Per tag, the numbers of its
+    elements are kept sorted, so whether a subtree contains a tag is a binary search.
+
+    The numbering describes the tree it was built from. A top-down traversal (breadth-first or pre-order) only
+    queries elements before their subtrees are rewritten, so it stays valid for them; rewritten or new elements
+    aren't numbered and the queries return None for them. '''
+    # Elements by pre-order number
+    elements: List[Element] = field(default_factory=list)
+    # id(element) -> (pre-order number, number of its last descendant)
+    intervals: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+    # Tag -> pre-order numbers of its elements, ascending
+    occurrences: Dict[str, List[int]] = field(default_factory=dict)
+
+    def interval(self, node: Element) -> Optional[Tuple[int, int]]:
+        interval = self.intervals.get(id(node))
+        if interval is None or self.elements[interval[0]] is not node:
+            return None
+        return interval
+
+    def contains(self, node: Element, tag: Optional[str]) -> Optional[bool]:
+        ''' Whether an element named 'tag' (any element if None) is below 'node', or None if 'node' isn't numbered. '''
+        interval = self.interval(node)
+        if interval is None:
+            return None
+
+        pre, last = interval
+        if tag is None:
+            return last > pre
+
+        numbers = self.occurrences.get(tag, [])
+        position = bisect_right(numbers, pre)
+        return position < len(numbers) and numbers[position] <= last
+
+    def descendants(self, node: Element, tag: Optional[str]) -> Optional[Iterator[Element]]:
+        ''' The elements named 'tag' (all if None) below 'node' in document order, or None if 'node' isn't numbered. '''
+        interval = self.interval(node)
+        if interval is None:
+            return None
+
+        pre, last = interval
+        if tag is None:
+            return iter(self.elements[pre + 1:last + 1])
+
+        numbers = self.occurrences.get(tag, [])
+        return self.numbered(numbers, bisect_right(numbers, pre), last)
+
+    def numbered(self, numbers: List[int], position: int, last: int) -> Iterator[Element]:
+        elements = self.elements
+        while position < len(numbers) and numbers[position] <= last:
+            yield elements[numbers[position]]
+            position += 1
+
+def build_subtree_index(root: Element) -> SubtreeIndex:
+    ''' Number every element below 'root' in a single iterative pass. '''
+    backend = backend_for(root)
+    index = SubtreeIndex()
+    elements, intervals, occurrences = index.elements, index.intervals, index.occurrences
+    tag, element_children = backend.tag, backend.element_children
+
+    # Elements to number, and the numbers of elements whose subtrees end once everything pushed after them is numbered
+    stack = element_children(root)
+    stack.reverse()
+    while stack != []:
+        node = stack.pop()
+        if type(node) is int:
+            intervals[id(elements[node])] = (node, len(elements) - 1)
+            continue
+
+        pre = len(elements)
+        elements.append(node)
+        occurrences.setdefault(tag(node), []).append(pre)
+        children = element_children(node)
+        if children == []:
+            intervals[id(node)] = (pre, pre)
+        else:
+            stack.append(pre)
+            children.reverse()
+            stack.extend(children)
+
+    return index
@@ -0,0 +1,68 @@
+from typing import Optional
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+
+def cache_key(*parts: bytes) -> str:
+    ''' A content hash of 'parts' (length-prefixed, so part boundaries matter). '''
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+def default_cache_dir() -> Optional[Path]:
+    ''' $TPML_CACHE_DIR (empty disables the disk cache), else the user cache directory. '''
+    directory = os.environ.get('TPML_CACHE_DIR')
+    if directory is not None:
+        return Path(directory) if directory != '' else None
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(cache_home) / 'tpml' / 'js'
+
+class EmitCache:
+    ''' Emitted bundles by content hash: an in-memory LRU in front of an optional directory. '''
+
+    def __init__(self, directory: Optional[Path] = None, capacity: int = 256):
+        self.directory = directory
+        self.capacity = capacity
+        self.entries: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        if self.directory is None:
+            return None
+
+        try:
+            value = (self.directory / f'{key}.js').read_text('utf8')
+        except OSError:
+            return None
+
+        self.remember(key, value)
+        return value
+
+    def put(self, key: str, value: str):
+        self.remember(key, value)
+        if self.directory is None:
+            return
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write then rename so concurrent readers never see a partial bundle
+            with tempfile.NamedTemporaryFile('w', encoding='utf8', dir=self.directory, suffix='.tmp', delete=False) as f:
+                f.write(value)
+            os.replace(f.name, self.directory / f'{key}.js')
+        except OSError:
+            # The disk cache is best effort
+            ...
+
+    def remember(self, key: str, value: str):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
@@ -0,0 +1,25 @@
+from enum import StrEnum
+
+import parser.ast as ast
+from runtime.matcher import keeps_children
+
+class RewriteKind(StrEnum):
+    ''' How a rewrite changes the elements it matches; the JS runtime picks the cheapest DOM operation for it. '''
+    # Same tag and children: the element is kept and only its attributes change
+    ATTRIBUTES = 'attributes'
+    # The children move, all at once, below an element with another tag
+    RENAME = 'rename'
+    # The replacement is built from the right side
+    STRUCTURAL = 'structural'
+    DELETE = 'delete'
+
+def classify(unification: ast.NodeUnification) -> RewriteKind:
+    left, right = unification.left, unification.right
+    if right.tag is None:
+        return RewriteKind.DELETE
+    if not keeps_children(unification):
+        return RewriteKind.STRUCTURAL
+    # The same concrete tag or tag variable, or '_' (the matched element's tag)
+    if right.tag == left.tag or right.tag == '_':
+        return RewriteKind.ATTRIBUTES
+    return RewriteKind.RENAME
@@ -1,32 +1,151 @@
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from pathlib import Path
+import os
 import subprocess
+import tempfile
 import orjson
 
 from jinja2 import Template 
 
 from lexer import lex
 from parser import parse
+from runtime.js.cache import EmitCache, cache_key, default_cache_dir
+from runtime.js.classify import classify
+from runtime.js.selector import css_selector
 
-def emit(tpml_rewrite:str, prefix=True):
+RUNTIME_DIR = Path(__file__).parent
+TEMPLATE_PATH = RUNTIME_DIR / 'bookmarklet.jinja'
+MATCHER_PATH = RUNTIME_DIR / 'matcher.js'
+ESBUILD_PATH = RUNTIME_DIR / 'node_modules' / '.bin' / 'esbuild'
 
+class EmitException(Exception):
+    ...
+
+# Bundles emitted by this process (and by earlier ones, through the disk cache)
+EMIT_CACHE = EmitCache(default_cache_dir())
+
+# (path, mtime, size) -> contents, so the runtime files are only re-read when they change
+runtime_files = dict()
+
+def read_runtime_file(path: Path) -> str:
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in runtime_files:
+        runtime_files[key] = path.read_text('utf8')
+    return runtime_files[key]
+
+@cache
+def load_template(template: str) -> Template:
+    return Template(template)
+
+@cache
+def esbuild_version() -> str:
+    try:
+        result = subprocess.run([ ESBUILD_PATH, '--version' ], capture_output=True)
+    except OSError:
+        # TODO: Handle missing esbuild install
+        return ''
+    return result.stdout.decode('utf8').strip()
+
+def rule_variables(tpml_rewrite: str, live: bool = False) -> Dict[str, str]:
+    ''' The template variables for 'tpml_rewrite': its rules serialized for the JS runtime and what is derived from them.
+    If 'live', the bundle keeps rewriting elements added to the page after it ran. '''
     tokens = lex.lex(tpml_rewrite)
     uni = parse.parse_unification(tokens)
 
-    match_rule = orjson.dumps(uni.left).decode('utf8')
-    rewrite_rule = orjson.dumps(uni.right).decode('utf8')
+    return {
+        'match_rule': orjson.dumps(uni.left).decode('utf8'),
+        'rewrite_rule': orjson.dumps(uni.right).decode('utf8'),
+        'selector': orjson.dumps(css_selector(uni.left)).decode('utf8'),
+        'kind': orjson.dumps(classify(uni)).decode('utf8'),
+        'mode': 'live' if live else 'once',
+    }
+
+def bundle_key(variables: Dict[str, str], template: str, matcher_js: str) -> str:
+    # The bundle only depends on these; editing the runtime JS or upgrading esbuild changes the key.
+    # The 'javascript:' prefix is added afterwards, so both variants share an entry.
+    parts = [ template, matcher_js, esbuild_version() ]
+    for name in sorted(variables):
+        parts.extend((name, variables[name]))
+    return cache_key(*(part.encode('utf8') for part in parts))
+
+def emit(tpml_rewrite:str, prefix=True, cache: Optional[EmitCache] = EMIT_CACHE, live: bool = False):
+    variables = rule_variables(tpml_rewrite, live=live)
+    template = read_runtime_file(TEMPLATE_PATH)
+    matcher_js = read_runtime_file(MATCHER_PATH)
+
+    key = bundle_key(variables, template, matcher_js)
+    bundle = cache.get(key) if cache is not None else None
+
+    if bundle is None:
+        bookmarklet_js = load_template(template).render(matcher_js=matcher_js, **variables)
+
+        result = subprocess.run(
+            [ ESBUILD_PATH, '--bundle', '--minify' ],
+            input=bookmarklet_js.encode('utf8'),
+            capture_output=True)
+
+        bundle = result.stdout.decode('utf8').strip()
+        # Never cache a failed build
+        if cache is not None and result.returncode == 0 and bundle != '':
+            cache.put(key, bundle)
+
+    scheme_prefix = 'javascript:' if prefix else ''
+    return f'{scheme_prefix}{bundle}'
+
+def build_many(sources: List[str]) -> List[str]:
+    ''' Bundle and minify each source with a single esbuild run (one entry point per source). '''
+    with tempfile.TemporaryDirectory(prefix='tpml-emit-') as directory:
+        input_dir = Path(directory) / 'in'
+        output_dir = Path(directory) / 'out'
+        input_dir.mkdir()
+
+        entry_points = []
+        for i, source in enumerate(sources):
+            entry_point = input_dir / f'{i}.js'
+            entry_point.write_text(source, 'utf8')
+            entry_points.append(str(entry_point))
+
+        result = subprocess.run(
+            [ ESBUILD_PATH, '--bundle', '--minify', '--log-level=error', f'--outdir={output_dir}', *entry_points ],
+            capture_output=True)
+        if result.returncode != 0:
+            raise EmitException(f'esbuild failed: {result.stderr.decode("utf8").strip()}')
+
+        return [ (output_dir / f'{i}.js').read_text('utf8').strip() for i in range(len(sources)) ]
+
+def emit_many(tpml_rewrites: List[str], prefix=True, cache: Optional[EmitCache] = EMIT_CACHE, batch_size: int = 500, jobs: int = 1, live: bool = False) -> List[str]:
+    ''' Emit one bundle per rewrite rule, like 'emit', running esbuild once per 'batch_size' uncached rules
+    ('jobs' runs at a time) instead of once per rule. Outputs are in the order of 'tpml_rewrites'. '''
+    template = read_runtime_file(TEMPLATE_PATH)
+    matcher_js = read_runtime_file(MATCHER_PATH)
+    emit_template = load_template(template)
 
-    with open('runtime/js/bookmarklet.jinja', 'r') as f:
-        emit_template = Template(f.read()) 
-    
-    with open('runtime/js/matcher.js', 'r') as f:
-        matcher_js = f.read()
+    bundles: List[Optional[str]] = []
+    # Key -> rendered source of every rule that has to be built (duplicates are built once)
+    pending: Dict[str, str] = dict()
+    keys = []
+    for tpml_rewrite in tpml_rewrites:
+        variables = rule_variables(tpml_rewrite, live=live)
+        key = bundle_key(variables, template, matcher_js)
+        bundle = cache.get(key) if cache is not None else None
+        if bundle is None and key not in pending:
+            pending[key] = emit_template.render(matcher_js=matcher_js, **variables)
 
-    bookmarklet_js = emit_template.render(matcher_js=matcher_js, match_rule=match_rule, rewrite_rule=rewrite_rule)
+        keys.append(key)
+        bundles.append(bundle)
 
-    # TODO: Handle missing esbuild install
-    result = subprocess.run(
-        f'./runtime/js/node_modules/.bin/esbuild --bundle --minify <<END_JS\n{bookmarklet_js}\nEND_JS', 
-        shell=True,
-        capture_output=True)
+    pending_keys = list(pending)
+    batches = [ pending_keys[i:i + batch_size] for i in range(0, len(pending_keys), batch_size) ]
+    built = dict()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for batch, batch_bundles in zip(batches, executor.map(lambda batch: build_many([ pending[key] for key in batch ]), batches)):
+            for key, bundle in zip(batch, batch_bundles):
+                built[key] = bundle
+                if cache is not None and bundle != '':
+                    cache.put(key, bundle)
 
     scheme_prefix = 'javascript:' if prefix else ''
-    return f'{scheme_prefix}{result.stdout.decode('utf8').strip()}'
+    return [ f'{scheme_prefix}{built[key] if bundle is None else bundle}' for key, bundle in zip(keys, bundles) ]
@@ -1,5 +1,3 @@
-const TEXT_NODE = 3;
-
 function variable(name) {
     return (name[0] == name[0].toUpperCase()) || name == '_';
 }
@@ -14,31 +12,86 @@ function getChildren(node) {
         return [];
     }
 
-    return Array(...node.children).filter((child) => child.nodeType != TEXT_NODE);
+    // 'children' only holds elements
+    return Array.from(node.children);
 }
 
 function matchSet(jsSet, setMatchRule) {
-    // If setMatchRule contains 'nodeType: ellipsis' then it's a fuzzy match
-    // Otherwise, strict set equality
+    // The set should include all of the string members; each '_' stands for one more value.
+    // If setMatchRule contains 'nodeType: ellipsis' then it's a fuzzy match (other values may be present),
+    // otherwise the set has exactly that many values.
     let fuzzyMatch = (setMatchRule.members.filter(m => m.nodeType == 'ellipsis').length > 0);
-    if (fuzzyMatch) {
-        let members = new Set(setMatchRule.members
-            .filter(m => m.nodeType != 'ellipsis')
-            .map(m => m.value)); // All values in this case should be strings
+    let wildcards = setMatchRule.members.filter(m => m.nodeType == 'wildcard').length;
+    let members = new Set(setMatchRule.members
+        .filter(m => m.nodeType == 'string')
+        .map(m => m.value));
+
+    for (const member of members) {
+        if (!jsSet.has(member)) {
+            return false;
+        }
+    }
+
+    let size = members.size + wildcards;
+    return fuzzyMatch ? (jsSet.size >= size) : (jsSet.size == size);
+}
+
+// Match the left side dict 'attrs' against the attributes of 'node' (see "Dict patterns" in the README).
+// Dicts are open: variables, unpacks and ellipses don't constrain anything, nor do attributes not in the dict.
+function matchAttributes(node, attrs) {
+    for (const entry of attrs) {
+        if (!Array.isArray(entry)) {
+            continue;
+        }
+
+        let [key, value] = entry;
+        let attribute = node.getAttribute(key.value);
+        if (attribute === null) {
+            return false;
+        }
+
+        if (value.nodeType == 'string') {
+            // Multi-valued attributes are compared space separated
+            if (attribute.split(/\s+/).filter(v => v != '').join(' ') != value.value) {
+                return false;
+            }
+        } else if (value.nodeType == 'set') {
+            if (!matchSet(new Set(attribute.split(/\s+/).filter(v => v != '')), value)) {
+                return false;
+            }
+        }
+        // "name": _ only requires the attribute to be set
+    }
 
-        // The js set should at least include all of the members (ie a superset of the match rule)
-        return members.isSubsetOf(jsSet);
-    } else {
-        let members = new Set(setMatchRule.members
-            .map(m => m.value)); // All values in this case should be strings
+    return true;
+}
 
-        // Strict equality
-        return (jsSet.difference(members).size == 0);
+// (...) ..> Pattern: some element below node, at any depth, matches Pattern
+function matchFilters(node, matchRule) {
+    for (const filter of (matchRule.filters ?? [])) {
+        let pattern = filter.right_arg;
+        // The browser keeps elements indexed by tag; only those with the pattern's tag are tried.
+        let candidates = node.getElementsByTagName(variable(pattern.tag) ? '*' : pattern.tag);
+        if (!Array.prototype.some.call(candidates, candidate => match(candidate, pattern))) {
+            return false;
+        }
     }
+
+    return true;
 }
 
 function match(node, matchRule) {
+    // Filters look at the whole subtree, so they're checked last
+    return matchNode(node, matchRule) && matchFilters(node, matchRule);
+}
+
+function matchNode(node, matchRule) {
     if (matchRule.tag == '_' || matchRule.tag == node.tagName.toLowerCase()) {
+        // Attributes are checked after the tag and before the children
+        if (!matchAttributes(node, matchRule.attrs ?? [])) {
+            return false;
+        }
+
         let nodeChildren = getChildren(node);
         // (_,_,[])
         if (matchRule.children.length == 0 && nodeChildren.length == 0) {
@@ -76,10 +129,13 @@ function extract_variables(node, matchRule) {
         vars[matchRule.tag] = node.tagName.toLowerCase();
     }
 
-    // If attributes contains a single Variable element extract
-    // the entire set as a var
-    if (matchRule.attrs.length == 1 && (matchRule.attrs[0].tag[0].toUpperCase() == matchRule.attrs[0].tag[0])) {
-        vars[matchRule.attrs[0].tag] = extract_node_attrs(node);
+    // A Variable among the attributes, as in (_,Attrs,_) or (_,{Attrs, ...},_), is bound to all of them.
+    // "key": value entries are [key, value] arrays and bind nothing.
+    for (const entry of matchRule.attrs) {
+        if (!Array.isArray(entry) && entry.tag && variable(entry.tag)) {
+            vars[entry.tag] = extract_node_attrs(node);
+            break;
+        }
     }
 
     return vars;
@@ -111,16 +167,22 @@ function map_insert(map, new_entries_map) {
     return newMap;
 }
 
-function clearNodeAttributes(node) {
-    for (const attr of node.attributes) {
-        node.removeAttribute(attr.name)
+// Only touch the attributes that change (each mutation may restyle the element)
+function replaceNodeAttributes(node, newAttrsMap) {
+    for (const name of node.getAttributeNames()) {
+        if (!newAttrsMap.has(name)) {
+            node.removeAttribute(name);
+        }
     }
-}
 
-function replaceNodeAttributes(node, newAttrsMap) {
-    clearNodeAttributes(node);
-    for (const [key,value] of newAttrsMap) {
-        node.setAttribute(key, value);
+    for (let [key,value] of newAttrsMap) {
+        // Multi-valued attributes (eg. class) are extracted as lists
+        if (Array.isArray(value)) {
+            value = value.join(' ');
+        }
+        if (node.getAttribute(key) !== value) {
+            node.setAttribute(key, value);
+        }
     }
 }
 
@@ -162,52 +224,195 @@ function reify_dict_as_map(dict_ast_entries, vars) {
     return map;
 }
 
-function unify(node, matchRule, rewriteRule, document) {
-    console.assert(match(node, matchRule));
+// How a rewrite changes the matched element; decided at emit time (see runtime/js/classify.py).
+const REWRITE_ATTRIBUTES = 'attributes';   // Same tag and children: only the attributes change
+const REWRITE_RENAME = 'rename';           // The children are kept below an element with a different tag
+const REWRITE_STRUCTURAL = 'structural';   // The replacement has a structure of its own
+const REWRITE_DELETE = 'delete';           // The element is removed
+
+function rewriteTag(node, rule, vars) {
+    if (rule.tag == '_') {
+        return node.tagName.toLowerCase();
+    }
+    if (variable(rule.tag)) {
+        return vars[rule.tag];
+    }
+
+    return rule.tag;
+}
+
+// Move all child nodes of 'from' to the end of 'to' in one DOM operation.
+function moveChildren(from, to, document) {
+    let range = document.createRange();
+    range.selectNodeContents(from);
+    to.appendChild(range.extractContents());
+}
+
+// Build the elements of 'rule'; its children variable (or wildcard) receives the child nodes of 'node'.
+function build(node, rule, vars, document) {
+    let element = document.createElement(rewriteTag(node, rule, vars));
+    replaceNodeAttributes(element, reify_dict_as_map(rule.attrs, vars));
+
+    if (rule.children.length == 1 && variable(rule.children[0].tag) && rule.children[0].children.length == 0) {
+        moveChildren(node, element, document);
+        return element;
+    }
 
-    let tag = matchRule.tag;
-    if (tag == '_') {
-        tag = node.tag;
+    if (rule.children.length > 0) {
+        let fragment = document.createDocumentFragment();
+        for (const child of rule.children) {
+            fragment.appendChild(build(node, child, vars, document));
+        }
+        element.appendChild(fragment);
     }
 
-    
+    return element;
+}
 
-    // For now, only perform direct tag substitutions
-    // TODO: Stop creating a new element--this will likely break the page.
-    let element = document.createElement(rewriteRule.tag);
+// Rewrite 'node' (matched by matchRule) according to 'kind'. Return the element now in its place
+// ('node' itself if it was changed in place, null if deleted; the caller puts it in the document)
+// and the elements left to visit.
+function unify(node, matchRule, rewriteRule, document, kind = REWRITE_STRUCTURAL) {
+    console.assert(match(node, matchRule));
+
+    let children = getChildren(node);
+    if (kind == REWRITE_DELETE) {
+        node.remove();
+        return [null, []];
+    }
 
     // Attributes rewriting
     // TODO: Handle wildcard
     let vars = extract_variables(node, matchRule);
-    let newAttrs = reify_dict_as_map(rewriteRule.attrs, vars);
-    replaceNodeAttributes(element, newAttrs);
+    if (kind == REWRITE_ATTRIBUTES) {
+        replaceNodeAttributes(node, reify_dict_as_map(rewriteRule.attrs, vars));
+        return [node, children];
+    }
 
-    for (const child of node.childNodes) {
-        element.appendChild(child);
+    if (kind == REWRITE_RENAME) {
+        let element = document.createElement(rewriteTag(node, rewriteRule, vars));
+        replaceNodeAttributes(element, reify_dict_as_map(rewriteRule.attrs, vars));
+        moveChildren(node, element, document);
+        return [element, children];
     }
 
-    return [element, getChildren(node)];
+    return [build(node, rewriteRule, vars, document), children];
 }
 
-function unify_tree(root_node, matchRule, rewriteRule, document) {
+// Put the result of 'unify' in the document
+function replaceNode(node, new_node) {
+    if (new_node != null && new_node !== node) {
+        node.replaceWith(new_node);
+    }
+}
+
+function unify_tree(root_node, matchRule, rewriteRule, document, kind = REWRITE_STRUCTURAL) {
     let children = getChildren(root_node);
 
     if (match(root_node, matchRule)) {
         let new_node;
-        [new_node, children] = unify(root_node, matchRule, rewriteRule, document);
-        root_node.replaceWith(new_node);
+        [new_node, children] = unify(root_node, matchRule, rewriteRule, document, kind);
+        replaceNode(root_node, new_node);
     }
 
     for (const child of children) {
-        unify_tree(child, matchRule, rewriteRule, document);
+        unify_tree(child, matchRule, rewriteRule, document, kind);
+    }
+}
+
+// Like unify_tree, but only matches the elements 'selector' selects: a prefilter derived from matchRule
+// at emit time, so the browser's selector engine rather than 'match' walks the document.
+function unify_selected(root_node, selector, matchRule, rewriteRule, document, kind = REWRITE_STRUCTURAL) {
+    let candidates;
+    try {
+        candidates = Array.from(root_node.querySelectorAll(selector));
+    } catch (e) {
+        // The selector isn't supported (eg. no :has()); walk the tree instead.
+        unify_tree(root_node, matchRule, rewriteRule, document, kind);
+        return;
+    }
+
+    // querySelectorAll only returns descendants
+    if (root_node.matches(selector)) {
+        candidates.unshift(root_node);
+    }
+
+    // Candidates are in document order, so parents are rewritten before their descendants.
+    for (const node of candidates) {
+        // Skip candidates dropped by an earlier rewrite
+        if (node.isConnected && match(node, matchRule)) {
+            let [new_node, _] = unify(node, matchRule, rewriteRule, document, kind);
+            replaceNode(node, new_node);
+        }
+    }
+}
+
+// Apply the rewrite now and to every element added to the document later (infinite scroll, client side
+// navigation). Added subtrees are queued and rewritten in one batch per animation frame, so the cost is
+// proportional to what changed. Returns the MutationObserver (disconnect it to stop).
+function unify_live(root_node, selector, matchRule, rewriteRule, document, kind = REWRITE_STRUCTURAL) {
+    const window = document.defaultView;
+    const observer = new window.MutationObserver(enqueue);
+    let queued = new Set();
+    let scheduled = false;
+
+    function enqueue(records) {
+        for (const record of records) {
+            for (const node of record.addedNodes) {
+                if (node.nodeType == window.Node.ELEMENT_NODE) {
+                    queued.add(node);
+                }
+            }
+        }
+
+        if (queued.size > 0 && !scheduled) {
+            scheduled = true;
+            window.requestAnimationFrame(flush);
+        }
+    }
+
+    function flush() {
+        // Mutations since the last callback belong to the page (still scheduled: no new frame is requested)
+        enqueue(observer.takeRecords());
+        scheduled = false;
+
+        let roots = queued;
+        queued = new Set();
+        for (const node of roots) {
+            if (node.isConnected && !nested(node, roots)) {
+                unify_selected(node, selector, matchRule, rewriteRule, document, kind);
+            }
+        }
+
+        // Drop the records of the rewrites above so they aren't processed again
+        observer.takeRecords();
+    }
+
+    unify_selected(root_node, selector, matchRule, rewriteRule, document, kind);
+    observer.observe(root_node, { childList: true, subtree: true });
+
+    return observer;
+}
+
+// Whether an ancestor of 'node' is in 'roots' (and so is rewritten along with it)
+function nested(node, roots) {
+    for (let parent = node.parentElement; parent != null; parent = parent.parentElement) {
+        if (roots.has(parent)) {
+            return true;
+        }
     }
+
+    return false;
 }
 
 module.exports = { 
     match, 
     matchSet, 
+    matchAttributes, 
     unify, 
     unify_tree, 
+    unify_selected, 
+    unify_live, 
     extract_variables, 
     extract_node_attrs, 
     reify_dict_as_map 
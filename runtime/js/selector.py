@@ -0,0 +1,75 @@
+from typing import List
+import re
+
+import parser.ast as ast
+from runtime.attributes import compile_attribute_pattern
+from runtime.matcher import any_children, any_tag
+
+# CSS prefilters for left side rules. A selector must select every element 'match' (in matcher.js) accepts;
+# it may select more, since the candidates are still matched in full.
+
+# Names that can be written in a selector without escaping
+IDENTIFIER = re.compile(r'-?[_a-zA-Z][_a-zA-Z0-9-]*')
+
+def quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def attribute_selectors(rule: ast.HTMLNode) -> str:
+    ''' [name] for every attribute the left side dict requires and .token (or [name~="token"]) for the members of its set patterns.
+
+    Values are only required to be present: 'match' compares them space separated, which an attribute selector can't. '''
+    pattern = compile_attribute_pattern(rule.attrs)
+    if pattern is None:
+        return ''
+
+    selectors = []
+    for name in sorted(pattern.names):
+        if not IDENTIFIER.fullmatch(name):
+            continue
+        set_pattern = dict(pattern.sets).get(name)
+        members = sorted(set_pattern.members) if set_pattern is not None else []
+        if members == []:
+            selectors.append(f'[{name}]')
+        for member in members:
+            if name == 'class' and IDENTIFIER.fullmatch(member):
+                selectors.append(f'.{member}')
+            else:
+                selectors.append(f'[{name}~={quote(member)}]')
+
+    return ''.join(selectors)
+
+def compound_selector(rule: ast.HTMLNode) -> str:
+    attributes = attribute_selectors(rule)
+    if rule.tag is None or any_tag(rule):
+        return attributes or '*'
+    return rule.tag + attributes
+
+def child_sequence(rules: List[ast.HTMLNode]) -> str:
+    ''' Exactly the element children 'rules', in order. '''
+    children = [ compound_selector(rule) for rule in rules ]
+    if len(children) == 1:
+        return f'{children[0]}:only-child'
+
+    return ' + '.join([ f'{children[0]}:first-child', *children[1:-1], f'{children[-1]}:last-child' ])
+
+def filter_selectors(rule: ast.HTMLNode) -> str:
+    ''' (...) ..> (tag,{...},...): a descendant named tag, with the attributes the dict requires. '''
+    compounds = [ compound_selector(filter.right_arg) for filter in rule.filters ]
+    return ''.join(f':has({compound})' for compound in compounds if compound != '*')
+
+def css_selector(rule: ast.HTMLNode) -> str:
+    ''' A selector for the candidates of 'rule': its tag and attributes, those of its element children and of its filters.
+
+    Grandchildren are left to 'match' (:has() can't be nested), as are attribute values and set sizes. '''
+    selector = compound_selector(rule) + filter_selectors(rule)
+
+    # (_,_,Children)
+    if any_children(rule):
+        return selector
+
+    # (_,_,[])
+    if rule.children == []:
+        return f'{selector}:not(:has(> *))'
+
+    # (_,_,[(...), ...])
+    return f'{selector}:has(> {child_sequence(rule.children)})'
@@ -0,0 +1,79 @@
+import { bench, describe } from 'vitest';
+import { match, unify_tree } from '../matcher';
+const fs = require('fs');
+const path = require('path');
+const jsdom = require("jsdom");
+const { JSDOM } = jsdom;
+
+// Same shape as benchmarks/synthetic.py: complete 'fanout'-ary subtrees below <body>, tags cycling.
+function generateHTML(elements, fanout = 8) {
+    const tags = ['div', 'span', 'p', 'b', 'i', 'section'];
+    let depth = 1, capacity = 1, level = 1;
+    while (capacity < elements) {
+        level *= fanout;
+        capacity += level;
+        depth += 1;
+    }
+
+    let parts = ['<html><body>'];
+    let stack = [];
+    let count = 0;
+    while (count < elements) {
+        if (stack.length > 0 && (stack.length >= depth || stack[stack.length - 1][1] >= fanout)) {
+            parts.push(`</${stack.pop()[0]}>`);
+            continue;
+        }
+
+        const tag = tags[count % tags.length];
+        if (stack.length > 0) {
+            stack[stack.length - 1][1] += 1;
+        }
+        stack.push([tag, 0]);
+        parts.push(`<${tag}>`);
+        count += 1;
+    }
+
+    while (stack.length > 0) {
+        parts.push(`</${stack.pop()[0]}>`);
+    }
+    parts.push('</body></html>');
+
+    return parts.join('');
+}
+
+const anyChildren = [ { tag: 'Children', attrs: [], children: [] } ];
+const boldToItalic = [
+    { tag: 'b', attrs: [], children: anyChildren },
+    { tag: 'i', attrs: [], children: anyChildren },
+];
+const spanToBold = [
+    { tag: 'span', attrs: [], children: anyChildren },
+    { tag: 'b', attrs: [], children: anyChildren },
+];
+
+const askHN = fs.readFileSync(path.join(__dirname, '../../../tests/data/ask-hn-oct-24.html'), 'utf8');
+const synthetic = generateHTML(10_000);
+
+describe('unify_tree', () => {
+    // Parsing is part of every run: the rewrite mutates the document.
+    bench('ask-hn: b -> i', () => {
+        const dom = new JSDOM(askHN);
+        unify_tree(dom.window.document.documentElement, ...boldToItalic, dom.window.document);
+    });
+
+    bench('synthetic 10k: span -> b', () => {
+        const dom = new JSDOM(synthetic);
+        unify_tree(dom.window.document.documentElement, ...spanToBold, dom.window.document);
+    });
+});
+
+describe('match', () => {
+    const dom = new JSDOM(synthetic);
+    const elements = [ ...dom.window.document.querySelectorAll('*') ];
+
+    bench('synthetic 10k: every element', () => {
+        for (const element of elements) {
+            match(element, spanToBold[0]);
+        }
+    });
+});
@@ -1,6 +1,8 @@
 import { expect, test, assert } from 'vitest';
-import { extract_node_attrs, extract_variables, match, matchSet, reify_dict_as_map, unify, unify_tree } from '../matcher';
+import { extract_node_attrs, extract_variables, match, matchSet, reify_dict_as_map, unify, unify_live, unify_selected, unify_tree } from '../matcher';
 import { html_beautify } from 'js-beautify';
+const fs = require('fs');
+const path = require('path');
 const jsdom = require("jsdom");
 const { JSDOM } = jsdom;
 
@@ -279,6 +281,21 @@ test('Extract variables: node attributes', () => {
     expect(vars['Attrs']['class']).toStrictEqual(['foo','bar']);
 })
 
+test('Extract variables: "key": value entries', () => {
+    let dom = new JSDOM('<div class="foo bar" id="baz"></div>');
+    const key = { value: 'id', nodeType: 'string' };
+    const value = { value: 'baz', nodeType: 'string' };
+
+    // (div,{"id": "baz"},[]): nothing to bind
+    let vars = extract_variables(dom.window.document.body.firstChild, { tag: 'div', attrs: [ [ key, value ] ], children: [] });
+    expect(Object.keys(vars).length).toBe(0);
+
+    // (div,{"id": "baz", Attrs},[]): the variable needn't be the only entry
+    const attrs = { tag: 'Attrs', attrs: [], children: [], nodeType: 'node' };
+    vars = extract_variables(dom.window.document.body.firstChild, { tag: 'div', attrs: [ [ key, value ], attrs ], children: [] });
+    expect(vars['Attrs']['id']).toBe('baz');
+})
+
 test('Reify dict: (string,string) entries', () => {
     let ast_dict = [
         [
@@ -412,4 +429,240 @@ test('unify: set attributes with unpack (union)', () => {
     expect(result.tagName.toLowerCase()).toBe('p');
     expect(result.id).toBe('foo');
     expect(result.className).toBe('bar');
-});
\ No newline at end of file
+});
+
+test('unify_selected: only selected candidates are rewritten', () => {
+    const doc = `
+        <html>
+            <head></head>
+            <body>
+                <p><b>hello</b></p>
+                <p><b>a</b><b>b</b></p>
+            </body>
+        </html>
+    `;
+
+    const transformedDoc = `
+        <html>
+            <head></head>
+            <body>
+                <div><b>hello</b></div>
+                <p><b>a</b><b>b</b></p>
+            </body>
+        </html>
+    `;
+
+    // (p,{},C) = (div,{},C), narrowed to paragraphs with a single b by the selector
+    const matchRule = { tag: 'p', attrs: [], children: [ { tag: 'C', attrs: [], children: [] } ] };
+    const rewriteRule = { tag: 'div', attrs: [], children: [ { tag: 'C', attrs: [], children: [] } ] };
+
+    let dom = new JSDOM(doc);
+    unify_selected(dom.window.document.documentElement, 'p:has(> b:only-child)', matchRule, rewriteRule, dom.window.document);
+    let result = dom.window.document.documentElement.outerHTML;
+
+    expect(beautify(transformedDoc)).toBe(beautify(result));
+});
+
+test('unify_live: added elements are rewritten in the next frame', async () => {
+    const doc = `
+        <html>
+            <head></head>
+            <body>
+                <b>before</b>
+            </body>
+        </html>
+    `;
+
+    const matchRule = { tag: 'b', attrs: [], children: [ { tag: 'C', attrs: [], children: [] } ] };
+    const rewriteRule = { tag: 'i', attrs: [], children: [ { tag: 'C', attrs: [], children: [] } ] };
+
+    let dom = new JSDOM(doc, { pretendToBeVisual: true });
+    let document = dom.window.document;
+    let observer = unify_live(document.documentElement, 'b', matchRule, rewriteRule, document);
+    expect(document.querySelectorAll('b').length).toBe(0);
+
+    let added = document.createElement('div');
+    added.innerHTML = '<b>after</b><b>again</b>';
+    document.body.appendChild(added);
+
+    await new Promise((resolve) => dom.window.requestAnimationFrame(() => setTimeout(resolve, 0)));
+    observer.disconnect();
+
+    expect(document.querySelectorAll('b').length).toBe(0);
+    expect(document.querySelectorAll('i').length).toBe(3);
+});
+
+test('unify: attribute-only rewrites keep the element', () => {
+    let dom = new JSDOM('<html><body><img src="a.png" class="x y"></body></html>');
+    let img = dom.window.document.querySelector('img');
+
+    const matchRule = { tag: 'img', attrs: [ { tag: 'Attrs', attrs: [], children: [] } ], children: [] };
+    const rewriteRule = {
+        tag: 'img',
+        attrs: [
+            { tag: 'Attrs', attrs: [], children: [] },
+            [ { tag: 'string', value: 'style' }, { tag: 'string', value: 'filter: grayscale(100%);' } ]
+        ],
+        children: []
+    };
+
+    let [result, children] = unify(img, matchRule, rewriteRule, dom.window.document, 'attributes');
+    expect(result).toBe(img);
+    expect(img.isConnected).toBe(true);
+    expect(img.getAttribute('src')).toBe('a.png');
+    expect(img.getAttribute('class')).toBe('x y');
+    expect(img.getAttribute('style')).toBe('filter: grayscale(100%);');
+});
+
+test('unify: renames move every child node at once', () => {
+    let dom = new JSDOM('<html><body><b>one <span>two</span> three</b></body></html>');
+    let document = dom.window.document;
+    let span = document.querySelector('span');
+
+    const children = [ { tag: 'C', attrs: [], children: [] } ];
+    unify_tree(document.body, { tag: 'b', attrs: [], children }, { tag: 'i', attrs: [], children }, document, 'rename');
+
+    expect(document.body.innerHTML).toBe('<i>one <span>two</span> three</i>');
+    expect(document.querySelector('span')).toBe(span);
+});
+
+test('unify: structural rewrites build the right side around the children', () => {
+    let dom = new JSDOM('<html><body><a href="/x">link <b>text</b></a></body></html>');
+    let document = dom.window.document;
+
+    const matchRule = {
+        tag: 'a',
+        attrs: [ { tag: 'Attrs', attrs: [], children: [] } ],
+        children: [ { tag: 'Children', attrs: [], children: [] } ]
+    };
+    const rewriteRule = {
+        tag: 'mark',
+        attrs: [],
+        children: [ matchRule ]
+    };
+
+    unify_selected(document.documentElement, 'a', matchRule, rewriteRule, document, 'structural');
+    expect(document.body.innerHTML).toBe('<mark><a href="/x">link <b>text</b></a></mark>');
+});
+
+test('unify: delete', () => {
+    let dom = new JSDOM('<html><body><p>a</p><img><p>b</p></body></html>');
+    let document = dom.window.document;
+
+    unify_selected(document.documentElement, 'img', { tag: 'img', attrs: [], children: [] }, { tag: null, attrs: [], children: [] }, document, 'delete');
+    expect(document.body.innerHTML).toBe('<p>a</p><p>b</p>');
+});
+
+test('Match: any depth filter', () => {
+    const dom = new JSDOM('<div><p><b><img></b></p></div><div><p></p></div>');
+    const [withImage, withoutImage] = dom.window.document.querySelectorAll('div');
+    const img = { tag: 'img', attrs: [], children: [], nodeType: 'node', filters: [] };
+    const rule = {
+        tag: 'div',
+        attrs: [],
+        children: [{ tag: 'Children', attrs: [], children: [], nodeType: 'node' }],
+        nodeType: 'node',
+        filters: [{ filter_type: '..>', right_arg: img }],
+    };
+
+    expect(match(withImage, rule)).toBe(true);
+    expect(match(withoutImage, rule)).toBe(false);
+
+    // (div,{},C) ..> (b,{},[(img,{},[])])
+    const b = { tag: 'b', attrs: [], children: [img], nodeType: 'node', filters: [] };
+    expect(match(withImage, { ...rule, filters: [{ filter_type: '..>', right_arg: b }] })).toBe(true);
+    expect(match(withImage, { ...rule, filters: [{ filter_type: '..>', right_arg: { ...b, children: [] } }] })).toBe(false);
+});
+
+
+test('Set matching: wildcards and strict sizes', () => {
+    let set = (...members) => ({ nodeType: 'set', members });
+    let foo = { nodeType: 'string', value: 'foo' };
+
+    expect(matchSet(new Set(['foo', 'bar']), set(foo))).toBe(false);
+    expect(matchSet(new Set(['foo', 'bar']), set(foo, { nodeType: 'wildcard' }))).toBe(true);
+    expect(matchSet(new Set(['foo']), set(foo, { nodeType: 'wildcard' }))).toBe(false);
+    expect(matchSet(new Set(['bar']), set(foo, { nodeType: 'ellipsis' }))).toBe(false);
+});
+
+test('Match attributes', () => {
+    let dom = new JSDOM('<p id="x" class="foo  bar" hidden></p>');
+    let p = dom.window.document.querySelector('p');
+    let key = (value) => ({ value, nodeType: 'string' });
+    let rule = (...attrs) => ({ tag: 'p', attrs, children: [], nodeType: 'node', filters: [] });
+
+    expect(match(p, rule([ key('id'), key('x') ]))).toBe(true);
+    expect(match(p, rule([ key('id'), key('y') ]))).toBe(false);
+    expect(match(p, rule([ key('class'), key('foo bar') ]))).toBe(true);
+    expect(match(p, rule([ key('hidden'), { nodeType: 'wildcard' } ]))).toBe(true);
+    expect(match(p, rule([ key('title'), { nodeType: 'wildcard' } ]))).toBe(false);
+    expect(match(p, rule([ key('class'), { nodeType: 'set', members: [ key('foo'), { nodeType: 'ellipsis' } ] } ]))).toBe(true);
+    // Variables don't constrain the attributes
+    expect(match(p, rule({ tag: 'Attrs', attrs: [], children: [] }))).toBe(true);
+});
+
+test('unify_tree: class patterns only rewrite matching elements (ask-hn)', () => {
+    const html = fs.readFileSync(path.join(__dirname, '../../../tests/data/ask-hn-oct-24.html'), 'utf8');
+    let document = new JSDOM(html).window.document;
+
+    // (td,{"class": {"title"}},C) = (th,{},C), as serialized by runtime/js/emitter.py (see test_runtime.py)
+    const children = [ { tag: 'C', attrs: [], children: [], nodeType: 'node', filters: [] } ];
+    const matchRule = {
+        tag: 'td',
+        attrs: [ [ { value: 'class', nodeType: 'string' }, { members: [ { value: 'title', nodeType: 'string' } ], nodeType: 'set' } ] ],
+        children,
+        nodeType: 'node',
+        filters: []
+    };
+    const rewriteRule = { tag: 'th', attrs: [], children, nodeType: 'node', filters: [] };
+
+    let cells = document.querySelectorAll('td').length;
+    let titles = document.querySelectorAll('td.title').length;
+    expect(titles).toBe(2);
+
+    unify_tree(document.documentElement, matchRule, rewriteRule, document, 'rename');
+    expect(document.querySelectorAll('th').length).toBe(titles);
+    expect(document.querySelectorAll('td').length).toBe(cells - titles);
+});
+
+test('unify_selected: attribute selectors narrow the candidates (ask-hn)', () => {
+    const html = fs.readFileSync(path.join(__dirname, '../../../tests/data/ask-hn-oct-24.html'), 'utf8');
+    let selectedDocument = new JSDOM(html).window.document;
+    let walkedDocument = new JSDOM(html).window.document;
+
+    // (a,{"href": _, "class": {"clicky", ...}},C) = (), as serialized by runtime/js/emitter.py
+    const matchRule = {
+        tag: 'a',
+        attrs: [
+            [ { value: 'href', nodeType: 'string' }, { nodeType: 'wildcard' } ],
+            [ { value: 'class', nodeType: 'string' }, { members: [ { value: 'clicky', nodeType: 'string' }, { nodeType: 'ellipsis' } ], nodeType: 'set' } ]
+        ],
+        children: [ { tag: 'C', attrs: [], children: [], nodeType: 'node', filters: [] } ],
+        nodeType: 'node',
+        filters: []
+    };
+    const rewriteRule = { tag: null, attrs: [], children: [], nodeType: 'node', filters: [] };
+    // css_selector(matchRule) in runtime/js/selector.py
+    const selector = 'a.clicky[href]';
+
+    let candidates = selectedDocument.querySelectorAll(selector).length;
+    expect(candidates).toBeGreaterThan(0);
+    expect(candidates).toBeLessThan(selectedDocument.querySelectorAll('a').length);
+
+    unify_selected(selectedDocument.documentElement, selector, matchRule, rewriteRule, selectedDocument, 'delete');
+    unify_tree(walkedDocument.documentElement, matchRule, rewriteRule, walkedDocument, 'delete');
+    expect(selectedDocument.querySelectorAll('a.clicky').length).toBe(0);
+    expect(selectedDocument.documentElement.outerHTML).toBe(walkedDocument.documentElement.outerHTML);
+});
+
+test('unify_tree: right side wildcards (shared with test_runtime.py)', () => {
+    // '_' on the right side is the matched element's tag, or its children
+    const cases = JSON.parse(fs.readFileSync(path.join(__dirname, '../../../tests/data/right-wildcard.json'), 'utf8'));
+    for (const { match_rule, rewrite_rule, kind, html, expected } of cases) {
+        for (const rewriteKind of new Set([ kind, 'structural' ])) {
+            let document = new JSDOM(html).window.document;
+            unify_tree(document.body, match_rule, rewrite_rule, document, rewriteKind);
+            expect(document.body.innerHTML).toBe(expected);
+        }
+    }
+});
@@ -1,97 +1,837 @@
-from typing import List, Optional, Dict, Tuple
-
-from bs4 import BeautifulSoup, Tag
+from typing import Any, Callable, Iterator, List, Optional, Dict, Tuple, Union
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from enum import StrEnum
 
 import parser.ast as ast
 from lexer.token import Wildcard
+from runtime.attributes import AttributePattern, compile_attribute_pattern
+from runtime.backend import BS4, Backend, Document, Element, backend_for
+from runtime.index import SubtreeIndex, TagIndex, build_subtree_index
+from runtime.traversal import Order, traverse
 
 class UnifyException(Exception):
     ...
 
-def match_bs4(program: ast.HTMLNode, soup: BeautifulSoup) -> List[Tag]:
+class BudgetException(UnifyException):
+    ''' A rewrite took more steps than its budget, eg rules that keep rewriting each other's output to a fixpoint. '''
+    ...
+
+class Mode(StrEnum):
+    ''' How often unify_tree goes over the document. '''
+    # Once: elements built by rewriting aren't matched again
+    SINGLE_PASS = 'single-pass'
+    # Until a pass rewrites nothing; each pass matches what the previous one built
+    FIXPOINT = 'fixpoint'
+
+# Compiled closures (see 'compile')
+MatchFn = Callable[[Element], bool]
+BindFn = Callable[[Element, Dict], None]
+BuildFn = Callable[[Dict, Document], Tuple[Element, List[Element]]]
+AttributesFn = Callable[[Dict], Dict[str, Any]]
+InPlaceFn = Callable[[Element, Dict, Document], None]
+
+# Numbering a document costs about as much as searching it twice. '..>' filters search that many elements
+# before numbering it, so they never cost much more than twice the better of the two.
+NUMBERING_FACTOR = 2.0
+
+# Rewrites a fixpoint may take if not given a budget
+FIXPOINT_BUDGET = 1_000_000
+
+# On a right side '_' is the matched element's tag, and in (_,_,_) its children. 'compile_bind' binds them under
+# these names (variables are capitalised, so they can't clash).
+MATCHED_TAG = '_tag'
+MATCHED_CHILDREN = '_children'
+
+@dataclass
+class Generation:
+    ''' One pass of unify_tree: the elements it built, which it doesn't match, and the rewrites so far. '''
+    # Rewrites allowed over all passes, or None for no limit
+    budget: Optional[int] = None
+    # Rewrites over all passes
+    steps: int = 0
+    # Rewrites in this pass
+    rewrites: int = 0
+    # id(element) -> element, for the elements built in this pass
+    created: Dict[int, Element] = field(default_factory=dict)
+
+    def __contains__(self, node: Element) -> bool:
+        return self.created.get(id(node)) is node
+
+    def step(self):
+        self.steps += 1
+        self.rewrites += 1
+        if self.budget is not None and self.steps > self.budget:
+            raise BudgetException(f'Rewriting took more than {self.budget} steps.')
+
+    def mark(self, backend: Backend, new_node: Element, moved: List[Element]):
+        ''' Record the elements of the replacement 'new_node' that were built, ie not moved from the matched element. '''
+        moved_ids = { id(node) for node in moved }
+        stack = [ new_node ]
+        while stack != []:
+            node = stack.pop()
+            if id(node) in moved_ids:
+                continue
+            self.created[id(node)] = node
+            stack.extend(backend.element_children(node))
+
+    def next(self) -> 'Generation':
+        return Generation(budget=self.budget, steps=self.steps)
+
+@dataclass
+class Numbering:
+    ''' The SubtreeIndex of a document, built once filters have searched enough of the document to pay for it. '''
+    root: Document
+    factor: float = NUMBERING_FACTOR
+    # Elements filters may search before the document is numbered (counted when first needed)
+    budget: Optional[float] = None
+    searched: int = 0
+    index: Optional[SubtreeIndex] = None
+
+    def get(self) -> Optional[SubtreeIndex]:
+        if self.index is None:
+            if self.budget is None:
+                backend = backend_for(self.root)
+                self.budget = self.factor * sum(1 for _ in backend.descendants(self.root))
+            if self.searched >= self.budget:
+                self.index = build_subtree_index(self.root)
+        return self.index
+
+@dataclass
+class Scope:
+    ''' Per document state of a compiled rule, set while 'unify_tree' runs it. '''
+    # Numbers the document for '..>' filters; without it they search the subtree.
+    numbering: Optional[Numbering] = None
+
+@dataclass
+class Program:
+    ''' A NodeUnification specialised into closures that can be applied to many nodes. '''
+    unification: ast.NodeUnification
+    # Concrete left side tag, or None if the left side matches any tag
+    tag: Optional[str]
+    match: MatchFn
+    bind: BindFn
+    # None if the right side is the empty node (ie the match is deleted)
+    build: Optional[BuildFn]
+    # The kind of tree the closures operate on
+    backend: Backend = BS4
+    # Set if the rewrite keeps the children: the matched element is renamed and given its new attributes
+    # instead of being rebuilt (see 'compile_inplace')
+    inplace: Optional[InPlaceFn] = None
+    # The left side's constraints on the matched element's attributes, if any (used to look up candidates in an index)
+    attributes: Optional[AttributePattern] = None
+    # Set if the left side has '..>' filters
+    scope: Optional[Scope] = None
+
+def any_tag(rule: ast.HTMLNode) -> bool:
+    return rule.tag == Wildcard.name or rule.variable
+
+def any_children(rule: ast.HTMLNode) -> bool:
+    ''' (_,_,Children) and (_,_,_) accept any list of children. '''
+    return len(rule.children) == 1 and rule.children[0].children == [] and any_tag(rule.children[0])
+
+def children_variable(rule: ast.HTMLNode) -> Optional[str]:
+    ''' The variable bound to the whole list of children in (_,_,Children), if any. '''
+    if len(rule.children) == 1 and rule.children[0].children == [] and rule.children[0].variable:
+        return rule.children[0].tag
+    return None
+
+def wildcard_children(rule: ast.HTMLNode) -> bool:
+    ''' (_,_,_): on a right side, the matched element's children. '''
+    return len(rule.children) == 1 and rule.children[0].children == [] and rule.children[0].tag == Wildcard.name
+
+def refers_to_match(rule: ast.HTMLNode) -> bool:
+    ''' Whether a right side uses the matched element's tag or children ('_'). '''
+    stack = [ rule ]
+    while stack != []:
+        node = stack.pop()
+        if node.tag == Wildcard.name:
+            return True
+        stack.extend(node.children)
+    return False
+
+def attributes_variable(rule: ast.HTMLNode) -> Optional[str]:
+    ''' The variable bound to all attributes in (_,Attrs,_) or (_,{Attrs, ...},_), if any. '''
+    for entry in rule.attrs:
+        if isinstance(entry, ast.HTMLNode) and entry.variable:
+            return entry.tag
+    return None
+
+def compile_attributes_match(pattern: AttributePattern, backend: Backend = BS4) -> MatchFn:
+    attribute, attribute_tokens = backend.attribute, backend.attribute_tokens
+    values, present, sets = pattern.values, pattern.present, pattern.sets
+
+    def match_attributes(node: Element) -> bool:
+        for name, value in values:
+            if attribute(node, name) != value:
+                return False
+        for name in present:
+            if attribute(node, name) is None:
+                return False
+        for name, set_pattern in sets:
+            tokens = attribute_tokens(node, name)
+            if tokens is None or not set_pattern.matches(tokens):
+                return False
+        return True
+
+    return match_attributes
+
+def has_filters(rule: ast.HTMLNode) -> bool:
+    stack = [ rule ]
+    while stack != []:
+        node = stack.pop()
+        if node.filters != []:
+            return True
+        stack.extend(node.children)
+    return False
+
+def compile_filter(filter: ast.BinaryFilter, backend: Backend = BS4, scope: Optional[Scope] = None) -> MatchFn:
+    ''' (...) ..> Pattern: some element below the node, at any depth, matches Pattern.
+
+    Once the document is numbered (see 'numbered'), only the descendants with Pattern's tag are tried, and a pattern
+    that is just a tag is decided by a binary search. Until then the subtree is searched. Variables in Pattern aren't bound. '''
+    pattern = filter.right_arg
+    tag = None if any_tag(pattern) else pattern.tag
+    name, element_children = backend.tag, backend.element_children
+
+    def descendants(node: Element) -> Iterator[Element]:
+        # Lazily, in document order: a search often stops early (bs4's 'descendants' first walks to the last one)
+        stack = element_children(node)
+        stack.reverse()
+        while stack != []:
+            node = stack.pop()
+            yield node
+            children = element_children(node)
+            children.reverse()
+            stack.extend(children)
+
+    # (tag,_,_) and (tag,{},Children): only the tag matters
+    only_tag = any_children(pattern) and compile_attribute_pattern(pattern.attrs) is None and pattern.filters == []
+    match_pattern = None if only_tag else compile_match(pattern, backend, scope)
+
+    def contains_match(node: Element) -> bool:
+        numbering = scope.numbering if scope is not None else None
+        index = numbering.get() if numbering is not None else None
+        if index is not None:
+            if only_tag:
+                contained = index.contains(node, tag)
+                if contained is not None:
+                    return contained
+            else:
+                candidates = index.descendants(node, tag)
+                if candidates is not None:
+                    return any(match_pattern(candidate) for candidate in candidates)
+
+        searched = 0
+        found = False
+        for descendant in descendants(node):
+            searched += 1
+            if (tag is None or name(descendant) == tag) and (only_tag or match_pattern(descendant)):
+                found = True
+                break
+
+        if numbering is not None:
+            numbering.searched += searched
+        return found
+
+    return contains_match
+
+def compile_match(rule: ast.HTMLNode, backend: Backend = BS4, scope: Optional[Scope] = None) -> MatchFn:
+    match_rule = compile_node_match(rule, backend, scope)
+    if rule.filters == []:
+        return match_rule
+
+    # Filters are checked last: they look at the whole subtree
+    filters = [ compile_filter(filter, backend, scope) for filter in rule.filters ]
+
+    def match_filtered(node: Element) -> bool:
+        if not match_rule(node):
+            return False
+        for match_filter in filters:
+            if not match_filter(node):
+                return False
+        return True
+
+    return match_filtered
+
+def compile_node_match(rule: ast.HTMLNode, backend: Backend = BS4, scope: Optional[Scope] = None) -> MatchFn:
+    ''' Match the tag, attributes and children of 'rule'. '''
+    match_structure = compile_structure_match(rule, backend, scope)
+    pattern = compile_attribute_pattern(rule.attrs)
+    if pattern is None:
+        return match_structure
+
+    # Attributes are checked after the tag and before the children
+    tag = None if any_tag(rule) else rule.tag
+    name = backend.tag
+    match_attributes = compile_attributes_match(pattern, backend)
+
+    def match(node: Element) -> bool:
+        if tag is not None and name(node) != tag:
+            return False
+        return match_attributes(node) and match_structure(node)
+
+    return match
+
+def compile_structure_match(rule: ast.HTMLNode, backend: Backend = BS4, scope: Optional[Scope] = None) -> MatchFn:
+    ''' Match the tag and children of 'rule', ignoring its attributes. '''
+    tag = None if any_tag(rule) else rule.tag
+    name = backend.tag
+    element_children = backend.element_children
+
+    # (_,_,Children)
+    if any_children(rule):
+        if tag is None:
+            return lambda node: True
+        return lambda node: name(node) == tag
+
+    # (_,_,[])
+    if rule.children == []:
+        has_element_children = backend.has_element_children
+
+        def match_leaf(node: Element) -> bool:
+            if tag is not None and name(node) != tag:
+                return False
+            return not has_element_children(node)
+
+        return match_leaf
+
+    # (_,_,[(...), ...])
+    child_matchers = [ compile_match(child, backend, scope) for child in rule.children ]
+    arity = len(child_matchers)
+
+    def match_children(node: Element) -> bool:
+        if tag is not None and name(node) != tag:
+            return False
+        children = element_children(node)
+        if len(children) != arity:
+            return False
+        for child_match, child in zip(child_matchers, children):
+            if not child_match(child):
+                return False
+        return True
+
+    return match_children
+
+def compile_bind(rule: ast.HTMLNode, backend: Backend = BS4, matched: bool = False) -> BindFn:
+    ''' Bind the variables of the left side 'rule', and if 'matched' the MATCHED_TAG and MATCHED_CHILDREN of the element. '''
+    steps = []
+    name = backend.tag
+    element_children = backend.element_children
+
+    if matched:
+        def bind_matched(node: Element, vars: Dict):
+            vars[MATCHED_TAG] = name(node)
+            vars[MATCHED_CHILDREN] = element_children(node)
+
+        steps.append(bind_matched)
+
+    # TODO: Handle multiple occurrences
+    if rule.variable:
+        tag_name = rule.tag
+
+        def bind_tag(node: Element, vars: Dict):
+            vars[tag_name] = name(node)
+
+        steps.append(bind_tag)
+
+    attributes_name = attributes_variable(rule)
+    if attributes_name is not None:
+        attributes = backend.attributes
+
+        def bind_attributes(node: Element, vars: Dict):
+            vars[attributes_name] = attributes(node)
+
+        steps.append(bind_attributes)
+
+    children_name = children_variable(rule)
+    if children_name is not None:
+        def bind_children_list(node: Element, vars: Dict):
+            vars[children_name] = element_children(node)
+
+        steps.append(bind_children_list)
+    else:
+        child_binders = [ (i, compile_bind(child, backend)) for i, child in enumerate(rule.children) ]
+        # Subtrees without variables need not be visited at all.
+        child_binders = [ (i, bind) for i, bind in child_binders if bind is not bind_nothing ]
+        if child_binders != []:
+            def bind_children(node: Element, vars: Dict):
+                children = element_children(node)
+                for i, bind in child_binders:
+                    if i < len(children):
+                        bind(children[i], vars)
+
+            steps.append(bind_children)
+
+    match steps:
+        case []:
+            return bind_nothing
+        case [ step ]:
+            return step
+
+    def bind_all(node: Element, vars: Dict):
+        for step in steps:
+            step(node, vars)
+
+    return bind_all
+
+def bind_nothing(node: Element, vars: Dict):
+    ...
+
+def compile_attributes(attrs: List) -> AttributesFn:
+    ''' The attributes of a right side element: variables bound to attributes are merged, then strings are set. '''
+    steps = []
+    for entry in attrs:
+        if isinstance(entry, (ast.HTMLNode, ast.UnpackNode)):
+            name = entry.tag if isinstance(entry, ast.HTMLNode) else entry.variable.tag
+            steps.append((name, None))
+        elif isinstance(entry, (tuple, list)):
+            key, value = entry
+            if isinstance(value, ast.String):
+                steps.append((key.value, value.value))
+            elif isinstance(value, ast.Set):
+                steps.append((key.value, [ member.value for member in value.members if isinstance(member, ast.String) ]))
+        # Ellipses and wildcards don't describe a value
+
+    def attributes(variables: Dict) -> Dict[str, Any]:
+        values = dict()
+        for key, value in steps:
+            if value is not None:
+                values[key] = value
+                continue
+
+            if key not in variables:
+                raise UnifyException(f'Variable {key} definition missing.')
+            values.update(variables[key])
+
+        return values
+
+    return attributes
+
+def compile_build(rule: ast.HTMLNode, backend: Backend = BS4) -> BuildFn:
+    tag = rule.tag
+    tag_variable = rule.variable
+    # (_,...) keeps the matched element's tag
+    if tag == Wildcard.name:
+        tag, tag_variable = MATCHED_TAG, True
+    new_element, append, extend = backend.new_element, backend.append, backend.extend
+    set_attributes = backend.set_attributes
+    attributes = compile_attributes(rule.attrs) if rule.attrs != [] else None
+
+    # Special case where the list is a variable. The moved children are what is left to visit; the built
+    # elements around them are marked by unify_tree so they aren't matched again (see 'Generation').
+    children_name = children_variable(rule) or (MATCHED_CHILDREN if wildcard_children(rule) else None)
+    child_builders = [] if children_name else [ compile_build(child, backend) for child in rule.children ]
+
+    def build(variables: Dict, soup: Document) -> Tuple[Element, List[Element]]:
+        name = tag
+        # If the right tag is a variable, set it to the variable's value
+        if tag_variable:
+            name = variables.get(tag)
+            if name is None:
+                raise UnifyException(f'Variable {tag} definition missing.')
+
+        new_tag = new_element(soup, name)
+        if attributes is not None:
+            set_attributes(new_tag, attributes(variables))
+
+        if children_name:
+            if children_name not in variables:
+                raise UnifyException(f'Variable {children_name} definition missing.')
+            children = variables[children_name]
+            extend(new_tag, children)
+            return new_tag, list(children)
+
+        remaining_children = []
+        for build_child in child_builders:
+            child, child_remainder = build_child(variables, soup)
+            append(new_tag, child)
+            remaining_children.extend(child_remainder)
+
+        return new_tag, remaining_children
+
+    return build
+
+def keeps_children(unification: ast.NodeUnification) -> bool:
+    ''' Whether the replacement has exactly the element children of the matched element.
+
+    Shared with the JS runtime (runtime.js.classify), so both rewrite the same rules in place. '''
+    left, right = unification.left, unification.right
+    if left.children == [] and right.children == []:
+        return True
+
+    # (_,_,Children) = (_,_,Children), (_,_,_) = (_,_,_)
+    return any_children(left) and any_children(right) and left.children[0].tag == right.children[0].tag
+
+def compile_inplace(unification: ast.NodeUnification, backend: Backend = BS4) -> Optional[InPlaceFn]:
+    ''' If the rewrite only changes the tag and attributes of the matched element, do that to the element itself.
+
+    The result is what 'compile_build' would build (text directly below the element is dropped too)
+    without allocating an element and moving the children into it. '''
+    right = unification.right
+    if right.tag is None or not keeps_children(unification):
+        return None
+
+    # None if the matched element keeps its tag ('_')
+    tag = None if right.tag == Wildcard.name else right.tag
+    tag_variable = right.variable
+    attributes = compile_attributes(right.attrs)
+    name, rename, set_attributes, drop_text = backend.tag, backend.rename, backend.set_attributes, backend.drop_text
+
+    def inplace(node: Element, variables: Dict, soup: Document):
+        new_name = tag
+        if tag_variable:
+            new_name = variables.get(tag)
+            if new_name is None:
+                raise UnifyException(f'Variable {tag} definition missing.')
+
+        if new_name is not None and name(node) != new_name:
+            rename(soup, node, new_name)
+        set_attributes(node, attributes(variables))
+        drop_text(node)
+
+    return inplace
+
+def compile(unification: ast.NodeUnification, backend: Backend = BS4, inplace: bool = True) -> Program:
+    ''' Compile a unification once so it can be applied to any number of nodes without re-reading the AST.
+
+    Unless 'inplace' is False, rewrites that keep the children mutate the matched element instead of replacing it. '''
+    left, right = unification.left, unification.right
+    if has_filters(right):
+        raise UnifyException('Filters (..>) are only allowed on the left side.')
+    scope = Scope() if has_filters(left) else None
+
+    return Program(
+        unification=unification,
+        tag=None if any_tag(left) else left.tag,
+        match=compile_match(left, backend, scope),
+        bind=compile_bind(left, backend, matched=refers_to_match(right)),
+        build=None if right.tag is None else compile_build(right, backend),
+        backend=backend,
+        inplace=compile_inplace(unification, backend) if inplace else None,
+        attributes=compile_attribute_pattern(left.attrs),
+        scope=scope)
+
+@dataclass(frozen=True)
+class RuleTest:
+    ''' What a decision tree knows of a left side: the tag, number and tags of the element children it accepts. '''
+    # None if any
+    tag: Optional[str]
+    # Number of element children, or None if any
+    arity: Optional[int]
+    # Tag per child (None where any), or None if no child's tag is known
+    child_tags: Optional[Tuple[Optional[str], ...]]
+
+    def accepts(self, arity: int, child_tags: Optional[Tuple[str, ...]]) -> bool:
+        if self.arity is None:
+            return True
+        if self.arity != arity:
+            return False
+        if self.child_tags is None or child_tags is None:
+            return True
+        return all(tag is None or tag == child_tag for tag, child_tag in zip(self.child_tags, child_tags))
+
+def rule_test(rule: ast.HTMLNode) -> RuleTest:
+    tag = None if any_tag(rule) else rule.tag
+    if any_children(rule):
+        return RuleTest(tag=tag, arity=None, child_tags=None)
+
+    child_tags = tuple(None if any_tag(child) else child.tag for child in rule.children)
+    if all(child_tag is None for child_tag in child_tags):
+        child_tags = None
+    return RuleTest(tag=tag, arity=len(rule.children), child_tags=child_tags)
+
+@dataclass
+class Branch:
+    ''' The rules that may match elements of one tag, split further on the elements' children. '''
+    rules: List[Tuple[int, Program, RuleTest]]
+    # Whether some rule tests the children's tags, not just their number
+    child_tags: bool
+    # Number of children (and their tags) -> the rules that may match, filled in as elements are seen
+    table: Dict[Any, List[Tuple[int, Program]]] = field(default_factory=dict)
+
+class DecisionTree:
+    ''' The left sides of a rule set merged into one tag -> number of children -> child tags trie.
+
+    Looking an element up costs one lookup per level whatever the number of rules, and yields the rules that
+    may match it in rule order; only their 'match' runs. Levels are built as elements reach them, and a tag
+    is only split on the children if more than one rule may match it. '''
+
+    def __init__(self, rules: List[Tuple[int, Program]], backend: Backend = BS4):
+        self.rules = [ (position, program, rule_test(program.unification.left)) for position, program in rules ]
+        self.name = backend.tag
+        self.element_children = backend.element_children
+        self.tags: Dict[str, Union[Branch, List[Tuple[int, Program]]]] = {}
+
+    def branch(self, tag: str) -> Union[Branch, List[Tuple[int, Program]]]:
+        rules = [ rule for rule in self.rules if rule[2].tag in (None, tag) ]
+        if len(rules) <= 1 or all(test.arity is None for _, _, test in rules):
+            return [ (position, program) for position, program, _ in rules ]
+        return Branch(rules=rules, child_tags=any(test.child_tags is not None for _, _, test in rules))
+
+    def candidates(self, node: Element) -> List[Tuple[int, Program]]:
+        tag = self.name(node)
+        branch = self.tags.get(tag)
+        if branch is None:
+            branch = self.tags[tag] = self.branch(tag)
+        if not isinstance(branch, Branch):
+            return branch
+
+        children = self.element_children(node)
+        child_tags = tuple(self.name(child) for child in children) if branch.child_tags else None
+        key = (len(children), child_tags)
+        rules = branch.table.get(key)
+        if rules is None:
+            rules = branch.table[key] = [ (position, program) for position, program, test in branch.rules if test.accepts(*key) ]
+        return rules
+
+@dataclass
+class RuleSet:
+    ''' Compiled rules with a tag-keyed dispatch table so one traversal applies all of them. '''
+    programs: List[Program]
+    # Tag -> (rule position, program) for every rule that may match the tag, in rule order
+    table: Dict[str, List[Tuple[int, Program]]]
+    # Rules matching any tag (wildcard or variable left side)
+    any_tag: List[Tuple[int, Program]]
+    backend: Backend = BS4
+    # Narrows the rules down by the element's children too (see 'DecisionTree')
+    tree: Optional[DecisionTree] = None
+    # Called with every element offered to the rules, before dispatch (see runtime.stats)
+    visit: Optional[Callable[[Element], None]] = None
+
+    def dispatch(self, tag: str) -> List[Tuple[int, Program]]:
+        return self.table.get(tag, self.any_tag)
+
+    def candidates(self, node: Element) -> List[Tuple[int, Program]]:
+        ''' The rules that may match 'node', in rule order. '''
+        if self.tree is None:
+            return self.dispatch(self.backend.tag(node))
+        return self.tree.candidates(node)
+
+def compile_rules(unifications: List[Union[ast.NodeUnification, Program]], backend: Backend = BS4, decision_tree: bool = True) -> RuleSet:
+    programs = [ as_program(unification, backend) for unification in unifications ]
+    rules = list(enumerate(programs))
+    any_tag = [ (position, program) for position, program in rules if program.tag is None ]
+
+    table = dict()
+    for position, program in rules:
+        if program.tag is not None and program.tag not in table:
+            table[program.tag] = [ rule for rule in rules if rule[1].tag in (None, program.tag) ]
+
+    tree = DecisionTree(rules, backend) if decision_tree else None
+    return RuleSet(programs=programs, table=table, any_tag=any_tag, backend=backend, tree=tree)
+
+def as_program(unification: Union[ast.NodeUnification, Program], backend: Backend = BS4) -> Program:
+    ''' Compile 'unification' for 'backend' unless it already is. '''
+    if isinstance(unification, Program):
+        if unification.backend.compatible(backend):
+            return unification
+        unification = unification.unification
+    return compile(unification, backend)
+
+def match_bs4(program: ast.HTMLNode, soup: Document, index: Optional[TagIndex] = None) -> List[Element]:
+    if index is not None and not any_tag(program):
+        return index.candidates(program.tag)
+
+    backend = backend_for(soup)
     matches = []
-    for node in soup.descendants:
-        if isinstance(node, Tag) and node.name == program.tag:
+    for node in backend.descendants(soup):
+        if backend.tag(node) == program.tag:
             matches.append(node)
     
     return matches
 
 # Variables is a str/value dictionary (TODO; some sort of sum type for this)
 # TODO: Enumerate possibities to account for semantics (enums your friend here..?)
-def build_tag(variables, replacement_node: ast.HTMLNode, soup: BeautifulSoup) -> Tuple[Tag, List[ast.HTMLNode]]:
-    remaining_children = []
-    tag = replacement_node.tag
-    # If the right tag is a variable, set it to the variable's value
-    if replacement_node.variable:
-        tag = variables[tag]
-        if tag is None:
-            raise UnifyException(f'Variable {tag} definition missing.')
-    
-    # Handle children as a list or var
-    new_tag = soup.new_tag(tag)
-    # TODO: Attributes (empty for now)
-    # Special case where the list is a variable
-    # TODO: Infinite loop since the same children are iterated again
-    if len(replacement_node.children) == 1 and replacement_node.children[0].variable:
-        # TODO: Return future children to iterate here..?
-        # (ie recursively extend a list of 'remaining_children', return it.)
-        new_tag.extend(variables[replacement_node.children[0].tag])
-        remaining_children.extend(variables[replacement_node.children[0].tag])
-    else:
-        child_tags = [ build_tag(variables, replacement_node=child, soup=soup) for child in replacement_node.children ]
-        if child_tags != []:
-            new_tag.extend([ child[0] for child in child_tags ])
-            for child in child_tags:
-                remaining_children.extend(child[1])
+def build_tag(variables, replacement_node: ast.HTMLNode, soup: Document) -> Tuple[Element, List[Element]]:
+    return compile_build(replacement_node, backend_for(soup))(variables, soup)
 
-    return new_tag, remaining_children
-
-def extract_variables(match_rule: ast.HTMLNode, matched_node: Tag) -> Dict:
+def extract_variables(match_rule: ast.HTMLNode, matched_node: Element) -> Dict:
     vars = dict()
-    # TODO: Handle multiple occurrences
-    if match_rule.variable:
-        vars[match_rule.tag] = matched_node.name
+    compile_bind(match_rule, backend_for(matched_node))(matched_node, vars)
+    return vars
 
-    if len(match_rule.children) == 1 and match_rule.children[0].variable:
-        vars[match_rule.children[0].tag] = [ child for child in matched_node.children if isinstance(child, Tag) ]
-        return vars
-    
-    matched_node_children = [ child for child in matched_node.children if isinstance(child, Tag) ]
-    # TODO: Handle attributes
-    # TODO: Sanity checks?
-    for child_rule, child_node in zip(match_rule.children, matched_node_children):
-        vars = { **vars, **extract_variables(child_rule, child_node) }
+def unchanged(backend: Backend, node: Element, tag: str, attributes: Dict[str, Any], children: List[Element]) -> bool:
+    ''' Whether 'node' has 'tag', 'attributes' and (the same) element 'children'. '''
+    new_children = backend.element_children(node)
+    return (backend.tag(node) == tag and backend.attributes(node) == attributes
+            and len(new_children) == len(children) and all(new is old for new, old in zip(new_children, children)))
 
-    return vars
+def substitute(program: Program, node: Element, soup: Document, index: Optional[TagIndex] = None, generation: Optional[Generation] = None) -> Tuple[Optional[Element], List[Element]]:
+    ''' Build the replacement of a node already matched by 'program' (or delete it, or change it in place).
 
-def unify(unification: ast.NodeUnification, node: Tag, soup: BeautifulSoup) -> Tuple[Optional[Tag], List[ast.HTMLNode]]:
+    Only rewrites that change the tree are counted in 'generation', so idempotent rules reach a fixpoint. '''
+    backend = program.backend
+    if program.build is None:
+        if generation is not None:
+            generation.step()
+        if index is not None:
+            index.remove(node)
+        backend.delete(node)
+        return (None, [])
+
+    vars = dict()
+    program.bind(node, vars)
+    tag, attributes = backend.tag(node), backend.attributes(node)
+    if program.inplace is not None:
+        children = backend.element_children(node)
+        program.inplace(node, vars, soup)
+        if generation is not None and not unchanged(backend, node, tag, attributes, children):
+            generation.step()
+        if index is not None and backend.tag(node) != tag:
+            index.rename(node, tag)
+        if index is not None and index.indexes_attributes:
+            index.update_attributes(node, attributes)
+        return (node, backend.element_children(node))
+
+    children = backend.element_children(node) if generation is not None else None
+    new_node, remainder = program.build(vars, soup)
+    if generation is not None:
+        # A replacement just like the matched element (with its children moved into it) changes nothing
+        if not unchanged(backend, new_node, tag, attributes, children):
+            generation.step()
+        generation.mark(backend, new_node, remainder)
+    return new_node, remainder
+
+def unify(unification: Union[ast.NodeUnification, Program], node: Element, soup: Document, index: Optional[TagIndex] = None) -> Tuple[Optional[Element], List[Element]]:
     ''' If the left unification node matches node, replace node with the right unification node. '''
+    program = as_program(unification, backend_for(node))
 
     # A left side match occurs with the node.
-    if unification.left.tag == node.name or unification.left.tag == Wildcard.name:
-        if unification.right.tag is None:
-            node.decompose()
-            return (None, [])
-        else:
-            vars = extract_variables(unification.left, node)
-            new_tag = build_tag(variables=vars, replacement_node=unification.right, soup=soup)
-            return new_tag
+    if program.match(node):
+        return substitute(program, node, soup=soup, index=index)
     else:
         # No left side match so return the node unmodified.
-        return (node, [ e for e in node.children if isinstance(e, Tag) ])
+        return (node, program.backend.element_children(node))
 
-def unify_tree(unification: ast.NodeUnification, root: Tag, soup: BeautifulSoup) -> Tag:
-    #root = root.replace_with(unify(unification, root, soup=soup))
-    children = [ e for e in root.children if isinstance(e, Tag) ]
+def replace(backend: Backend, node: Element, new_node: Optional[Element], remainder: List[Element], index: Optional[TagIndex] = None):
+    ''' Put the result of 'unify' in place of 'node'. '''
+    if new_node is not None and new_node is not node:
+        if index is not None:
+            # The moved children now belong to 'new_node'; only detached leftovers remain under 'node'.
+            index.remove(node)
+            index.add(new_node, moved=remainder)
+        backend.replace(node, new_node)
 
-    while children != []:
-        child = children.pop(0)
-        new_child, remainder = unify(unification, child, soup=soup)
-        if new_child is None:
-            continue
-        if child != new_child:
-            child.replace_with(new_child)
+def rewrite(program: Program, node: Element, soup: Document, index: Optional[TagIndex] = None, generation: Optional[Generation] = None) -> Tuple[Optional[Element], List[Element]]:
+    ''' Unify 'node' in place in its tree; return its replacement and the elements left to visit.
 
-        children.extend(remainder)
-    
-    return root
\ No newline at end of file
+    Elements built earlier in the same 'generation' aren't matched, only looked through. '''
+    if (generation is not None and node in generation) or not program.match(node):
+        return (node, program.backend.element_children(node))
+
+    new_node, remainder = substitute(program, node, soup=soup, index=index, generation=generation)
+    replace(program.backend, node, new_node, remainder, index=index)
+    return new_node, remainder
+
+def rewrite_rules(rules: RuleSet, node: Element, soup: Document, index: Optional[TagIndex] = None, generation: Optional[Generation] = None) -> List[Element]:
+    ''' Apply every rule in 'rules' to 'node' in rule order and return the elements left to visit.
+
+    A node rewritten by a rule is only offered to the rules after it. Elements built earlier in the same
+    'generation' aren't matched, only looked through. '''
+    backend = rules.backend
+    if generation is not None and node in generation:
+        return backend.element_children(node)
+    if rules.visit is not None:
+        rules.visit(node)
+
+    remainder = None
+    position = -1
+    while True:
+        for rule_position, program in rules.candidates(node):
+            if rule_position > position and program.match(node):
+                break
+        else:
+            return backend.element_children(node) if remainder is None else remainder
+
+        position = rule_position
+        new_node, remainder = substitute(program, node, soup=soup, index=index, generation=generation)
+        replace(backend, node, new_node, remainder, index=index)
+        node = new_node
+        if node is None:
+            return remainder
+
+@contextmanager
+def numbered(programs: List[Program], root: Document, order: Order):
+    ''' Number the document below 'root' for the '..>' filters of 'programs' while they run. '''
+    scopes = [ program.scope for program in programs if program.scope is not None ]
+    # The numbering only stays valid if subtrees are queried before they're rewritten
+    if scopes == [] or order == Order.POST_ORDER:
+        yield
+        return
+
+    # Numbered when first needed, ie as the document is then. Elements queried later haven't had
+    # their subtrees rewritten since, so the numbering holds for them.
+    numbering = Numbering(root, factor=NUMBERING_FACTOR)
+    for scope in scopes:
+        scope.numbering = numbering
+    try:
+        yield
+    finally:
+        for scope in scopes:
+            scope.numbering = None
+
+def unify_tree(unification: Union[ast.NodeUnification, Program, RuleSet], root: Document, soup: Document, index: Optional[TagIndex] = None, order: Order = Order.BREADTH_FIRST, mode: Mode = Mode.SINGLE_PASS, budget: Optional[int] = None, each_pass: Callable[[], AbstractContextManager] = nullcontext) -> Document:
+    ''' Unify every element below 'root'. If given, 'index' must have been built from 'root' and is kept current.
+
+    Programs run on whichever kind of tree 'root' is (see runtime.backend); they are recompiled if needed.
+    Elements built by a pass aren't matched again in it; with Mode.FIXPOINT passes are repeated until one
+    rewrites nothing. More than 'budget' rewrites (by default FIXPOINT_BUDGET for fixpoints) raise a BudgetException.
+    Every pass runs in a context from 'each_pass' (runtime.memo shapes the document anew for each). '''
+    if budget is None and mode == Mode.FIXPOINT:
+        budget = FIXPOINT_BUDGET
+
+    generation = Generation(budget=budget)
+    while True:
+        with each_pass():
+            unify_pass(unification, root, soup=soup, index=index, order=order, generation=generation)
+        if mode == Mode.SINGLE_PASS or generation.rewrites == 0:
+            return root
+        generation = generation.next()
+
+def unify_pass(unification: Union[ast.NodeUnification, Program, RuleSet], root: Document, soup: Document, index: Optional[TagIndex] = None, order: Order = Order.BREADTH_FIRST, generation: Optional[Generation] = None) -> Document:
+    ''' One pass of 'unify_tree'. '''
+    backend = backend_for(root)
+
+    if isinstance(unification, RuleSet):
+        if len(unification.programs) != 1:
+            if not unification.backend.compatible(backend):
+                unification = compile_rules(unification.programs, backend, decision_tree=unification.tree is not None)
+            return unify_tree_rules(unification, root, soup=soup, index=index, order=order, generation=generation)
+        unification = unification.programs[0]
+
+    program = as_program(unification, backend)
+
+    with numbered([ program ], root, order):
+        # Concrete left side tags (and, if indexed, attributes) only need to visit their candidates
+        # (in document order, ie pre-order).
+        if index is not None and index.covers(program.tag, program.attributes) and order != Order.POST_ORDER:
+            for node in index.candidates(program.tag, program.attributes):
+                # Skip candidates deleted or detached by an earlier rewrite
+                if node in index:
+                    rewrite(program, node, soup=soup, index=index, generation=generation)
+
+            return root
+
+        def visit(node: Element) -> List[Element]:
+            _, remainder = rewrite(program, node, soup=soup, index=index, generation=generation)
+            return remainder
+
+        traverse(root, visit, order=order, children=backend.element_children)
+
+    return root
+
+def unify_tree_rules(rules: RuleSet, root: Document, soup: Document, index: Optional[TagIndex] = None, order: Order = Order.BREADTH_FIRST, generation: Optional[Generation] = None) -> Document:
+    ''' Apply a rule set to every element below 'root' in a single traversal. '''
+    visit = lambda node: rewrite_rules(rules, node, soup=soup, index=index, generation=generation)
+    with numbered(rules.programs, root, order):
+        # As for a single rule, if the index narrows down every rule, only the union of their candidates is visited
+        keys = [ (program.tag, program.attributes) for program in rules.programs ]
+        if index is not None and all(index.covers(*key) for key in keys) and order != Order.POST_ORDER:
+            for node in index.union(keys):
+                if node in index:
+                    visit(node)
+            return root
+
+        traverse(root, visit, order=order, children=rules.backend.element_children)
+    return root
@@ -0,0 +1,236 @@
+from typing import Dict, FrozenSet, List, Optional, Tuple, Union
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import parser.ast as ast
+from runtime.attributes import compile_attribute_pattern
+from runtime.backend import BS4, Backend, Document, Element, backend_for
+from runtime.index import TagIndex
+from runtime.matcher import Mode, Program, RuleSet, any_children, compile_rules, unify_tree as unify_tree_unmemoized
+from runtime.traversal import Order
+
+# Memoized match outcomes: rules are opted in with 'memoize' and run with 'unify_tree' below.
+#
+# An element's shape at depth d is its tag, the values of the attributes any rule looks at and, for d > 0,
+# the shapes at depth d - 1 of its element children. A rule whose pattern is d deep decides every element
+# of the same depth d shape the same way, so its outcome is cached per (rule, shape). Shapes are interned
+# as ints and computed once per element and depth, as rules ask for them.
+
+def pattern_depth(rule: ast.HTMLNode) -> Optional[int]:
+    ''' How deep below an element 'rule' looks, or None if it may look at the whole subtree ('..>'). '''
+    if rule.filters != []:
+        return None
+    if any_children(rule):
+        return 0
+    if rule.children == []:
+        return 1
+
+    depths = [ pattern_depth(child) for child in rule.children ]
+    if None in depths:
+        return None
+    return 1 + max(depths)
+
+def pattern_attributes(rule: ast.HTMLNode) -> FrozenSet[str]:
+    ''' The attribute names 'rule' and its child and filter patterns constrain. '''
+    names = set()
+    stack = [ rule ]
+    while stack != []:
+        node = stack.pop()
+        pattern = compile_attribute_pattern(node.attrs)
+        if pattern is not None:
+            names |= pattern.names
+        stack.extend(node.children)
+        stack.extend(filter.right_arg for filter in node.filters)
+
+    return frozenset(names)
+
+class Shapes:
+    ''' The shapes of the elements of one document, computed as rules ask for them. '''
+
+    def __init__(self, memo: 'MatchMemo', attributes: FrozenSet[str], backend: Backend = BS4):
+        self.intern = memo.intern
+        self.attributes = sorted(attributes)
+        self.backend = backend
+        # (id(element), depth) -> (element, shape); None is the depth of whole subtrees
+        self.elements: Dict[Tuple[int, Optional[int]], Tuple[Element, int]] = {}
+
+    def cached(self, node: Element, depth: Optional[int]) -> Optional[int]:
+        entry = self.elements.get((id(node), depth))
+        if entry is None or entry[0] is not node:
+            return None
+        return entry[1]
+
+    def get(self, node: Element, depth: Optional[int]) -> int:
+        entry = self.elements.get((id(node), depth))
+        if entry is not None and entry[0] is node:
+            return entry[1]
+        if depth is None:
+            return self.whole(node)
+
+        if depth == 0:
+            backend = self.backend
+            shape = self.intern((0, backend.tag(node), tuple(backend.attribute(node, name) for name in self.attributes)))
+        else:
+            # Patterns are shallow, so this recursion is too
+            children = tuple(self.get(child, depth - 1) for child in self.backend.element_children(node))
+            shape = self.intern((depth, self.get(node, 0), children))
+
+        self.elements[(id(node), depth)] = (node, shape)
+        return shape
+
+    def whole(self, node: Element) -> int:
+        ''' The shape of the whole subtree below 'node', children before their parents. '''
+        element_children = self.backend.element_children
+        stack = [ (node, False) ]
+        while stack != []:
+            element, expanded = stack.pop()
+            if self.cached(element, None) is not None:
+                continue
+
+            children = element_children(element)
+            if not expanded:
+                stack.append((element, True))
+                stack.extend((child, False) for child in children)
+                continue
+
+            shape = self.intern((None, self.get(element, 0), tuple(self.cached(child, None) for child in children)))
+            self.elements[(id(element), None)] = (element, shape)
+
+        return self.cached(node, None)
+
+    def forget(self, node: Element, depths: List[Optional[int]]):
+        for depth in depths:
+            self.elements.pop((id(node), depth), None)
+
+class MatchMemo:
+    ''' Match outcomes per (rule, shape) in a bounded LRU, and the interned shapes, kept across documents. '''
+
+    def __init__(self, capacity: int = 65536, max_shapes: int = 1 << 20):
+        self.capacity = capacity
+        self.max_shapes = max_shapes
+        self.outcomes: OrderedDict[Tuple[int, int], bool] = OrderedDict()
+        self.shape_ids: Dict[tuple, int] = {}
+        # The shapes of the document being rewritten, if any
+        self.shapes: Optional[Shapes] = None
+        # Rules are numbered as they're memoized, so rule sets can share a memo
+        self.rules = 0
+        self.hits = 0
+        self.misses = 0
+
+    def new_rule(self) -> int:
+        self.rules += 1
+        return self.rules
+
+    def get(self, key: Tuple[int, int]) -> Optional[bool]:
+        outcome = self.outcomes.get(key)
+        if outcome is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.outcomes.move_to_end(key)
+        return outcome
+
+    def put(self, key: Tuple[int, int], outcome: bool):
+        self.outcomes[key] = outcome
+        if len(self.outcomes) > self.capacity:
+            self.outcomes.popitem(last=False)
+
+    def intern(self, shape: tuple) -> int:
+        shape_id = self.shape_ids.get(shape)
+        if shape_id is None:
+            shape_id = self.shape_ids[shape] = len(self.shape_ids)
+        return shape_id
+
+    def new_document(self, attributes: FrozenSet[str], backend: Backend = BS4) -> Shapes:
+        if len(self.shape_ids) > self.max_shapes:
+            # Cached outcomes refer to shape ids, so they go too
+            self.shape_ids.clear()
+            self.outcomes.clear()
+        return Shapes(self, attributes, backend)
+
+@dataclass
+class Memoized:
+    ''' A rule set whose rules consult a MatchMemo (see 'memoize'). '''
+    rules: RuleSet
+    memo: MatchMemo
+    # The attributes the rules look at
+    attributes: FrozenSet[str]
+
+def memoize_program(program: Program, memo: MatchMemo, key: int, depths: List[Optional[int]]) -> Program:
+    ''' A copy of 'program' whose match outcomes are cached by the shape of the element as deep as its pattern looks.
+
+    'depths' are the depths any rule sharing the memo reads shapes at. '''
+    match, inplace, tag, name = program.match, program.inplace, program.tag, program.backend.tag
+    depth = pattern_depth(program.unification.left)
+
+    def memoized_match(node: Element) -> bool:
+        shapes = memo.shapes
+        if shapes is None:
+            return match(node)
+        # Not worth a shape
+        if tag is not None and name(node) != tag:
+            return False
+
+        shape = shapes.get(node, depth)
+        outcome = memo.get((key, shape))
+        if outcome is None:
+            outcome = match(node)
+            memo.put((key, shape), outcome)
+        return outcome
+
+    def forgetting_inplace(node: Element, variables: Dict, soup: Document):
+        inplace(node, variables, soup)
+        # The element keeps its identity but not its shape
+        if memo.shapes is not None:
+            memo.shapes.forget(node, depths)
+
+    memoized = Program(**vars(program))
+    memoized.match = memoized_match
+    memoized.inplace = None if inplace is None else forgetting_inplace
+    return memoized
+
+def memoize(rules: Union[RuleSet, List[Union[ast.NodeUnification, Program]]], memo: Optional[MatchMemo] = None, backend: Backend = BS4) -> Memoized:
+    ''' Opt 'rules' into memoized matching; run the result with 'unify_tree' below.
+
+    Variable binding isn't cached: the compiled 'bind' closures already are a plan of where each variable is read. '''
+    if not isinstance(rules, RuleSet):
+        rules = compile_rules(rules, backend)
+    if memo is None:
+        memo = MatchMemo()
+
+    depths = [ pattern_depth(program.unification.left) for program in rules.programs ]
+    # Every depth an element may have a shape at
+    depths = list(range(max([ depth for depth in depths if depth is not None ], default=0) + 1)) + [ None ]
+
+    attributes = frozenset()
+    for program in rules.programs:
+        attributes |= pattern_attributes(program.unification.left)
+
+    programs = [ memoize_program(program, memo, memo.new_rule(), depths) for program in rules.programs ]
+    return Memoized(rules=compile_rules(programs, rules.backend, decision_tree=rules.tree is not None), memo=memo, attributes=attributes)
+
+@contextmanager
+def shaped(memoized: Memoized, root: Document, order: Order):
+    ''' Shape the document below 'root' while 'memoized' runs on it. '''
+    memo = memoized.memo
+    # Children are rewritten before their parent is matched in post-order, so the parent's shape would be stale
+    if order == Order.POST_ORDER:
+        yield
+        return
+
+    memo.shapes = memo.new_document(memoized.attributes, backend_for(root))
+    try:
+        yield
+    finally:
+        memo.shapes = None
+
+def unify_tree(memoized: Memoized, root: Document, soup: Document, index: Optional[TagIndex] = None, order: Order = Order.BREADTH_FIRST, mode: Mode = Mode.SINGLE_PASS, budget: Optional[int] = None) -> Document:
+    ''' runtime.matcher.unify_tree with memoized matching.
+
+    Shapes are computed before any element is rewritten, anew for every pass. A top-down traversal matches each
+    element before its subtree is rewritten, so its shape still holds; rewritten elements are matched without the memo. '''
+    return unify_tree_unmemoized(
+        memoized.rules, root, soup=soup, index=index, order=order, mode=mode, budget=budget,
+        each_pass=lambda: shaped(memoized, root, order))
@@ -0,0 +1,293 @@
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
+from bisect import bisect_right
+from dataclasses import dataclass, field
+import re
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.formatter import HTMLFormatter
+import bs4
+
+try:
+    from bs4.builder._htmlparser import BeautifulSoupHTMLParser, HTMLParserTreeBuilder
+except ImportError as e:
+    # The classes below can still be defined; 'parse' reports the error
+    BeautifulSoupHTMLParser = HTMLParserTreeBuilder = object
+    import_error: Optional[ImportError] = e
+else:
+    import_error = None
+
+# Output that copies unchanged elements from the source verbatim and only serializes what was rewritten.
+#
+# 'parse' records where every element starts and ends in the source (html.parser documents only) and what it
+# looked like; 'write' serializes a document compactly (like str(document), not prettified) in chunks, and
+# with a Source, copies every element whose subtree is as parsed straight from the source bytes.
+
+CHUNK_SIZE = 1 << 16
+
+# SpanParser hooks into bs4's html.parser driver, which isn't public API. These are the releases it's known to
+# work with (pinned in pyproject.toml); 'parse' raises a SpliceException if the internals it uses are missing.
+BS4_VERSIONS = '>=4.12.3,<4.16'
+
+FORMATTER = HTMLFormatter.REGISTRY['minimal']
+
+NON_ASCII = re.compile(r'[^\x00-\x7f]+')
+
+def line_starts(text: str) -> List[int]:
+    starts = [ 0 ]
+    position = text.find('\n')
+    while position != -1:
+        starts.append(position + 1)
+        position = text.find('\n', position + 1)
+    return starts
+
+class SpanParser(BeautifulSoupHTMLParser):
+    ''' html.parser as bs4 drives it, also recording where each element ends in the source. '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Where the start tag being handled ends, if any
+        self.starttag_end: Optional[int] = None
+
+    def source_offset(self) -> int:
+        line, column = self.getpos()
+        return self.soup.builder.line_starts[line - 1] + column
+
+    def handle_startendtag(self, tag, attrs):
+        self.starttag_end = self.source_offset() + len(self.get_starttag_text())
+        try:
+            super().handle_startendtag(tag, attrs)
+        finally:
+            self.starttag_end = None
+
+    def handle_starttag(self, tag, attrs, handle_empty_element=True):
+        outer = self.starttag_end is None
+        if outer:
+            # Void elements are closed while their start tag is handled
+            self.starttag_end = self.source_offset() + len(self.get_starttag_text())
+        try:
+            super().handle_starttag(tag, attrs, handle_empty_element=handle_empty_element)
+        finally:
+            if outer:
+                self.starttag_end = None
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        stack = self.soup.tagStack
+        open_tags = list(stack)
+        super().handle_endtag(tag, check_already_closed=check_already_closed)
+        closed = open_tags[len(stack):]
+        if closed == []:
+            return
+
+        ends = self.soup.builder.ends
+        if self.starttag_end is not None:
+            # A void element: it ends with its start tag
+            for element in closed:
+                ends[id(element)] = (element, self.starttag_end)
+            return
+
+        # The end tag closes the outermost element; the ones inside it were left open and end where it starts
+        start = self.source_offset()
+        end = self.rawdata.find('>', start) + 1 or len(self.rawdata)
+        ends[id(closed[0])] = (closed[0], end)
+        for element in closed[1:]:
+            ends[id(element)] = (element, start)
+
+class SpanTreeBuilder(HTMLParserTreeBuilder):
+    ''' bs4's html.parser tree builder, recording where elements end (see SpanParser). '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.line_starts: List[int] = []
+        self.ends: Dict[int, Tuple[Tag, int]] = {}
+
+    def feed(self, markup: str):
+        self.line_starts = line_starts(markup)
+        self.ends = {}
+        # bs4 feeds the whole document at once, so the parser's offsets are offsets into 'markup'
+        super().feed(markup, _parser_class=SpanParser)
+
+@dataclass
+class Source:
+    ''' A document's source, where its elements are in it and what they looked like when parsed. '''
+    text: str
+    data: bytes
+    line_starts: List[int]
+    # id(element) -> (element, start, end, name, attrs, contents) as parsed; offsets are characters
+    elements: Dict[int, Tuple[Tag, int, int, str, Dict, List]] = field(default_factory=dict)
+    # The runs of non-ASCII characters in 'text' (start, end) and the bytes they add to the offsets after them
+    # (each run's total includes the runs before it). Empty if the source is ASCII.
+    run_starts: List[int] = field(default_factory=list)
+    run_ends: List[int] = field(default_factory=list)
+    run_extra: List[int] = field(default_factory=list)
+
+    def __post_init__(self):
+        if len(self.data) != len(self.text):
+            extra = 0
+            for run in NON_ASCII.finditer(self.text):
+                extra += len(run.group().encode('utf-8')) - len(run.group())
+                self.run_starts.append(run.start())
+                self.run_ends.append(run.end())
+                self.run_extra.append(extra)
+
+    def byte_offset(self, offset: int) -> int:
+        ''' The offset in 'data' of the character at 'offset' in 'text'. '''
+        run = bisect_right(self.run_starts, offset) - 1
+        if run < 0:
+            return offset
+        if offset >= self.run_ends[run]:
+            return offset + self.run_extra[run]
+
+        # Inside a run: the runs before it, and the part of it before 'offset'
+        start = self.run_starts[run]
+        before = self.run_extra[run - 1] if run > 0 else 0
+        return offset + before + len(self.text[start:offset].encode('utf-8')) - (offset - start)
+
+    def unchanged(self, element: Tag) -> bool:
+        ''' Whether 'element' has its parsed name, attributes and contents (not necessarily its parsed subtree). '''
+        entry = self.elements.get(id(element))
+        if entry is None or entry[0] is not element:
+            return False
+
+        _, _, _, name, attrs, contents = entry
+        if element.name != name or element.attrs is not attrs or len(element.contents) != len(contents):
+            return False
+        return all(child is original for child, original in zip(element.contents, contents))
+
+class SpliceException(Exception):
+    ...
+
+def unsupported(error: Exception) -> SpliceException:
+    return SpliceException(f'Splicing needs beautifulsoup4{BS4_VERSIONS}; bs4 {bs4.__version__} lacks internals it uses ({type(error).__name__}: {error}).')
+
+def parse(html: str) -> Tuple[BeautifulSoup, Source]:
+    ''' Parse 'html' with html.parser, recording its Source for 'write'. '''
+    if import_error is not None:
+        raise unsupported(import_error)
+
+    builder = SpanTreeBuilder()
+    try:
+        document = BeautifulSoup(html, builder=builder)
+    except (AttributeError, TypeError) as e:
+        # Missing attributes (soup.tagStack, builder.feed's _parser_class...) or changed signatures
+        raise unsupported(e)
+
+    source = Source(text=html, data=html.encode('utf-8'), line_starts=builder.line_starts)
+    source.elements[id(document)] = (document, 0, len(html), document.name, document.attrs, list(document.contents))
+    for element in document.descendants:
+        if not isinstance(element, Tag):
+            continue
+
+        if element.sourceline is None:
+            raise unsupported(AttributeError('elements have no source positions'))
+        start = builder.line_starts[element.sourceline - 1] + element.sourcepos
+        # Elements still open at the end of the document end with it
+        _, end = builder.ends.get(id(element), (element, len(html)))
+        source.elements[id(element)] = (element, start, end, element.name, element.attrs, list(element.contents))
+
+    return document, source
+
+def unchanged_subtrees(document: BeautifulSoup, source: Source) -> Set[int]:
+    ''' The ids of the elements whose whole subtree is as parsed, children before their parents. '''
+    unchanged = set()
+    elements = [ document ] + [ element for element in document.descendants if isinstance(element, Tag) ]
+    for element in reversed(elements):
+        if source.unchanged(element) and all(id(child) in unchanged for child in element.contents if isinstance(child, Tag)):
+            unchanged.add(id(element))
+    return unchanged
+
+def start_tag(element: Tag) -> str:
+    ''' The start tag str(element) begins with. '''
+    attributes = []
+    for key, value in FORMATTER.attributes(element):
+        if value is None:
+            attributes.append(key)
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ' '.join(value)
+        attributes.append(f'{key}={FORMATTER.quoted_attribute_value(FORMATTER.attribute_value(str(value)))}')
+
+    prefix = f'{element.prefix}:' if element.prefix else ''
+    attributes = ''.join(f' {attribute}' for attribute in attributes)
+    close = FORMATTER.void_element_close_prefix or '' if element.is_empty_element else ''
+    return f'<{prefix}{element.name}{attributes}{close}>'
+
+def end_tag(element: Tag) -> str:
+    prefix = f'{element.prefix}:' if element.prefix else ''
+    return f'</{prefix}{element.name}>'
+
+class ChunkedOutput:
+    ''' Collects output into chunks of about 'chunk_size' bytes; large source slices are written as they are. '''
+
+    def __init__(self, output: BinaryIO, chunk_size: int = CHUNK_SIZE):
+        self.output = output
+        self.chunk_size = chunk_size
+        self.pieces: List[bytes] = []
+        self.size = 0
+
+    def write(self, text: str):
+        self.append(text.encode('utf-8'))
+
+    def append(self, data):
+        if len(data) >= self.chunk_size:
+            self.flush()
+            self.output.write(data)
+            return
+
+        self.pieces.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pieces != []:
+            self.output.write(b''.join(self.pieces))
+            self.pieces = []
+            self.size = 0
+
+def write(document: BeautifulSoup, output: BinaryIO, source: Optional[Source] = None, chunk_size: int = CHUNK_SIZE):
+    ''' Write 'document' to 'output' as UTF-8, like str(document) but in chunks.
+
+    With the 'source' it was parsed from (see 'parse'), the document is spliced into the source instead: elements
+    whose subtree is as parsed, wherever they are now, are copied from it, and so are the tags and text of elements
+    that only had something below them rewritten. A document that wasn't rewritten is written back byte for byte. '''
+    chunks = ChunkedOutput(output, chunk_size)
+    unchanged = unchanged_subtrees(document, source) if source is not None else set()
+    data = memoryview(source.data) if source is not None else None
+
+    def copy(start: int, end: int):
+        if start < end:
+            chunks.append(data[source.byte_offset(start):source.byte_offset(end)])
+
+    # Elements and text to write, end tags and (start, end) source ranges, in reverse
+    stack = [ document ]
+    while stack != []:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            copy(*node)
+        elif isinstance(node, NavigableString):
+            chunks.write(node.output_ready(FORMATTER))
+        elif isinstance(node, str):
+            chunks.write(node)
+        elif id(node) in unchanged:
+            _, start, end, _, _, _ = source.elements[id(node)]
+            copy(start, end)
+        elif source is not None and source.unchanged(node):
+            # Copy what surrounds the children (its tags and text); the children are written as they are now
+            _, position, end, _, _, _ = source.elements[id(node)]
+            pieces = []
+            for child in node.contents:
+                if isinstance(child, Tag):
+                    _, child_start, child_end, _, _, _ = source.elements[id(child)]
+                    pieces.extend([ (position, child_start), child ])
+                    position = child_end
+            pieces.append((position, end))
+            stack.extend(reversed(pieces))
+        elif node is document:
+            stack.extend(reversed(node.contents))
+        else:
+            chunks.write(start_tag(node))
+            if not node.is_empty_element:
+                stack.append(end_tag(node))
+                stack.extend(reversed(node.contents))
+
+    chunks.flush()
@@ -0,0 +1,154 @@
+from typing import Callable, Dict, List, Optional, Union
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import time
+
+import parser.ast as ast
+from runtime.backend import BS4, Backend, Document, Element
+from runtime.matcher import Program, RuleSet, compile, compile_rules
+
+# Called as hook(event, rule position, element) for 'match', 'create' and 'delete' events
+Hook = Callable[[str, int, Element], None]
+
+PHASES = ('parse', 'match', 'rebuild', 'serialize')
+
+@dataclass
+class RuleStats:
+    rule: str
+    # Elements the traversal offered the rule (before dispatch by tag)
+    visited: int = 0
+    # ... of which had the rule's tag (all of them for wildcard and variable tags)
+    tag_hits: int = 0
+    matches: int = 0
+    # Elements built for replacements
+    created: int = 0
+    deleted: int = 0
+
+@dataclass
+class Stats:
+    ''' Counters and timings collected by an instrumented rule set (see 'instrument'). '''
+    rules: List[RuleStats] = field(default_factory=list)
+    # Seconds per phase. Rebuilding happens while matching; 'report' subtracts it from 'match'.
+    seconds: Dict[str, float] = field(default_factory=lambda: { phase: 0.0 for phase in PHASES })
+    hook: Optional[Hook] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self) -> Dict:
+        seconds = dict(self.seconds)
+        seconds['match'] = max(0.0, seconds.get('match', 0.0) - seconds.get('rebuild', 0.0))
+        return { 'rules': self.rules, 'seconds': seconds }
+
+    def format(self) -> str:
+        report = self.report()
+        lines = [ f'{"rule":<32} {"visited":>9} {"tag hits":>9} {"matches":>9} {"created":>9} {"deleted":>9}' ]
+        for rule in self.rules:
+            lines.append(f'{rule.rule:<32} {rule.visited:>9} {rule.tag_hits:>9} {rule.matches:>9} {rule.created:>9} {rule.deleted:>9}')
+
+        lines.append('')
+        for phase, seconds in report['seconds'].items():
+            lines.append(f'{phase:<10} {seconds * 1000:>10.2f} ms')
+
+        return '\n'.join(lines)
+
+class CountingBackend:
+    ''' Delegates to 'backend', counting the elements one rule creates and deletes. '''
+
+    def __init__(self, backend: Backend, stats: Stats, position: int):
+        self.backend = backend
+        self.stats = stats
+        self.position = position
+        self.rule = stats.rules[position]
+
+    def __getattr__(self, name: str):
+        return getattr(self.backend, name)
+
+    def new_element(self, document: Document, tag: str) -> Element:
+        element = self.backend.new_element(document, tag)
+        self.rule.created += 1
+        if self.stats.hook is not None:
+            self.stats.hook('create', self.position, element)
+        return element
+
+    def delete(self, node: Element):
+        self.rule.deleted += 1
+        if self.stats.hook is not None:
+            self.stats.hook('delete', self.position, node)
+        with self.stats.phase('rebuild'):
+            self.backend.delete(node)
+
+    def compatible(self, other: Backend) -> bool:
+        return self.backend.compatible(other)
+
+def describe(unification: ast.NodeUnification) -> str:
+    left, right = unification.left, unification.right
+    return f'{left.tag} -> {right.tag if right.tag is not None else "()"}'
+
+def instrument_program(program: Program, stats: Stats, position: int, visits: bool) -> Program:
+    ''' A copy of 'program' that records what it does in 'stats'. With 'visits', matching also counts visits. '''
+    rule = stats.rules[position]
+    backend = program.backend
+    instrumented = compile(program.unification, CountingBackend(backend, stats, position), inplace=program.inplace is not None)
+    tag, name, match, build = program.tag, backend.tag, instrumented.match, instrumented.build
+
+    def counted_match(node: Element) -> bool:
+        if visits:
+            rule.visited += 1
+            if tag is None or name(node) == tag:
+                rule.tag_hits += 1
+        if not match(node):
+            return False
+
+        rule.matches += 1
+        if stats.hook is not None:
+            stats.hook('match', position, node)
+        return True
+
+    def timed_build(variables: Dict, soup: Document):
+        with stats.phase('rebuild'):
+            return build(variables, soup)
+
+    inplace = instrumented.inplace
+
+    def timed_inplace(node: Element, variables: Dict, soup: Document):
+        with stats.phase('rebuild'):
+            inplace(node, variables, soup)
+
+    instrumented.match = counted_match
+    instrumented.build = None if build is None else timed_build
+    instrumented.inplace = None if inplace is None else timed_inplace
+    return instrumented
+
+def instrument(rules: Union[RuleSet, List[Union[ast.NodeUnification, Program]]], stats: Stats, backend: Backend = BS4) -> RuleSet:
+    ''' A copy of 'rules' that records what it does in 'stats'. Uninstrumented rules pay nothing for this. '''
+    if not isinstance(rules, RuleSet):
+        rules = compile_rules(rules, backend)
+
+    stats.rules = [ RuleStats(rule=f'{position}: {describe(program.unification)}') for position, program in enumerate(rules.programs) ]
+    # A single rule runs without dispatch (see matcher.unify_pass), so it's matched against every element visited
+    dispatched = len(rules.programs) != 1
+    programs = [ instrument_program(program, stats, position, visits=not dispatched) for position, program in enumerate(rules.programs) ]
+    instrumented = compile_rules(programs, rules.backend, decision_tree=rules.tree is not None)
+    if dispatched:
+        instrumented.visit = count_visits(instrumented, stats)
+    return instrumented
+
+def count_visits(rules: RuleSet, stats: Stats) -> Callable[[Element], None]:
+    ''' Counts every element offered to 'rules' as visited by each rule, and as a tag hit for those it dispatches to. '''
+    counters = [ (program.tag, rule) for program, rule in zip(rules.programs, stats.rules) ]
+    name = rules.backend.tag
+
+    def visit(node: Element):
+        tag = name(node)
+        for rule_tag, rule in counters:
+            rule.visited += 1
+            if rule_tag is None or rule_tag == tag:
+                rule.tag_hits += 1
+
+    return visit
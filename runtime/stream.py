@@ -0,0 +1,428 @@
+from typing import Callable, Dict, List, Optional, TextIO, Tuple, Union
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+
+import parser.ast as ast
+from runtime.attributes import AttributePattern, compile_attribute_pattern
+from lexer.token import Wildcard
+from runtime.matcher import MATCHED_TAG, Program, RuleSet, UnifyException, any_children, any_tag, attributes_variable, children_variable, compile_attributes, compile_rules, has_filters, wildcard_children
+
+# Elements that never have children (nor end tags)
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+])
+
+class NotStreamableException(UnifyException):
+    ...
+
+@dataclass
+class StreamProgram:
+    ''' A rule set checked for streaming. '''
+    rules: RuleSet
+    # Per rule position: True if the match is only decided at the element's end tag
+    # (the element's subtree is buffered until then), False if decided at its start tag.
+    buffered: List[bool]
+    # Attribute constraints of the child patterns of buffered rules, by id() of the pattern node
+    # (the rules' own are Program.attributes)
+    child_attributes: Dict[int, AttributePattern] = field(default_factory=dict)
+
+def pattern_variables(rule: ast.HTMLNode) -> List[str]:
+    names = []
+    stack = [ rule ]
+    while stack != []:
+        node = stack.pop()
+        if node.variable:
+            names.append(node.tag)
+        stack.extend(node.children)
+
+    return names
+
+def streamable(unification: ast.NodeUnification) -> Optional[str]:
+    ''' Return why 'unification' cannot be applied to a stream, or None if it can. '''
+    left, right = unification.left, unification.right
+
+    if has_filters(left):
+        return f'the ..> filter of {left.tag} needs its whole subtree'
+
+    if not any_children(left):
+        # The match is decided once the element closes, so everything below it is buffered:
+        # that's only bounded if no descendant pattern accepts an arbitrary list of children.
+        stack = list(left.children)
+        while stack != []:
+            node = stack.pop()
+            if any_children(node):
+                return f'the children of {node.tag} in {left.tag} need unbounded lookahead'
+            stack.extend(node.children)
+
+    bound = set(pattern_variables(left))
+    children_name = children_variable(left)
+
+    children_references = 0
+    for name in pattern_variables(right):
+        if name not in bound:
+            return f'variable {name} is unbound'
+        if name == children_name:
+            children_references += 1
+
+    stack = [ right ]
+    while stack != []:
+        node = stack.pop()
+        # (_,_,_): the matched element's children, only copied through if the match is decided at its start tag
+        if wildcard_children(node):
+            if not any_children(left):
+                return f'the children _ of {node.tag} need the subtree of {left.tag}'
+            children_references += 1
+        stack.extend(node.children)
+
+    if children_references > 1:
+        return f'{children_name or "_"} is used more than once'
+
+    return None
+
+def compile_stream(unifications: List[Union[ast.NodeUnification, Program]]) -> StreamProgram:
+    ''' Compile a rule set for streaming, raising NotStreamableException for rules that need unbounded lookahead. '''
+    rules = compile_rules(unifications)
+
+    reasons = []
+    for position, program in enumerate(rules.programs):
+        reason = streamable(program.unification)
+        if reason is not None:
+            reasons.append(f'rule {position}: {reason}')
+
+    if reasons != []:
+        raise NotStreamableException(f'Program is not streamable ({"; ".join(reasons)})')
+
+    child_attributes = dict()
+    for program in rules.programs:
+        stack = list(program.unification.left.children)
+        while stack != []:
+            node = stack.pop()
+            pattern = compile_attribute_pattern(node.attrs)
+            if pattern is not None:
+                child_attributes[id(node)] = pattern
+            stack.extend(node.children)
+
+    return StreamProgram(
+        rules=rules,
+        buffered=[ not any_children(program.unification.left) for program in rules.programs ],
+        child_attributes=child_attributes)
+
+def bind_element(rule: ast.HTMLNode, tag: str, attrs: Dict, vars: Dict):
+    ''' Bind the tag and attribute variables of 'rule' matched by an element. '''
+    if rule.variable:
+        vars[rule.tag] = tag
+    attributes_name = attributes_variable(rule)
+    if attributes_name is not None:
+        vars[attributes_name] = attrs
+
+def render_attributes(node: ast.HTMLNode, vars: Dict) -> str:
+    if node.attrs == []:
+        return ''
+
+    parts = []
+    for name, value in compile_attributes(node.attrs)(vars).items():
+        if isinstance(value, list):
+            value = ' '.join(value)
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+        parts.append(f' {name}="{value}"')
+
+    return ''.join(parts)
+
+def render(node: ast.HTMLNode, vars: Dict) -> Tuple[str, Optional[str]]:
+    ''' Serialize a right side node. If it contains a children variable, return the markup
+    before and after it; otherwise the whole markup and None. '''
+    tag = node.tag
+    if node.variable:
+        tag = vars.get(node.tag)
+        if tag is None:
+            raise UnifyException(f'Variable {node.tag} definition missing.')
+    elif tag == Wildcard.name:
+        # The matched element's tag
+        tag = vars[MATCHED_TAG]
+
+    attributes = render_attributes(node, vars)
+    if children_variable(node) is not None or wildcard_children(node):
+        return (f'<{tag}{attributes}>', f'</{tag}>')
+
+    if node.children == [] and tag in VOID_ELEMENTS:
+        return (f'<{tag}{attributes}/>', None)
+
+    prefix = [ f'<{tag}{attributes}>' ]
+    suffix = None
+    for child in node.children:
+        child_prefix, child_suffix = render(child, vars)
+        if suffix is None:
+            prefix.append(child_prefix)
+            if child_suffix is not None:
+                suffix = [ child_suffix ]
+        else:
+            suffix.append(child_prefix)
+
+    if suffix is None:
+        prefix.append(f'</{tag}>')
+        return (''.join(prefix), None)
+
+    suffix.append(f'</{tag}>')
+    return (''.join(prefix), ''.join(suffix))
+
+@dataclass
+class OpenElement:
+    tag: str
+    # Written when the element closes (rewritten elements); None to copy the end tag
+    close: Optional[str] = None
+    # Inside a deleted or replaced subtree: nothing is written
+    skip: bool = False
+    # Text directly below a rewritten element is dropped along with the element
+    drop_text: bool = False
+
+@dataclass
+class Candidate:
+    ''' An element being buffered until a rule decided at its end tag can be checked. '''
+    position: int
+    unification: ast.NodeUnification
+    # Buffered events, starting with the element's own start tag
+    events: List[Tuple] = field(default_factory=list)
+    # Open elements of the buffered subtree: (tag, pattern, element children seen)
+    patterns: List[List] = field(default_factory=list)
+    vars: Dict = field(default_factory=dict)
+
+def attributes(attrs: List[Tuple[str, Optional[str]]]) -> Dict[str, str]:
+    # Attributes without a value (<input disabled>) are empty, as in bs4 trees
+    return { name: '' if value is None else value for name, value in attrs }
+
+class StreamRewriter(HTMLParser):
+    ''' Applies a StreamProgram to HTML fed incrementally, writing output as it goes.
+
+    Memory is bounded by the document depth plus the subtree of the element currently buffered.
+    Unlike unify_tree, each element is rewritten by at most one rule (the first that matches). '''
+
+    def __init__(self, program: StreamProgram, write: Callable[[str], object]):
+        super().__init__(convert_charrefs=False)
+        self.program = program
+        self.write = write
+        self.stack: List[OpenElement] = []
+        self.candidate: Optional[Candidate] = None
+
+    # HTMLParser callbacks
+
+    def handle_starttag(self, tag, attrs):
+        self.start(tag, self.get_starttag_text(), tag in VOID_ELEMENTS, attributes(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.start(tag, self.get_starttag_text(), True, attributes(attrs))
+
+    def handle_endtag(self, tag):
+        self.end(tag)
+
+    def handle_data(self, data):
+        self.text(data)
+
+    def handle_entityref(self, name):
+        self.text(f'&{name};')
+
+    def handle_charref(self, name):
+        self.text(f'&#{name};')
+
+    def handle_comment(self, data):
+        self.text(f'<!--{data}-->')
+
+    def handle_decl(self, decl):
+        self.text(f'<!{decl}>')
+
+    def handle_pi(self, data):
+        self.text(f'<?{data}>')
+
+    def unknown_decl(self, data):
+        self.text(f'<![{data}]>')
+
+    # Events
+
+    def text(self, data: str):
+        if self.candidate is not None:
+            self.candidate.events.append(('text', data))
+        elif self.stack == [] or not (self.stack[-1].skip or self.stack[-1].drop_text):
+            self.write(data)
+
+    def start(self, tag: str, raw: str, void: bool, attrs: Dict, position: int = 0):
+        if self.candidate is not None:
+            self.candidate_start(tag, raw, void, attrs)
+            return
+
+        if self.stack != [] and self.stack[-1].skip:
+            if not void:
+                self.stack.append(OpenElement(tag=tag, skip=True))
+            return
+
+        for rule_position, program in self.program.rules.dispatch(tag):
+            if rule_position < position:
+                continue
+            if program.attributes is not None and not program.attributes.matches(attrs):
+                continue
+
+            if self.program.buffered[rule_position]:
+                self.candidate = Candidate(position=rule_position, unification=program.unification)
+                self.candidate.patterns.append([tag, program.unification.left, 0])
+                self.candidate.events.append(('start', tag, raw, void, attrs))
+                bind_element(program.unification.left, tag, attrs, self.candidate.vars)
+                self.candidate.vars[MATCHED_TAG] = tag
+                if void:
+                    self.candidate_end_element()
+                return
+
+            self.rewrite(tag, void, attrs, program.unification)
+            return
+
+        self.write(raw)
+        if not void:
+            self.stack.append(OpenElement(tag=tag))
+
+    def rewrite(self, tag: str, void: bool, attrs: Dict, unification: ast.NodeUnification):
+        ''' Apply a rule decided at the start tag of 'tag'. '''
+        left, right = unification.left, unification.right
+        if right.tag is None:
+            if not void:
+                self.stack.append(OpenElement(tag=tag, skip=True))
+            return
+
+        vars = { MATCHED_TAG: tag }
+        bind_element(left, tag, attrs, vars)
+        prefix, suffix = render(right, vars)
+        self.write(prefix)
+
+        if suffix is None:
+            # The replacement doesn't keep the children
+            if not void:
+                self.stack.append(OpenElement(tag=tag, skip=True))
+        elif void:
+            self.write(suffix)
+        else:
+            self.stack.append(OpenElement(tag=tag, close=suffix, drop_text=True))
+
+    def end(self, tag: str):
+        if self.candidate is not None:
+            if not self.candidate_end(tag):
+                return
+
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i].tag == tag:
+                break
+        else:
+            # Stray end tag
+            return
+
+        while len(self.stack) > i:
+            element = self.stack.pop()
+            if element.skip:
+                continue
+            if element.close is not None:
+                self.write(element.close)
+            elif len(self.stack) == i:
+                self.write(f'</{tag}>')
+
+    # Buffered candidates
+
+    def candidate_start(self, tag: str, raw: str, void: bool, attrs: Dict):
+        candidate = self.candidate
+        candidate.events.append(('start', tag, raw, void, attrs))
+
+        parent = candidate.patterns[-1]
+        _, pattern, seen = parent
+        if seen >= len(pattern.children):
+            self.candidate_fail()
+            return
+
+        child = pattern.children[seen]
+        if not any_tag(child) and child.tag != tag:
+            self.candidate_fail()
+            return
+        child_attributes = self.program.child_attributes.get(id(child))
+        if child_attributes is not None and not child_attributes.matches(attrs):
+            self.candidate_fail()
+            return
+
+        parent[2] += 1
+        bind_element(child, tag, attrs, candidate.vars)
+
+        if void:
+            if child.children != []:
+                self.candidate_fail()
+        else:
+            candidate.patterns.append([tag, child, 0])
+
+    def candidate_end(self, tag: str) -> bool:
+        ''' Handle an end tag while buffering; return True if it also has to close elements outside the candidate. '''
+        candidate = self.candidate
+        if any(open_tag == tag for open_tag, _, _ in candidate.patterns):
+            candidate.events.append(('end', tag))
+            while self.candidate is candidate:
+                closed = candidate.patterns[-1][0]
+                self.candidate_end_element()
+                if closed == tag:
+                    break
+            return False
+
+        if not any(element.tag == tag for element in self.stack):
+            # Stray end tag
+            return False
+
+        # Implicitly closes the candidate itself
+        while (matched := self.candidate_end_element()) is None:
+            ...
+        if matched:
+            return True
+
+        # The buffered events were replayed; close them as usual.
+        self.end(tag)
+        return False
+
+    def candidate_end_element(self) -> Optional[bool]:
+        ''' Close the innermost buffered element. Return None while the candidate is still open,
+        otherwise whether it matched. '''
+        candidate = self.candidate
+        _, pattern, seen = candidate.patterns.pop()
+        if seen != len(pattern.children):
+            self.candidate_fail()
+            return False
+
+        if candidate.patterns != []:
+            return None
+
+        self.candidate = None
+        right = candidate.unification.right
+        if right.tag is not None:
+            markup, _ = render(right, candidate.vars)
+            self.write(markup)
+        return True
+
+    def candidate_fail(self):
+        ''' Copy the candidate's start tag through and replay its buffered events against the later rules. '''
+        candidate = self.candidate
+        self.candidate = None
+
+        _, tag, raw, void, attrs = candidate.events[0]
+        self.start(tag, raw, void, attrs, position=candidate.position + 1)
+        for event in candidate.events[1:]:
+            match event:
+                case ('start', tag, raw, void, attrs):
+                    self.start(tag, raw, void, attrs)
+                case ('end', tag):
+                    self.end(tag)
+                case ('text', data):
+                    self.text(data)
+
+    def close(self):
+        super().close()
+        while self.candidate is not None:
+            self.candidate_end_element()
+        while self.stack != []:
+            element = self.stack.pop()
+            if not element.skip and element.close is not None:
+                self.write(element.close)
+
+def rewrite_stream(program: StreamProgram, input: TextIO, output: TextIO, chunk_size: int = 1 << 16):
+    ''' Rewrite the HTML read from 'input' into 'output' chunk by chunk. '''
+    rewriter = StreamRewriter(program, write=output.write)
+    while (chunk := input.read(chunk_size)) != '':
+        rewriter.feed(chunk)
+    rewriter.close()
@@ -0,0 +1,60 @@
+from typing import Callable, List
+from collections import deque
+from enum import StrEnum
+
+from runtime.backend import BS4, Element
+
+class Order(StrEnum):
+    ''' The order in which unify_tree visits the elements below the root. '''
+    BREADTH_FIRST = 'breadth-first'
+    PRE_ORDER = 'pre-order'
+    # Children are rewritten before their parent is matched
+    POST_ORDER = 'post-order'
+
+# Visits an element and returns the elements left to visit below it
+Visitor = Callable[[Element], List[Element]]
+
+def unique(nodes: List[Element]) -> List[Element]:
+    ''' Drop repeated elements (ie children moved by more than one variable reference). '''
+    if len(nodes) < 2:
+        return nodes
+
+    seen = set()
+    result = []
+    for node in nodes:
+        if id(node) not in seen:
+            seen.add(id(node))
+            result.append(node)
+
+    return result
+
+def traverse(root: Element, visit: Visitor, order: Order = Order.BREADTH_FIRST, children: Callable[[Element], List[Element]] = BS4.element_children):
+    ''' Visit every element below 'root' exactly once without recursion.
+
+    Each element is pushed and popped once, so a traversal is O(n) in the number of
+    elements visited and its stack never depends on the Python recursion limit. '''
+    match order:
+        case Order.BREADTH_FIRST:
+            queue = deque(children(root))
+            while queue:
+                queue.extend(unique(visit(queue.popleft())))
+        case Order.PRE_ORDER:
+            stack = children(root)
+            stack.reverse()
+            while stack != []:
+                remainder = unique(visit(stack.pop()))
+                remainder.reverse()
+                stack.extend(remainder)
+        case Order.POST_ORDER:
+            # (node, children already pushed)
+            stack = [ (child, False) for child in reversed(children(root)) ]
+            while stack != []:
+                node, expanded = stack.pop()
+                if expanded:
+                    # The remainder has already been visited; don't enqueue it again.
+                    visit(node)
+                else:
+                    stack.append((node, True))
+                    stack.extend((child, False) for child in reversed(children(node)))
+        case _:
+            raise ValueError(f'Unsupported traversal order: {order}')
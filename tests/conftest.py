@@ -0,0 +1,19 @@
+''' Fixtures and helpers shared by the tests. '''
+import pytest
+
+from runtime.backend import BACKENDS, Backend
+
+ASK_HN = 'tests/data/ask-hn-oct-24.html'
+
+# Backends whose parser is an optional dependency: tests on them are skipped unless it's installed
+REQUIRES = { 'html5lib': 'html5lib', 'lxml': 'lxml' }
+
+@pytest.fixture(params=list(BACKENDS))
+def backend(request) -> Backend:
+    if request.param in REQUIRES:
+        pytest.importorskip(REQUIRES[request.param])
+    return BACKENDS[request.param]
+
+def read_ask_hn() -> str:
+    with open(ASK_HN) as f:
+        return f.read()
@@ -0,0 +1,103 @@
+''' The test_runtime cases, run against every tree backend. '''
+import parser.parse as parse
+import lexer.lex as lex
+from runtime import matcher
+from runtime.backend import BACKENDS, Backend
+from runtime.index import build_index
+from runtime.traversal import Order
+from tests.conftest import read_ask_hn
+
+def shape(backend: Backend, node) -> tuple:
+    ''' The element structure below 'node' as nested (tag, children) tuples. '''
+    return tuple((backend.tag(child), shape(backend, child)) for child in backend.element_children(node))
+
+def unification(program: str):
+    return parse.parse_unification(lex.lex(program))
+
+def test_backend_matches(backend):
+    document = backend.parse(read_ask_hn())
+
+    matches = matcher.match_bs4(parse.parse('(a,{},[])'), soup=document)
+    assert matches[0].get('href') == 'https://news.ycombinator.com'
+
+def test_backend_unify_operator(backend):
+    document = backend.parse('<div></div><span></span>')
+    div, span = matcher.match_bs4(parse.parse('(div,{},[])'), document) + matcher.match_bs4(parse.parse('(span,{},[])'), document)
+
+    program = unification('(div,{},[]) = (p,{},[])')
+    unified_div, div_remainder = matcher.unify(program, div, soup=document)
+    unified_span, span_remainder = matcher.unify(program, span, soup=document)
+
+    assert backend.tag(unified_div) == 'p' and div_remainder == []
+    assert backend.tag(unified_span) == 'span' and span_remainder == []
+
+def test_backend_delete_node(backend):
+    with open('tests/data/simple.html') as f:
+        document = backend.parse(f.read())
+
+    matcher.unify_tree(unification('(p,{},[]) = ()'), root=document, soup=document)
+    expected = backend.parse('<html><body><div></div></body></html>')
+    assert shape(backend, document) == shape(backend, expected)
+
+def test_backend_build_tag(backend):
+    document = backend.parse('<p></p>')
+    new_tag, _ = matcher.build_tag(variables={'X': 'span'}, replacement_node=parse.parse('(p,{},[(X,{},[]),(X,{},[])])'), soup=document)
+    assert backend.tag(new_tag) == 'p'
+    assert shape(backend, new_tag) == (('span', ()), ('span', ()))
+
+def test_backend_extract_variables(backend):
+    document = backend.parse('<p><span></span><b></b></p>')
+    p = matcher.match_bs4(parse.parse('(p,{},[])'), document)[0]
+
+    vars = matcher.extract_variables(match_rule=parse.parse('(p,{},[(X,{},[]),(Y,{},[])])'), matched_node=p)
+    assert vars == { 'X': 'span', 'Y': 'b' }
+
+    vars = matcher.extract_variables(match_rule=parse.parse('(p,{},Children)'), matched_node=p)
+    assert vars == { 'Children': backend.element_children(p) }
+
+def test_backend_bold_spans(backend):
+    document = backend.parse('<p><span></span><div></div></p>')
+    matcher.unify_tree(unification('(span,{},Children) = (b,{},[(span,{},Children)])'), root=document, soup=document)
+
+    expected = backend.parse('<p><b><span></span></b><div></div></p>')
+    assert shape(backend, document) == shape(backend, expected)
+
+def test_backend_rules(backend):
+    program = '(img,A,C) = (); (span,{},Children) = (b,{},[(span,{},Children)]); (font,{},Children) = (p,{},Children)'
+    rules = matcher.compile_rules(parse.parse_rules(lex.lex(program)))
+
+    html = read_ask_hn()
+
+    document = backend.parse(html)
+    matcher.unify_tree(rules, root=document, soup=document, order=Order.PRE_ORDER)
+
+    # The same program compiled for bs4 gives the same structure as on the reference backend
+    reference = BACKENDS['html.parser'].parse(html)
+    matcher.unify_tree(rules, root=reference, soup=reference, order=Order.PRE_ORDER)
+    tags = [ backend.tag(node) for node in backend.descendants(document) ]
+    reference_tags = [ node.name for node in reference.descendants if node.name is not None ]
+    for tag in ('img', 'b', 'span', 'font', 'p'):
+        assert tags.count(tag) == reference_tags.count(tag)
+
+def test_backend_index(backend):
+    html = read_ask_hn()
+
+    program = matcher.compile(unification('(span,{},Children) = (b,{},[(span,{},Children)])'))
+    document = backend.parse(html)
+    indexed_document = backend.parse(html)
+    index = build_index(indexed_document)
+
+    matcher.unify_tree(program, root=document, soup=document)
+    matcher.unify_tree(program, root=indexed_document, soup=indexed_document, index=index)
+    assert shape(backend, document) == shape(backend, indexed_document)
+    assert len(index.candidates('b')) == len([ node for node in backend.descendants(indexed_document) if backend.tag(node) == 'b' ])
+
+def test_backend_match_attributes(backend):
+    document = backend.parse('<div><p class="a b" id="x"></p><p class="a"></p><p></p></div>')
+    ps = matcher.match_bs4(parse.parse('(p,{},[])'), document)
+
+    program = matcher.compile(unification('(p,{"class": {"a", ...}, "id": _},[]) = ()'), backend)
+    assert [ program.match(p) for p in ps ] == [True, False, False]
+
+    index = build_index(document, attributes=True)
+    assert index.candidates('p', program.attributes) == ps[:1]
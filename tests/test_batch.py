@@ -0,0 +1,81 @@
+import os
+
+import orjson
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+import lexer.lex as lex
+from tpml import batch
+
+# The real one, for 'crashing_rewrite_file' (run_batch looks it up in the batch module, which the tests patch)
+rewrite_file = batch.rewrite_file
+
+def crashing_rewrite_file(input_path, output_path):
+    # Kills the worker, as the OS would
+    if input_path.endswith('crash.html'):
+        os._exit(1)
+    return rewrite_file(input_path, output_path)
+
+def write_inputs(input_dir):
+    (input_dir / 'nested').mkdir(parents=True)
+    (input_dir / 'a.html').write_text('<p><span></span></p>')
+    (input_dir / 'nested' / 'b.html').write_text('<div><span><i></i></span></div>')
+    (input_dir / 'notes.txt').write_text('<span></span>')
+    # Not valid UTF-8, so reading it fails
+    (input_dir / 'bad.html').write_bytes(b'<p>\xff\xfe</p>')
+
+def read_manifest(path):
+    return { record['input']: record for record in map(orjson.loads, path.read_bytes().splitlines()) }
+
+def test_batch(tmp_path):
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    write_inputs(input_dir)
+
+    rules = parse.parse_rules(lex.lex('(span,{},Children) = (b,{},Children)'))
+    summary = batch.run_batch(rules, input_dir=str(input_dir), output_dir=str(output_dir), jobs=2, max_in_flight=1)
+
+    assert (summary.succeeded, summary.failed) == (2, 1)
+    assert str(BeautifulSoup((output_dir / 'a.html').read_text(), 'html.parser')) == '<p><b></b></p>'
+    assert str(BeautifulSoup((output_dir / 'nested' / 'b.html').read_text(), 'html.parser')) == '<div><b><i></i></b></div>'
+    assert not (output_dir / 'notes.txt').exists()
+    # Failed files leave no output (nor temporary files) behind
+    assert not (output_dir / 'bad.html').exists()
+    assert sorted(path.name for path in output_dir.iterdir()) == [ 'a.html', 'manifest.ndjson', 'nested' ]
+
+    manifest = read_manifest(output_dir / 'manifest.ndjson')
+    assert manifest[str(input_dir / 'a.html')]['ok']
+    assert not manifest[str(input_dir / 'bad.html')]['ok']
+    assert 'UnicodeDecodeError' in manifest[str(input_dir / 'bad.html')]['error']
+
+def test_batch_stream(tmp_path):
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    write_inputs(input_dir)
+
+    rules = parse.parse_rules(lex.lex('(span,{},Children) = (b,{},Children)'))
+    manifest = tmp_path / 'manifest.ndjson'
+    summary = batch.run_batch(rules, input_dir=str(input_dir), output_dir=str(output_dir), glob='*.html', jobs=1, manifest=str(manifest), stream=True)
+
+    assert (summary.succeeded, summary.failed) == (1, 1)
+    assert (output_dir / 'a.html').read_text() == '<p><b></b></p>'
+    assert len(read_manifest(manifest)) == 2
+
+def test_batch_broken_pool(tmp_path, monkeypatch):
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    write_inputs(input_dir)
+    (input_dir / 'crash.html').write_text('<span></span>')
+    monkeypatch.setattr(batch, 'rewrite_file', crashing_rewrite_file)
+
+    # One worker takes the files in order: a.html and bad.html finish before it dies on crash.html.
+    # nested/b.html was outstanding with it, so both are retried alone; only crash.html fails.
+    rules = parse.parse_rules(lex.lex('(span,{},Children) = (b,{},Children)'))
+    summary = batch.run_batch(rules, input_dir=str(input_dir), output_dir=str(output_dir), jobs=1)
+
+    manifest = read_manifest(output_dir / 'manifest.ndjson')
+    assert len(manifest) == 4 and (summary.succeeded, summary.failed) == (2, 2)
+    assert manifest[str(input_dir / 'a.html')]['ok']
+    assert manifest[str(input_dir / 'nested' / 'b.html')]['ok']
+    assert 'UnicodeDecodeError' in manifest[str(input_dir / 'bad.html')]['error']
+    assert 'BrokenProcessPool' in manifest[str(input_dir / 'crash.html')]['error']
+    assert not (output_dir / 'crash.html').exists()
+    assert str(BeautifulSoup((output_dir / 'nested' / 'b.html').read_text(), 'html.parser')) == '<div><b><i></i></b></div>'
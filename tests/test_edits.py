@@ -0,0 +1,86 @@
+import io
+
+import pytest
+
+import parser.parse as parse
+from runtime import edits, matcher
+from runtime.backend import BS4, Backend
+from runtime.index import build_index
+from tests.conftest import read_ask_hn
+
+def recorded(program: str, html: str, backend: Backend = BS4, **kwargs):
+    ''' The document rewritten by 'program' and its edit script. '''
+    script = []
+    rules = edits.record(parse.parse_program(program), script.append, backend)
+    document = backend.parse(html)
+    matcher.unify_tree(rules, root=document, soup=document, **kwargs)
+    return document, script
+
+@pytest.mark.parametrize('program', [
+    '(img,A,C) = (); (span,{"class": {"age"}},C) = (b,{},C)',
+    '(tr,{"class": {"athing", "comtr"}},[(td,{},[(table,{},C)])]) = (section,{},[(main,{"class": "c"},C),(hr,{},[])])',
+    '(span,Attrs,Children) = (b,Attrs,Children); (b,{"class": {"age"}},[(a,{},C)]) = (i,{},C)',
+    '(td,{},C) ..> (a,{"class": {"hnuser"}},C) = (section,{},C)',
+])
+def test_edits_apply(program, backend):
+    html = read_ask_hn()
+    document, script = recorded(program, html, backend)
+    assert script != []
+
+    applied = edits.apply(backend.parse(html), script)
+    assert backend.serialize(applied) == backend.serialize(document)
+
+def test_edits_fixpoint():
+    html = '<p><i><i>x</i></i><b><i></i></b></p>'
+    # Later passes rewrite what earlier ones built
+    document, script = recorded('(b,{},C) = (i,{},C); (i,{},[]) = ()', html, mode=matcher.Mode.FIXPOINT)
+    assert [ (edit['op'], edit['path']) for edit in script ] == [
+        ('update', [0, 1]), ('delete', [0, 0, 0]), ('delete', [0, 1, 0]), ('delete', [0, 0]), ('delete', [0, 0]) ]
+    assert str(edits.apply(BS4.parse(html), script)) == str(document) == '<p></p>'
+
+def test_edits_siblings(backend):
+    # Deletes and replacements among siblings shift the positions of the ones after them
+    html = '<ul>' + ''.join(f'<li class="{i % 3}">{i}</li>' for i in range(60)) + '</ul>'
+    program = '(li,{"class": {"0"}},C) = (); (li,{"class": {"1"}},C) = (p,{},[(b,{},C)])'
+    document, script = recorded(program, html, backend)
+    assert [ (edit['op'], edit['path'][-1]) for edit in script[:6] ] == [
+        ('delete', 0), ('replace', 0), ('delete', 2), ('replace', 2), ('delete', 4), ('replace', 4) ]
+
+    applied = edits.apply(backend.parse(html), script)
+    assert backend.serialize(applied) == backend.serialize(document)
+
+def test_edits_script():
+    html = '<div>a<p class="x">b</p><ul><li>1</li><li>2</li></ul></div>'
+    program = '(p,{},C) = (em,{"id": "e"},C); (ul,{},C) = (ol,{},[(li,{},[]),(li,{},C)]); (li,{},[]) = ()'
+    output = io.BytesIO()
+    rules = edits.record(parse.parse_program(program), edits.ndjson(output))
+    document = BS4.parse(html)
+    matcher.unify_tree(rules, root=document, soup=document)
+
+    script = list(edits.read(output.getvalue().splitlines()))
+    assert script == [
+        { 'op': 'update', 'rule': 0, 'path': [0, 0], 'tag': 'em', 'attrs': { 'id': 'e' } },
+        { 'op': 'replace', 'rule': 1, 'path': [0, 1], 'node': { 'tag': 'ol', 'attrs': {}, 'children': [
+            { 'tag': 'li', 'attrs': {}, 'children': [] },
+            { 'tag': 'li', 'attrs': {}, 'children': [ { 'moved': [0] }, { 'moved': [1] } ] },
+        ] } },
+        # The built li isn't matched; the moved ones are
+        { 'op': 'delete', 'rule': 2, 'path': [0, 1, 1, 0] },
+        { 'op': 'delete', 'rule': 2, 'path': [0, 1, 1, 0] },
+    ]
+    assert str(edits.apply(BS4.parse(html), script)) == str(document) == '<div>a<em id="e"></em><ol><li></li><li></li></ol></div>'
+
+def test_edits_index():
+    html = read_ask_hn()
+    program = '(span,{"class": {"age"}},C) = ()'
+    script = []
+    rules = edits.record(parse.parse_program(program), script.append)
+    document = BS4.parse(html)
+    matcher.unify_tree(rules, root=document, soup=document, index=build_index(document, attributes=True))
+
+    assert len(script) == len(BS4.parse(html).select('span.age'))
+    assert str(edits.apply(BS4.parse(html), script)) == str(document)
+
+def test_edits_mismatch():
+    with pytest.raises(edits.EditException):
+        edits.apply(BS4.parse('<p></p>'), [ { 'op': 'delete', 'path': [1] } ])
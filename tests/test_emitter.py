@@ -0,0 +1,144 @@
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+import orjson
+import pytest
+
+import lexer.lex as lex
+import parser.parse as parse
+from runtime import matcher
+from runtime.js import emitter
+from runtime.js.cache import EmitCache, cache_key
+from runtime.js.classify import RewriteKind, classify
+from runtime.js.selector import css_selector
+
+def test_cache_key():
+    assert cache_key(b'ab', b'c') == cache_key(b'ab', b'c')
+    assert cache_key(b'ab', b'c') != cache_key(b'a', b'bc')
+
+def test_emit_cache_lru():
+    cache = EmitCache(capacity=2)
+    cache.put('a', '1')
+    cache.put('b', '2')
+    assert cache.get('a') == '1'
+
+    # 'b' is now the least recently used entry
+    cache.put('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1' and cache.get('c') == '3'
+
+def test_emit_cache_disk(tmp_path):
+    EmitCache(directory=tmp_path).put('a', 'bundle')
+
+    # A new process (ie an empty in-memory cache) reads it back from disk
+    cache = EmitCache(directory=tmp_path)
+    assert cache.get('a') == 'bundle'
+    assert cache.get('b') is None
+
+def test_read_runtime_file_invalidation(tmp_path):
+    path = tmp_path / 'matcher.js'
+    path.write_text('let a = 1;')
+    assert emitter.read_runtime_file(path) == 'let a = 1;'
+
+    path.write_text('let a = 22;')
+    assert emitter.read_runtime_file(path) == 'let a = 22;'
+
+def test_emit_many_builds_misses_once(monkeypatch):
+    builds = []
+    def build_many(sources):
+        builds.append(len(sources))
+        return [ f'bundle{len(builds)}.{i}' for i in range(len(sources)) ]
+    monkeypatch.setattr(emitter, 'build_many', build_many)
+
+    cache = EmitCache(capacity=8)
+    rules = [ '(b,{},C) = (i,{},C)', '(p,{},[]) = (span,{},[])', '(b,{},C) = (i,{},C)' ]
+    bundles = emitter.emit_many(rules, prefix=False, cache=cache)
+
+    # Duplicate rules share a build; outputs follow the input order
+    assert builds == [2]
+    assert bundles == [ 'bundle1.0', 'bundle1.1', 'bundle1.0' ]
+
+    # Everything is cached now
+    assert emitter.emit_many(rules, cache=cache) == [ f'javascript:{bundle}' for bundle in bundles ]
+    assert builds == [2]
+
+def test_emit_many_batches(monkeypatch):
+    builds = []
+    def build_many(sources):
+        builds.append(len(sources))
+        return [ 'bundle' ] * len(sources)
+    monkeypatch.setattr(emitter, 'build_many', build_many)
+
+    rules = [ f'(b,{{}},C) = ({tag},{{}},C)' for tag in ('i', 'em', 'u', 's', 'q') ]
+    assert len(emitter.emit_many(rules, cache=None, batch_size=2, jobs=2)) == 5
+    assert sorted(builds) == [1, 2, 2]
+
+@pytest.mark.parametrize('rule, selector', [
+    ('(b,{},Children)', 'b'),
+    ('(Tag,{},_)', '*'),
+    ('(img,{},[])', 'img:not(:has(> *))'),
+    ('(p,{},[(b,{},C)])', 'p:has(> b:only-child)'),
+    ('(ul,{},[(li,{},[]),(_,{},[(a,{},[])]),(li,{},C)])', 'ul:has(> li:first-child + * + li:last-child)'),
+    ('(div,{},C) ..> (img,A,C)', 'div:has(img)'),
+    ('(li,{},[(a,{},C)]) ..> (img,{},[])', 'li:has(img):has(> a:only-child)'),
+    ('(div,{},C) ..> (_,{},[])', 'div'),
+    ('(td,{"class": {"title"}},C)', 'td.title'),
+    ('(a,{"href": _, "class": {"x", "y", ...}},C)', 'a.x.y[href]'),
+    ('(_,{"id": "main", "rel": {"next"}},C)', '[id][rel~="next"]'),
+    ('(p,{"class": {_}},[(a,{"class": {"hn-user"}},[])])', 'p[class]:has(> a.hn-user:only-child)'),
+    ('(div,{},C) ..> (_,{"class": {"x"}},[])', 'div:has(.x)'),
+    ('(p,{A, "class": {"a b"}},C)', 'p[class~="a b"]'),
+])
+def test_css_selector(rule, selector):
+    assert css_selector(parse.parse(rule)) == selector
+
+def test_css_selector_narrows():
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+
+    # The selector selects every match, and fewer elements than the tag alone
+    program = matcher.compile(parse.parse_unification(lex.lex('(a,{"href": _, "class": {"clicky"}},C) = ()')))
+    selected = soup.select(css_selector(program.unification.left))
+    matches = [ a for a in soup.find_all('a') if program.match(a) ]
+    assert matches != [] and all(a in selected for a in matches)
+    assert len(selected) < len(soup.find_all('a'))
+
+def test_rule_variables_selector():
+    variables = emitter.rule_variables('(p,{},[(b,{},C)]) = (div,{},[(b,{},C)])')
+    assert orjson.loads(variables['selector']) == 'p:has(> b:only-child)'
+
+def test_rule_variables_live():
+    once = emitter.rule_variables('(b,{},C) = (i,{},C)')
+    live = emitter.rule_variables('(b,{},C) = (i,{},C)', live=True)
+
+    # Live and one-off bundles are cached separately
+    assert emitter.bundle_key(once, 'template', 'matcher') != emitter.bundle_key(live, 'template', 'matcher')
+    assert 'unify_live(' in emitter.load_template(emitter.read_runtime_file(emitter.TEMPLATE_PATH)).render(matcher_js='', **live)
+
+CLASSIFIED = [
+    ('(img,Attrs,C) = (img,{Attrs, "style": "filter: grayscale(100%);"}, C)', RewriteKind.ATTRIBUTES),
+    ('(Tag,{},Children) = (Tag,{"class": "x"},Children)', RewriteKind.ATTRIBUTES),
+    ('(p,{},[]) = (p,{"id": "x"},[])', RewriteKind.ATTRIBUTES),
+    ('(b,{},_) = (i,{},_)', RewriteKind.RENAME),
+    ('(b,{},C) = (_,{},C)', RewriteKind.ATTRIBUTES),
+    ('(a,Attrs,Children) = (mark,{},[(a,Attrs,Children)])', RewriteKind.STRUCTURAL),
+    ('(p,{},[(b,{},C)]) = (p,{},[(i,{},C)])', RewriteKind.STRUCTURAL),
+    ('(img,A,C) = ()', RewriteKind.DELETE),
+]
+
+@pytest.mark.parametrize('rule, kind', CLASSIFIED)
+def test_classify(rule, kind):
+    assert classify(parse.parse_unification(lex.lex(rule))) == kind
+
+@pytest.mark.parametrize('rule', [ rule for rule, _ in CLASSIFIED ])
+def test_classifiers_agree(rule):
+    # The Python runtime rewrites in place the rules the JS runtime renames or changes the attributes of
+    unification = parse.parse_unification(lex.lex(rule))
+    inplace = classify(unification) in (RewriteKind.ATTRIBUTES, RewriteKind.RENAME)
+    assert (matcher.compile(unification).inplace is not None) == inplace
+
+def test_examples_classified():
+    # Every example is valid input to the emitter
+    for path in sorted(Path('examples').glob('*.tpml')):
+        variables = emitter.rule_variables(path.read_text())
+        assert orjson.loads(variables['kind']) in list(RewriteKind)
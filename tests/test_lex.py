@@ -1,6 +1,6 @@
 import pytest
 
-from lexer.lex import lex
+from lexer.lex import LexError, lex, lex_offsets, lex_spans
 import lexer.token as token
 
 def test_lex_parens():
@@ -83,4 +83,51 @@ def test_lex_unpack_operator():
     input = '*'
     assert lex(input) == [
         token.UnpackOperator()
-    ]
\ No newline at end of file
+    ]
+def test_lex_semicolon():
+    input = '() = ();\n() = ()'
+    assert lex(input) == [
+        token.LeftParen(),
+        token.RightParen(),
+        token.Unification(),
+        token.LeftParen(),
+        token.RightParen(),
+        token.Semicolon(),
+        token.LeftParen(),
+        token.RightParen(),
+        token.Unification(),
+        token.LeftParen(),
+        token.RightParen(),
+    ]
+
+def test_lex_spans():
+    tokens, spans = lex_spans('(p, "a b") ..> X')
+    assert tokens == [
+        token.LeftParen(),
+        token.TagName(name='p'),
+        token.CommaDelimiter(),
+        token.String(value='a b'),
+        token.RightParen(),
+        token.Filter(filterType=token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH),
+        token.Variable(name='X'),
+    ]
+    assert [ (span.start, span.end) for span in spans ] == [ (0, 1), (1, 2), (2, 3), (4, 9), (9, 10), (11, 14), (15, 16) ]
+
+    _, starts, ends = lex_offsets('(p, "a b") ..> X')
+    assert list(zip(starts, ends)) == [ (span.start, span.end) for span in spans ]
+
+def test_lex_punctuation_singletons():
+    tokens = lex('(a)(b)')
+    assert tokens[0] is tokens[3]
+    assert tokens[2] is tokens[5]
+
+def test_lex_variable_boundary():
+    # Variables are a capital followed by lowercase letters
+    assert lex('TagName') == [ token.Variable(name='Tag'), token.Variable(name='Name') ]
+
+def test_lex_error_position():
+    with pytest.raises(LexError, match='line 2, column 3'):
+        lex('(a,\n  %)')
+
+    with pytest.raises(LexError, match='column 4'):
+        lex('(a "unterminated')
@@ -0,0 +1,94 @@
+import pytest
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+from runtime import matcher
+from runtime.memo import MatchMemo, memoize, pattern_depth, unify_tree
+from runtime.traversal import Order
+from tests.conftest import read_ask_hn
+
+@pytest.mark.parametrize('rule, depth', [
+    ('(p,{},C)', 0),
+    ('(p,{},[])', 1),
+    ('(p,{},[(a,{},C),(b,{},[])])', 2),
+    ('(p,{},C) ..> (a,{},[])', None),
+    ('(p,{},[(a,{},C) ..> (b,{},[])])', None),
+])
+def test_pattern_depth(rule, depth):
+    unification, = parse.parse_program(f'{rule} = ()')
+    assert pattern_depth(unification.left) == depth
+
+@pytest.mark.parametrize('program, order', [
+    ('(img,A,C) = (); (span,{},Children) = (b,{},[(span,{},Children)]); (font,{},C) = (em,{},C)', Order.BREADTH_FIRST),
+    ('(tr,{"class": {"athing", "comtr"}},[(td,{},[(table,{},C)])]) = (section,{},C)', Order.BREADTH_FIRST),
+    ('(td,{"class": {"ind"}},[(img,A,[])]) = (td,{},[]); (span,{"class": {"age"}},[(a,{"href": _},C)]) = (em,{},C)', Order.PRE_ORDER),
+    ('(td,{},C) ..> (a,{"class": {"hnuser"}},C) = (section,{},C)', Order.BREADTH_FIRST),
+    ('(span,Attrs,Children) = (b,Attrs,Children); (b,{"class": {"age"}},[(a,{},C)]) = (i,{},C)', Order.PRE_ORDER),
+    ('(span,{},[(a,{},C)]) = (b,{},C)', Order.POST_ORDER),
+])
+def test_memoized_unify_tree(program, order):
+    html = read_ask_hn()
+    rules = matcher.compile_rules(parse.parse_program(program))
+    memoized = memoize(rules)
+
+    expected = BeautifulSoup(html, 'html.parser')
+    matcher.unify_tree(rules, root=expected, soup=expected, order=order)
+
+    # The memo is kept across documents
+    for _ in range(2):
+        soup = BeautifulSoup(html, 'html.parser')
+        unify_tree(memoized, root=soup, soup=soup, order=order)
+        assert str(soup) == str(expected)
+
+    assert memoized.memo.shapes is None
+    if order == Order.POST_ORDER:
+        assert memoized.memo.hits == memoized.memo.misses == 0
+    else:
+        assert memoized.memo.hits > memoized.memo.misses
+
+def test_memoized_fixpoint():
+    # The second pass sees the p elements' new children, so they are shaped again
+    memoized = memoize(parse.parse_program('(b,{},C) = (i,{},C); (p,{},[(i,{},[])]) = (hr,{},[])'))
+    soup = BeautifulSoup('<p><b></b></p><p><b></b></p>', 'html.parser')
+    unify_tree(memoized, root=soup, soup=soup, mode=matcher.Mode.FIXPOINT)
+    assert str(soup) == '<hr/><hr/>'
+
+    with pytest.raises(matcher.BudgetException):
+        soup = BeautifulSoup('<b></b>', 'html.parser')
+        unify_tree(memoize(parse.parse_program('(b,{},C) = (b,{},[(b,{},C)])')), root=soup, soup=soup, mode=matcher.Mode.FIXPOINT, budget=5)
+
+def test_memo_attributes():
+    # Only the attributes rules look at tell shapes apart
+    memoized = memoize(parse.parse_program('(p,{"class": {"x"}},[]) = (hr,{},[])'))
+    soup = BeautifulSoup('<p class="x" id="1"></p><p class="x" id="2"></p><p class="y"></p><p class="x"><b></b></p>', 'html.parser')
+    unify_tree(memoized, root=soup, soup=soup)
+
+    assert str(soup) == '<hr/><hr/><p class="y"></p><p class="x"><b></b></p>'
+    assert (memoized.memo.hits, memoized.memo.misses) == (1, 3)
+
+def test_memo_shared():
+    memo = MatchMemo()
+    first = memoize(parse.parse_program('(p,{},[]) = (hr,{},[])'), memo)
+    second = memoize(parse.parse_program('(p,{},[]) = ()'), memo)
+
+    soup = BeautifulSoup('<p></p><p></p>', 'html.parser')
+    unify_tree(first, root=soup, soup=soup)
+    assert str(soup) == '<hr/><hr/>'
+
+    # Outcomes are per rule, even for the same shapes
+    soup = BeautifulSoup('<p></p><p></p>', 'html.parser')
+    unify_tree(second, root=soup, soup=soup)
+    assert str(soup) == ''
+    assert (memo.hits, memo.misses) == (2, 2)
+
+def test_memo_capacity():
+    memo = MatchMemo(capacity=2)
+    memoized = memoize(parse.parse_program('(p,{},[(b,{},C)]) = (hr,{},[])'), memo)
+    soup = BeautifulSoup('<p><a></a></p><p><b></b></p><p><i></i></p><p><a></a></p>', 'html.parser')
+    unify_tree(memoized, root=soup, soup=soup)
+
+    # The first shape was evicted before it came round again
+    assert str(soup) == '<p><a></a></p><hr/><p><i></i></p><p><a></a></p>'
+    assert len(memo.outcomes) == 2
+    assert (memo.hits, memo.misses) == (0, 4)
@@ -226,4 +226,59 @@ def test_parse_dict_unpack_entry():
         (ast.String(value='foo'), ast.String(value='bar')),
         ast.UnpackNode(variable=ast.HTMLNode(tag='Foo', attrs=[], children=[])),
         (ast.String(value='baz'), ast.String(value='bar')),
-    ]
\ No newline at end of file
+    ]
+def test_parse_rules():
+    tokens = lex.lex('''
+    (img,A,C) = ();
+    (b,{},Children) = (strong,{},Children)
+    (i,{},[]) = ()
+    ''')
+    rules = parse.parse_rules(tokens)
+
+    assert [ (rule.left.tag, rule.right.tag) for rule in rules ] == [
+        ('img', None),
+        ('b', 'strong'),
+        ('i', None),
+    ]
+    assert rules[1] == parse.parse_unification(lex.lex('(b,{},Children) = (strong,{},Children)'))
+
+def test_parse_rules_missing_right_side():
+    tokens = lex.lex('(b,{},Children) = (strong,{},Children); (i,{},[]) =')
+
+    with pytest.raises(parse.ParseError):
+        parse.parse_rules(tokens)
+
+def test_parse_program():
+    assert parse.parse_program('(b,{},C) = (i,{},C); (p,{},[]) = ()') == parse.parse_rules(lex.lex('(b,{},C) = (i,{},C) (p,{},[]) = ()'))
+
+def test_parse_error_position():
+    with pytest.raises(parse.ParseError, match="Expected '\\(' at line 2, column 13"):
+        parse.parse_program('(b,{},C) = (i,{},C)\n(p,{},[]) = [')
+
+    # Without the source, errors point at the token
+    with pytest.raises(parse.ParseError, match="Expected .,. at token 5"):
+        parse.parse_node(lex.lex('(b,{}]'))
+
+def test_parse_deep_nesting():
+    depth = 200
+    source = '(div,{},[' * depth + '(b,{},[])' + '])' * depth
+    node = parse.parse(source)
+    for _ in range(depth):
+        node = node.children[0]
+    assert node.tag == 'b'
+
+def test_parse_set_wildcard():
+    tokens = lex.lex('{ "foo", _, ... }')
+    ast_set, tokens = parse.parse_set(tokens)
+
+    assert tokens == []
+    assert ast_set == ast.Set(members=[ast.String(value='foo'), ast.Wildcard(), ast.Ellipsis()])
+
+def test_parse_node_filters():
+    node = parse.parse('(div,{},C) ..> (a,{},[]) ..> (img,{},[])')
+    img = ast.HTMLNode(tag='img', attrs=[], children=[])
+    a = ast.HTMLNode(tag='a', attrs=[], children=[], filters=[
+        ast.BinaryFilter(filter_type=lex.token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH, right_arg=img)
+    ])
+
+    assert node.filters == [ast.BinaryFilter(filter_type=lex.token.Filter.Type.ANY_DEPTH_SUBTREE_MATCH, right_arg=a)]
@@ -1,3 +1,6 @@
+import sys
+
+import orjson
 import pytest
 
 from bs4 import BeautifulSoup
@@ -6,6 +9,9 @@ from bs4 import Tag
 import parser.parse as parse
 import lexer.lex as lex
 from runtime import matcher
+from runtime.index import build_index, build_subtree_index
+from runtime.js.classify import classify
+from runtime.traversal import Order, traverse
 
 def test_bs4_matches():
     with open('tests/data/ask-hn-oct-24.html') as f:
@@ -156,4 +162,446 @@ def test_bold_spans():
 
 
     assert new_tree.prettify() == new_soup.prettify()
-    #vars = matcher.extract_variables(match_rule=match_rule, matched_node=soup.p)
\ No newline at end of file
+    #vars = matcher.extract_variables(match_rule=match_rule, matched_node=soup.p)
+
+
+def test_compile_program():
+    program = matcher.compile(parse.parse_unification(lex.lex('(span,{},Children) = (b,{},[(span,{},Children)])')))
+    assert program.tag == 'span'
+    assert program.build is not None
+
+    soup = BeautifulSoup('<p><span><i></i></span><div></div></p>', 'html.parser')
+    assert program.match(soup.span)
+    assert not program.match(soup.div)
+
+    vars = dict()
+    program.bind(soup.span, vars)
+    assert vars == { 'Children': [soup.i] }
+
+def test_compiled_arity():
+    program = matcher.compile(parse.parse_unification(lex.lex('(p,{},[(X,{},[]),(Y,{},[])]) = ()')))
+    soup = BeautifulSoup('<p><span></span><div></div></p><p><span></span></p><p>text</p>', 'html.parser')
+    assert [ program.match(p) for p in soup.find_all('p') ] == [ True, False, False ]
+
+def test_compiled_program_reuse():
+    program = matcher.compile(parse.parse_unification(lex.lex('(b,{},Children) = (strong,{},Children)')))
+    documents = [ BeautifulSoup('<p><b></b><b><i></i></b></p>', 'html.parser') for _ in range(3) ]
+
+    for soup in documents:
+        matcher.unify_tree(program, root=soup, soup=soup)
+        assert str(soup) == '<p><strong></strong><strong><i></i></strong></p>'
+
+def test_tag_index():
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+
+    index = build_index(soup)
+    assert index.candidates('a') == soup.find_all('a')
+    assert matcher.match_bs4(parse.parse('(a,{},[])'), soup=soup, index=index) == matcher.match_bs4(parse.parse('(a,{},[])'), soup=soup)
+
+def test_unify_tree_index():
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    unification = parse.parse_unification(lex.lex('(span,{},Children) = (b,{},[(span,{},Children)])'))
+    soup = BeautifulSoup(html, 'html.parser')
+    indexed_soup = BeautifulSoup(html, 'html.parser')
+    index = build_index(indexed_soup)
+
+    matcher.unify_tree(unification, root=soup, soup=soup)
+    matcher.unify_tree(unification, root=indexed_soup, soup=indexed_soup, index=index)
+    assert str(soup) == str(indexed_soup)
+
+    # The index tracks the rewritten tree (new elements are appended, so compare as sets)
+    assert sorted(map(id, index.candidates('b'))) == sorted(map(id, indexed_soup.find_all('b')))
+    assert sorted(map(id, index.candidates('span'))) == sorted(map(id, indexed_soup.find_all('span')))
+
+def test_unify_tree_index_delete():
+    with open('tests/data/simple.html') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+
+    index = build_index(soup)
+    unification = parse.parse_unification(lex.lex('(div,{},Children) = ()'))
+    matcher.unify_tree(unification, root=soup, soup=soup, index=index)
+
+    assert soup.div is None
+    assert index.candidates('div') == []
+    assert index.candidates('p') == soup.find_all('p')
+
+@pytest.mark.parametrize('program', [
+    '(span,{},Children) = (b,{},[(span,{},Children)]); (a,{},C) = (i,{},C); (font,{},C) = (em,{},C)',
+    '(td,{"class": {"title"}},C) = (th,{},C); (a,{"href": _},C) = ()',
+])
+def test_unify_tree_rules_index(program):
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    rules = matcher.compile_rules(parse.parse_rules(lex.lex(program)))
+    soup = BeautifulSoup(html, 'html.parser')
+    indexed_soup = BeautifulSoup(html, 'html.parser')
+    index = build_index(indexed_soup, attributes=True)
+    # Only the union of the rules' candidates is visited, in document order
+    assert index.union([ ('a', None), ('span', None) ]) == indexed_soup.find_all(['a', 'span'])
+
+    matcher.unify_tree(rules, root=soup, soup=soup)
+    matcher.unify_tree(rules, root=indexed_soup, soup=indexed_soup, index=index)
+    assert str(soup) == str(indexed_soup)
+
+def test_unify_tree_rules():
+    rules = matcher.compile_rules(parse.parse_rules(lex.lex('''
+    (img,A,C) = ();
+    (b,{},Children) = (strong,{},Children)
+    (strong,{},Children) = (em,{},Children)
+    (_,{},[]) = (hr,{},[])
+    ''')))
+
+    assert [ position for position, _ in rules.dispatch('b') ] == [ 1, 3 ]
+    assert [ position for position, _ in rules.dispatch('div') ] == [ 3 ]
+
+    soup = BeautifulSoup('<div><img/><b><i></i></b><strong><span></span></strong><p></p></div>', 'html.parser')
+    matcher.unify_tree(rules, root=soup, soup=soup)
+
+    # A rewritten node is offered to the later rules only
+    assert str(soup) == '<div><em><hr/></em><em><hr/></em><hr/></div>'
+
+def test_unify_tree_rules_matches_sequential():
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    program = '(img,A,C) = (); (span,{},Children) = (b,{},[(span,{},Children)]); (font,{},Children) = (p,{},Children)'
+    unifications = parse.parse_rules(lex.lex(program))
+
+    soup = BeautifulSoup(html, 'html.parser')
+    matcher.unify_tree(matcher.compile_rules(unifications), root=soup, soup=soup)
+
+    sequential_soup = BeautifulSoup(html, 'html.parser')
+    for unification in unifications:
+        matcher.unify_tree(unification, root=sequential_soup, soup=sequential_soup)
+
+    assert str(soup) == str(sequential_soup)
+
+def test_decision_tree():
+    rules = matcher.compile_rules(parse.parse_program('''
+    (p,{},[(b,{},C)]) = (x,{},[]);
+    (p,{},[(i,{},C),(_,{},C)]) = (y,{},[]);
+    (p,{},[]) = (z,{},[]);
+    (_,{},[(b,{},C)]) = (w,{},[]);
+    (p,{"class": "c"},C) = (v,{},[])
+    '''))
+
+    soup = BeautifulSoup('<p><b></b></p><p><i></i><b></b></p><p></p><div><b></b></div>', 'html.parser')
+    candidates = [ [ position for position, _ in rules.candidates(node) ] for node in soup.find_all(['p', 'div']) ]
+    assert candidates == [ [0, 3, 4], [1, 4], [2, 4], [3] ]
+
+    # Single rules aren't split any further
+    assert [ position for position, _ in rules.candidates(soup.b) ] == [ 3 ]
+
+@pytest.mark.parametrize('program', [
+    '(tr,{},[(td,{},C),(td,{},D)]) = (p,{},C); (tr,{},[(td,{},C)]) = (); (td,{},[(a,{},C),(_,{},D)]) = (td,{},C); (td,{},[]) = (hr,{},[])',
+    '(span,{},Children) = (b,{},[(span,{},Children)]); (b,{},[(span,{},C)]) = (i,{},C); (_,{},[(_,{},C)]) = (em,{},C)',
+])
+def test_decision_tree_matches_dispatch(program):
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    outputs = []
+    for decision_tree in (True, False):
+        rules = matcher.compile_rules(parse.parse_program(program), decision_tree=decision_tree)
+        soup = BeautifulSoup(html, 'html.parser')
+        matcher.unify_tree(rules, root=soup, soup=soup)
+        outputs.append(str(soup))
+
+    assert outputs[0] == outputs[1]
+
+def test_unify_tree_orders():
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    unification = parse.parse_unification(lex.lex('(span,{},Children) = (b,{},[(span,{},Children)])'))
+    results = []
+    for order in Order:
+        soup = BeautifulSoup(html, 'html.parser')
+        results.append(str(matcher.unify_tree(unification, root=soup, soup=soup, order=order)))
+
+    assert results[0] == results[1] == results[2]
+
+def test_unify_tree_post_order():
+    unification = parse.parse_unification(lex.lex('(div,{},[]) = ()'))
+
+    soup = BeautifulSoup('<div><div></div></div>', 'html.parser')
+    matcher.unify_tree(unification, root=soup, soup=soup, order=Order.PRE_ORDER)
+    assert str(soup) == '<div></div>'
+
+    # Children are rewritten first, so the emptied parent matches too
+    soup = BeautifulSoup('<div><div></div></div>', 'html.parser')
+    matcher.unify_tree(unification, root=soup, soup=soup, order=Order.POST_ORDER)
+    assert str(soup) == ''
+
+def test_unify_tree_deep_document():
+    depth = 2 * sys.getrecursionlimit()
+    html = '<div>' * depth + '</div>' * depth
+
+    unification = parse.parse_unification(lex.lex('(div,{},Children) = (section,{},Children)'))
+    for order in Order:
+        soup = BeautifulSoup(html, 'html.parser')
+        matcher.unify_tree(unification, root=soup, soup=soup, order=order)
+        assert soup.div is None and len(soup.find_all('section')) == depth
+
+def test_inplace_rename():
+    program = matcher.compile(parse.parse_unification(lex.lex('(b,{},Children) = (strong,{"class": "x"},Children)')))
+    assert program.inplace is not None
+
+    soup = BeautifulSoup('<p><b id="a">text <i>one</i> <br/></b></p>', 'html.parser')
+    b = soup.b
+    index = build_index(soup)
+    matcher.unify_tree(program, root=soup, soup=soup, index=index)
+
+    # Same element, new tag and attributes; text directly below it is dropped as when rebuilding
+    assert soup.strong is b
+    assert str(soup) == '<p><strong class="x"><i>one</i><br/></strong></p>'
+    assert b in index and index.candidates('b') == []
+
+def test_inplace_wildcard_children():
+    # (_,_,_) keeps the children like a children variable does
+    program = matcher.compile(parse.parse_unification(lex.lex('(b,{},_) = (i,{},_)')))
+    assert program.inplace is not None
+
+    soup = BeautifulSoup('<p><b><span>one</span></b></p>', 'html.parser')
+    matcher.unify_tree(program, root=soup, soup=soup)
+    assert str(soup) == '<p><i><span>one</span></i></p>'
+
+with open('tests/data/right-wildcard.json', 'rb') as f:
+    RIGHT_WILDCARD = orjson.loads(f.read())
+
+@pytest.mark.parametrize('case', RIGHT_WILDCARD, ids=[ case['rule'] for case in RIGHT_WILDCARD ])
+def test_right_wildcard(case):
+    # '_' on the right side is the matched element's tag, or its children. runtime/js/tests/matcher.test.js
+    # runs the same cases on the serialized rules.
+    unification = parse.parse_unification(lex.lex(case['rule']))
+    assert orjson.loads(orjson.dumps(unification.left)) == case['match_rule']
+    assert orjson.loads(orjson.dumps(unification.right)) == case['rewrite_rule']
+    assert classify(unification) == case['kind']
+
+    for inplace in (True, False):
+        soup = BeautifulSoup(case['html'], 'html.parser')
+        matcher.unify_tree(matcher.compile(unification, inplace=inplace), root=soup, soup=soup)
+        assert str(soup) == case['expected']
+
+def test_inplace_void_element():
+    # Renamed elements serialize like newly created ones
+    program = matcher.compile(parse.parse_unification(lex.lex('(span,{},[]) = (br,{},[])')))
+    soup = BeautifulSoup('<p><span></span></p>', 'html.parser')
+    matcher.unify_tree(program, root=soup, soup=soup)
+    assert str(soup) == '<p><br/></p>'
+
+def test_inplace_attributes():
+    program = matcher.compile(parse.parse_unification(lex.lex('(img,Attrs,C) = (img,{Attrs, "style": "filter: grayscale(100%);"}, C)')))
+    assert program.inplace is not None
+
+    soup = BeautifulSoup('<p><img src="a.png"/></p>', 'html.parser')
+    img = soup.img
+    matcher.unify_tree(program, root=soup, soup=soup)
+
+    assert soup.img is img
+    assert img.attrs == { 'src': 'a.png', 'style': 'filter: grayscale(100%);' }
+
+def test_structural_rewrite_not_inplace():
+    program = matcher.compile(parse.parse_unification(lex.lex('(a,Attrs,Children) = (mark,{},[(a,Attrs,Children)])')))
+    assert program.inplace is None
+
+    soup = BeautifulSoup('<p><a href="/x"><b>link</b></a></p>', 'html.parser')
+    matcher.unify_tree(program, root=soup, soup=soup)
+    assert str(soup) == '<p><mark><a href="/x"><b>link</b></a></mark></p>'
+
+@pytest.mark.parametrize('program', [
+    '(span,{},Children) = (b,{},Children); (font,{},C) = (em,{"class": "f"},C); (Tag,{},[]) = (Tag,{},[])',
+    '(td,Attrs,Children) = (th,{Attrs},Children); (a,Attrs,C) = (a,{Attrs, "rel": "nofollow"},C)',
+])
+def test_inplace_matches_rebuild(program):
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    unifications = parse.parse_rules(lex.lex(program))
+    outputs = []
+    for inplace in (True, False):
+        soup = BeautifulSoup(html, 'html.parser')
+        rules = matcher.compile_rules([ matcher.compile(unification, inplace=inplace) for unification in unifications ])
+        matcher.unify_tree(rules, root=soup, soup=soup)
+        outputs.append(str(soup))
+
+    assert outputs[0] == outputs[1]
+
+@pytest.mark.parametrize('pattern, html, matches', [
+    ('{"class": {"foo"}}', '<p class="foo"></p>', True),
+    ('{"class": {"foo"}}', '<p class="foo bar"></p>', False),
+    ('{"class": {"foo", ...}}', '<p class="foo bar"></p>', True),
+    ('{"class": {"foo", ...}}', '<p class="bar"></p>', False),
+    ('{"class": {_, _}}', '<p class="foo bar"></p>', True),
+    ('{"class": {_, _}}', '<p class="foo"></p>', False),
+    ('{"class": {"baz", _}}', '<p class="baz bar"></p>', True),
+    ('{"class": {...}}', '<p></p>', False),
+    ('{"id": "x"}', '<p id="x" class="foo"></p>', True),
+    ('{"id": "x"}', '<p id="y"></p>', False),
+    ('{"class": "foo bar"}', '<p class="foo bar"></p>', True),
+    ('{"hidden": _}', '<p hidden></p>', True),
+    ('{"hidden": _}', '<p></p>', False),
+    ('{}', '<p class="foo"></p>', True),
+    ('{A, "id": "x"}', '<p id="x"></p>', True),
+])
+def test_match_attributes(pattern, html, matches):
+    program = matcher.compile(parse.parse_unification(lex.lex(f'(p,{pattern},[]) = ()')))
+    soup = BeautifulSoup(html, 'html.parser')
+    assert program.match(soup.p) == matches
+
+def test_match_child_attributes():
+    program = matcher.compile(parse.parse_unification(lex.lex('(p,{},[(a,{"class": {"x", ...}},[])]) = ()')))
+    soup = BeautifulSoup('<p><a class="x y"></a></p><p><a class="y"></a></p>', 'html.parser')
+    assert [ program.match(p) for p in soup.find_all('p') ] == [True, False]
+
+def test_attribute_index():
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+
+    index = build_index(soup, attributes=True)
+    pattern = matcher.compile(parse.parse_unification(lex.lex('(_,{"class": {"togg", ...}},C) = ()'))).attributes
+    assert index.candidates(None, pattern) == soup.find_all(class_='togg')
+
+    pattern = matcher.compile(parse.parse_unification(lex.lex('(a,{"href": _, "class": {"clicky"}},C) = ()'))).attributes
+    assert index.candidates('a', pattern) == [ a for a in soup.find_all('a', class_='clicky') if a.has_attr('href') ]
+
+@pytest.mark.parametrize('program', [
+    '(div,{"class": {"commtext", ...}},Children) = (section,{},Children)',
+    '(_,{"class": {"clicky"}},C) = ()',
+    '(span,{"class": {"age"}},C) = (span,{"class": {"when"}},C)',
+])
+def test_unify_tree_attribute_index(program):
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    unification = parse.parse_unification(lex.lex(program))
+    soup = BeautifulSoup(html, 'html.parser')
+    indexed_soup = BeautifulSoup(html, 'html.parser')
+    index = build_index(indexed_soup, attributes=True)
+
+    matcher.unify_tree(unification, root=soup, soup=soup)
+    matcher.unify_tree(unification, root=indexed_soup, soup=indexed_soup, index=index)
+    assert str(soup) == str(indexed_soup)
+
+def test_unify_tree_class_pattern():
+    # The same rule is run by runtime/js/tests/matcher.test.js
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+
+    cells = len(soup.find_all('td'))
+    titles = len(soup.find_all('td', class_='title'))
+    assert titles == 2
+
+    unification = parse.parse_unification(lex.lex('(td,{"class": {"title"}},C) = (th,{},C)'))
+    matcher.unify_tree(unification, root=soup, soup=soup)
+    assert len(soup.find_all('th')) == titles
+    assert len(soup.find_all('td')) == cells - titles
+
+def test_attribute_index_inplace():
+    soup = BeautifulSoup('<p><span class="age">1</span><span class="age"><b></b></span></p>', 'html.parser')
+    index = build_index(soup, attributes=True)
+    unification = parse.parse_unification(lex.lex('(span,{"class": {"age"}},C) = (span,{"class": {"when"}},C)'))
+    matcher.unify_tree(unification, root=soup, soup=soup, index=index)
+
+    when = matcher.compile(parse.parse_unification(lex.lex('(span,{"class": {"when"}},C) = ()'))).attributes
+    age = matcher.compile(parse.parse_unification(lex.lex('(span,{"class": {"age"}},C) = ()'))).attributes
+    assert index.candidates('span', when) == soup.find_all('span')
+    assert index.candidates('span', age) == []
+
+@pytest.mark.parametrize('pattern, matches', [
+    ('(div,{},C) ..> (img,A,C)', [True, False, False]),
+    ('(div,{},C) ..> (b,{},[(img,{},[])])', [True, False, False]),
+    ('(div,{},C) ..> (b,{},[])', [False, False, True]),
+    ('(div,{},C) ..> (p,{},C) ..> (img,A,C)', [True, False, False]),
+    ('(div,{},C) ..> (_,{"class": {"x"}},[])', [False, True, False]),
+    ('(div,{},C) ..> (_,{},C)', [True, True, True]),
+])
+def test_match_filter(pattern, matches):
+    program = matcher.compile(parse.parse_unification(lex.lex(f'{pattern} = ()')))
+    soup = BeautifulSoup('<div><p><b><img/></b></p></div><div><i class="x"></i></div><div><b></b></div>', 'html.parser')
+    assert [ program.match(div) for div in soup.find_all('div', recursive=False) ] == matches
+
+def test_filter_right_side():
+    with pytest.raises(matcher.UnifyException):
+        matcher.compile(parse.parse_unification(lex.lex('(div,{},C) = (div,{},C) ..> (img,A,C)')))
+
+def test_subtree_index():
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+
+    subtree = build_subtree_index(soup)
+    for node in soup.find_all(['tr', 'td', 'span'])[:200]:
+        assert list(subtree.descendants(node, 'a')) == node.find_all('a')
+        assert list(subtree.descendants(node, None)) == node.find_all(True)
+        assert subtree.contains(node, 'img') == (node.find('img') is not None)
+
+    assert subtree.contains(soup.new_tag('p'), 'a') is None
+
+@pytest.mark.parametrize('program, order', [
+    ('(tr,{},C) ..> (a,{"class": {"hnuser"}},C) = (section,{},C)', Order.BREADTH_FIRST),
+    ('(td,{},C) ..> (img,A,C) = ()', Order.PRE_ORDER),
+    ('(span,{"class": {"age"}},C) = (em,{},[(i,{},C)]); (em,{},C) ..> (a,{},[]) = (mark,{},C)', Order.BREADTH_FIRST),
+    ('(span,{"class": {"age"}},C) = (em,{},C); (em,{},C) ..> (a,{},[]) = (mark,{},C)', Order.PRE_ORDER),
+    ('(table,{},C) ..> (div,{},C) ..> (span,{},[]) = (div,{},C)', Order.BREADTH_FIRST),
+])
+def test_unify_tree_filters_match_scan(program, order, monkeypatch):
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    # Number the document as soon as a filter runs
+    monkeypatch.setattr(matcher, 'NUMBERING_FACTOR', 0.0)
+
+    rules = matcher.compile_rules(parse.parse_program(program))
+    numbered = BeautifulSoup(html, 'html.parser')
+    matcher.unify_tree(rules, root=numbered, soup=numbered, order=order)
+
+    # Without a numbering every filter searches the subtree
+    scanned = BeautifulSoup(html, 'html.parser')
+    traverse(scanned, lambda node: matcher.rewrite_rules(rules, node, soup=scanned), order=order)
+
+    assert str(numbered) == str(scanned)
+    assert all(program.scope is None or program.scope.numbering is None for program in rules.programs)
+
+@pytest.mark.parametrize('order', list(Order))
+def test_built_elements_not_matched(order):
+    # The second rule hands the span the first one built back to the traversal
+    rules = matcher.compile_rules(parse.parse_program('(span,{},Children) = (b,{},[(span,{},Children)]); (b,{},C) = (mark,{},C)'))
+    soup = BeautifulSoup('<p><span><i></i></span><b><span></span></b></p>', 'html.parser')
+    matcher.unify_tree(rules, root=soup, soup=soup, order=order)
+    assert str(soup) == '<p><mark><span><i></i></span></mark><mark><mark><span></span></mark></mark></p>'
+
+def test_unify_tree_fixpoint():
+    rules = matcher.compile_rules(parse.parse_program('(font,{},C) = (em,{},C); (em,{},[(em,{},C)]) = (em,{},C)'))
+    html = '<p><font><font><font><i></i></font></font></font></p>'
+
+    soup = BeautifulSoup(html, 'html.parser')
+    matcher.unify_tree(rules, root=soup, soup=soup)
+    assert str(soup) == '<p><em><em><em><i></i></em></em></em></p>'
+
+    soup = BeautifulSoup(html, 'html.parser')
+    matcher.unify_tree(rules, root=soup, soup=soup, mode=matcher.Mode.FIXPOINT)
+    assert str(soup) == '<p><em><i></i></em></p>'
+
+@pytest.mark.parametrize('inplace', [ True, False ])
+def test_unify_tree_fixpoint_idempotent(inplace):
+    # Once every img has the style, rewriting it again changes nothing: that's a fixpoint, not a step
+    unification = parse.parse_unification(lex.lex('(img,Attrs,C) = (img,{Attrs, "style": "filter: grayscale(100%);"},C)'))
+    program = matcher.compile(unification, inplace=inplace)
+    soup = BeautifulSoup('<p><img src="a.png"/><img/></p>', 'html.parser')
+    matcher.unify_tree(program, root=soup, soup=soup, mode=matcher.Mode.FIXPOINT, budget=4)
+    assert [ img['style'] for img in soup.find_all('img') ] == [ 'filter: grayscale(100%);' ] * 2
+
+def test_unify_tree_budget():
+    # Each pass wraps the span the previous one built
+    unification = parse.parse_unification(lex.lex('(span,{},Children) = (b,{},[(span,{},Children)])'))
+    soup = BeautifulSoup('<p><span></span></p>', 'html.parser')
+    with pytest.raises(matcher.BudgetException):
+        matcher.unify_tree(unification, root=soup, soup=soup, mode=matcher.Mode.FIXPOINT, budget=20)
+
+    soup = BeautifulSoup('<p><span></span><span></span></p>', 'html.parser')
+    with pytest.raises(matcher.BudgetException):
+        matcher.unify_tree(unification, root=soup, soup=soup, budget=1)
@@ -0,0 +1,119 @@
+import os
+import socket
+import threading
+
+import orjson
+import pytest
+
+from tpml import serve
+
+PROGRAM = '(img,A,C) = (); (span,{"class": {"age"}},C) = (b,{},C)'
+
+# The real one, for 'crashing_handle_line' (Daemon looks it up in the serve module, which the tests patch)
+handle_line = serve.handle_line
+
+def crashing_handle_line(line):
+    # Kills the worker, as the OS would
+    if b'"crash"' in line:
+        os._exit(1)
+    return handle_line(line)
+
+@pytest.fixture(params=[ ('unix', 0), ('tcp', 2) ])
+def address(request, tmp_path):
+    kind, jobs = request.param
+    daemon = serve.Daemon(jobs=jobs, cache_size=2)
+    server = serve.make_server(str(tmp_path / 'tpml.sock') if kind == 'unix' else '127.0.0.1:0', daemon)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield serve.server_address(server)
+    finally:
+        server.shutdown()
+        server.server_close()
+        daemon.shutdown()
+
+def test_serve_rewrite(address):
+    html = '<p><img src="a"/><span class="age">1 hour</span></p>'
+    with serve.Client(address) as client:
+        for request_id in range(3):
+            response = client.rewrite(PROGRAM, html, id=request_id)
+            assert (response['id'], response['ok'], response['html']) == (request_id, True, '<p><b></b></p>')
+
+        response = client.rewrite(PROGRAM, html, edits=True)
+        assert [ edit['op'] for edit in response['edits'] ] == [ 'delete', 'update' ]
+
+def test_serve_options(address):
+    with serve.Client(address) as client:
+        response = client.rewrite('(b,{},C) = (i,{},C); (i,{},[]) = ()', '<p><b><b></b></b></p>', mode='fixpoint')
+        assert response['html'] == '<p></p>'
+
+        response = client.rewrite('(b,{},C) = (b,{},[(b,{},C)])', '<b></b>', mode='fixpoint', budget=5)
+        assert not response['ok'] and response['error'].startswith('BudgetException')
+
+def test_serve_errors(address):
+    with serve.Client(address) as client:
+        response = client.rewrite('(img,A', '<p></p>', id='x')
+        assert response['id'] == 'x' and not response['ok'] and response['error'].startswith('ParseError')
+
+        response = client.request({ 'id': 1, 'html': '<p></p>' })
+        assert not response['ok'] and response['error'].startswith('ServeException')
+
+        response = client.rewrite(PROGRAM, '<p></p>', backend='nope')
+        assert not response['ok'] and response['error'].startswith('BackendException')
+
+        # The connection is still usable
+        assert client.rewrite(PROGRAM, '<img/>')['html'] == ''
+
+        # Lines that aren't requests are answered too
+        client.file.write(b'not json\n[1]\n')
+        client.file.flush()
+        assert orjson.loads(client.file.readline())['error'].startswith('JSONDecodeError')
+        assert orjson.loads(client.file.readline())['error'] == 'ServeException: A request is a JSON object.'
+
+def test_serve_broken_pool(monkeypatch):
+    monkeypatch.setattr(serve, 'handle_line', crashing_handle_line)
+    daemon = serve.Daemon(jobs=1)
+    try:
+        request = { 'program': PROGRAM, 'html': '<img/>' }
+        response = orjson.loads(daemon.answer(orjson.dumps({ 'id': 'crash', **request })))
+        assert response['id'] == 'crash' and not response['ok'] and response['error'].startswith('BrokenProcessPool')
+
+        # Answered by a new pool
+        response = orjson.loads(daemon.answer(orjson.dumps({ 'id': 2, **request })))
+        assert (response['id'], response['ok'], response['html']) == (2, True, '')
+    finally:
+        daemon.shutdown()
+
+def test_program_cache():
+    cache = serve.ProgramCache(capacity=2)
+    first = cache.get('(a,{},C) = ()', 'html.parser')
+    cache.get('(b,{},C) = ()', 'html.parser')
+    assert cache.get('(a,{},C) = ()', 'html.parser') is first
+    cache.get('(a,{},C) = ()', 'lxml')
+
+    # The least recently used program was evicted
+    assert list(cache.programs) == [ ('(a,{},C) = ()', 'html.parser'), ('(a,{},C) = ()', 'lxml') ]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+@pytest.mark.parametrize('address, target', [
+    ('127.0.0.1:8765', ('127.0.0.1', 8765)),
+    ('localhost:0', ('localhost', 0)),
+    ('/tmp/tpml.sock', '/tmp/tpml.sock'),
+    ('tpml.sock', 'tpml.sock'),
+])
+def test_parse_address(address, target):
+    assert serve.parse_address(address) == target
+
+def test_stale_socket(tmp_path):
+    path = str(tmp_path / 'tpml.sock')
+    # Bound by a daemon that is gone
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+
+    server = serve.make_server(path, serve.Daemon(jobs=0))
+    try:
+        with pytest.raises(serve.ServeException):
+            serve.make_server(path, serve.Daemon(jobs=0))
+    finally:
+        server.server_close()
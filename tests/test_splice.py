@@ -0,0 +1,83 @@
+import io
+
+import pytest
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+from runtime import matcher, splice
+from tests.conftest import read_ask_hn
+
+HTML = '''<!DOCTYPE html>
+<div  id=x class="a  b">caf&eacute; &amp; <br>more<img src="a>b"/>
+  <p>unclosed <i>one</i>
+  <p>and <b>two</b></p>
+</div>
+<ul><li>Ünïcode<li><span title='quoted'>last</span></ul>'''
+
+def written(document, source=None, chunk_size=splice.CHUNK_SIZE) -> str:
+    output = io.BytesIO()
+    splice.write(document, output, source, chunk_size=chunk_size)
+    return output.getvalue().decode('utf-8')
+
+@pytest.mark.parametrize('html', [ HTML, read_ask_hn() ])
+def test_splice_unchanged(html):
+    document, source = splice.parse(html)
+    assert str(document) == str(BeautifulSoup(html, 'html.parser'))
+    assert written(document, source) == html
+
+    for element in document.find_all(True):
+        _, start, _, _, _, _ = source.elements[id(element)]
+        assert html.startswith(f'<{element.name}', start)
+
+def test_write_compact():
+    html = read_ask_hn()
+    document = BeautifulSoup(html, 'html.parser')
+    assert written(document) == str(document)
+
+    # Written in chunks of about chunk_size bytes
+    writes = []
+    class Output:
+        def write(self, data):
+            writes.append(len(data))
+
+    splice.write(document, Output(), chunk_size=1024)
+    assert len(writes) > 100 and max(writes) < 2048
+
+@pytest.mark.parametrize('program, expected', [
+    ('(i,{},C) = (em,{},C)', HTML.replace('<i>one</i>', '<em></em>')),
+    ('(b,{},C) = ()', HTML.replace('<b>two</b>', '')),
+    # The parent of a replaced element has other contents now, so it is serialized too
+    ('(span,{},C) = (mark,{"class": "m"},[])', HTML.replace("<li><span title='quoted'>last</span>", '<li><mark class="m"></mark></li>')),
+])
+def test_splice_rewritten(program, expected):
+    document, source = splice.parse(HTML)
+    matcher.unify_tree(matcher.compile_rules(parse.parse_program(program)), root=document, soup=document)
+    assert written(document, source) == expected
+
+def test_splice_moved():
+    document, source = splice.parse('<div>\n  <p  class=x>a &amp; b</p>\n</div>')
+    rules = matcher.compile_rules(parse.parse_program('(div,{},Children) = (section,{},[(main,{},Children)])'))
+    matcher.unify_tree(rules, root=document, soup=document)
+    assert written(document, source) == '<section><main><p  class=x>a &amp; b</p></main></section>'
+
+def test_splice_ask_hn():
+    html = read_ask_hn()
+    rules = matcher.compile_rules(parse.parse_program('(img,A,C) = (); (span,{"class": {"age"}},C) = (b,{},C)'))
+    document, source = splice.parse(html)
+    matcher.unify_tree(rules, root=document, soup=document)
+
+    expected = BeautifulSoup(html, 'html.parser')
+    matcher.unify_tree(rules, root=expected, soup=expected)
+    assert str(BeautifulSoup(written(document, source), 'html.parser')) == str(expected)
+
+def test_splice_unsupported_bs4(monkeypatch):
+    # As if bs4's tree builder no longer took a parser class
+    monkeypatch.setattr(splice.HTMLParserTreeBuilder, 'feed', lambda self, markup: None)
+    with pytest.raises(splice.SpliceException, match='beautifulsoup4>=4.12.3'):
+        splice.parse(HTML)
+
+def test_byte_offsets():
+    text = '<p>café</p><p>ÜÜ 😀</p>\n<i>x</i>é'
+    source = splice.Source(text=text, data=text.encode('utf-8'), line_starts=splice.line_starts(text))
+    assert [ source.byte_offset(offset) for offset in range(len(text) + 1) ] == [ len(text[:offset].encode('utf-8')) for offset in range(len(text) + 1) ]
@@ -0,0 +1,68 @@
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+from runtime import matcher
+from runtime.index import build_index
+from runtime.stats import Stats, instrument
+
+HTML = '<div><img/><span><b></b></span><span>text</span><img/></div>'
+RULES = '(img,A,C) = (); (span,{},Children) = (i,{},[(em,{},Children)])'
+
+def rewrite(rules, html=HTML):
+    soup = BeautifulSoup(html, 'html.parser')
+    matcher.unify_tree(rules, root=soup, soup=soup)
+    return str(soup)
+
+def test_stats_counters():
+    rules = matcher.compile_rules(parse.parse_program(RULES))
+    stats = Stats()
+    output = rewrite(instrument(rules, stats))
+
+    # Instrumentation doesn't change the result
+    assert output == rewrite(rules)
+
+    # Every element of the document is offered to both rules; the built ones aren't
+    img, span = stats.rules
+    assert (img.visited, img.tag_hits, img.matches, img.created, img.deleted) == (6, 2, 2, 0, 2)
+    assert (span.visited, span.tag_hits, span.matches, span.created, span.deleted) == (6, 2, 2, 4, 0)
+
+def test_stats_index_visits():
+    stats = Stats()
+    rules = instrument(parse.parse_program(RULES), stats)
+    soup = BeautifulSoup(HTML, 'html.parser')
+    matcher.unify_tree(rules, root=soup, soup=soup, index=build_index(soup))
+
+    # Only the rules' candidates are visited
+    img, span = stats.rules
+    assert (img.visited, img.tag_hits, img.matches) == (4, 2, 2)
+    assert (span.visited, span.tag_hits, span.matches) == (4, 2, 2)
+
+def test_stats_wildcard_tag_hits():
+    stats = Stats()
+    rules = instrument(parse.parse_program('(_,{},[]) = (hr,{},[])'), stats)
+    rewrite(rules)
+
+    # Every element is visited; only those without element children match
+    rule, = stats.rules
+    assert rule.visited == rule.tag_hits == 6
+    assert rule.matches == 4
+
+def test_stats_hook():
+    events = []
+    stats = Stats(hook=lambda event, position, node: events.append((event, position, node.name)))
+    rewrite(instrument(parse.parse_program(RULES), stats))
+
+    assert events.count(('match', 0, 'img')) == 2
+    assert events.count(('delete', 0, 'img')) == 2
+    assert ('create', 1, 'em') in events
+
+def test_stats_report():
+    stats = Stats()
+    rules = instrument(parse.parse_program(RULES), stats)
+    with stats.phase('match'):
+        rewrite(rules)
+
+    report = stats.report()
+    assert set(report['seconds']) == { 'parse', 'match', 'rebuild', 'serialize' }
+    assert report['seconds']['rebuild'] > 0
+    assert '1: span -> i' in stats.format()
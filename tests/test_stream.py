@@ -0,0 +1,91 @@
+import io
+import subprocess
+import sys
+
+import pytest
+
+from bs4 import BeautifulSoup
+
+import parser.parse as parse
+import lexer.lex as lex
+from runtime import matcher
+from runtime import stream
+
+def rewrite(program: str, html: str, chunk_size: int = 1 << 16) -> str:
+    output = io.StringIO()
+    stream_program = stream.compile_stream(parse.parse_rules(lex.lex(program)))
+    stream.rewrite_stream(stream_program, io.StringIO(html), output, chunk_size=chunk_size)
+    return output.getvalue()
+
+def normalize(html: str) -> str:
+    return ' '.join(str(BeautifulSoup(html, 'html.parser')).split())
+
+@pytest.mark.parametrize('program', [
+    '(img,A,C) = (); (span,{},Children) = (b,{},[(span,{},Children)]); (font,{},Children) = (p,{},Children)',
+    '(tr,{},[(td,{},[]),(X,{},[])]) = (X,{},[]); (a,{},[]) = ()',
+    '(a,Attrs,Children) = (a,{Attrs, "rel": "nofollow"},Children); (td,Attrs,C) = (th,{Attrs},C)',
+    '(span,{"class": {"age"}},C) = (i,{},C); (td,{"class": {"votelinks"}},[(center,{},[(a,{"id": _},[(div,{},[])])])]) = ()',
+    '(a,{"href": _},[(div,{"class": {"votearrow", ...}},[])]) = (hr,{},[]); (_,{"class": {"clicky"}},C) = ()',
+])
+def test_stream_matches_tree(program):
+    with open('tests/data/ask-hn-oct-24.html') as f:
+        html = f.read()
+
+    soup = BeautifulSoup(html, 'html.parser')
+    matcher.unify_tree(matcher.compile_rules(parse.parse_rules(lex.lex(program))), root=soup, soup=soup)
+
+    assert normalize(rewrite(program, html)) == ' '.join(str(soup).split())
+
+def test_stream_chunks():
+    with open('tests/data/simple.html') as f:
+        html = f.read()
+
+    program = '(p,{},[]) = (b,{},[]); (div,{},Children) = (section,{},Children)'
+    assert rewrite(program, html, chunk_size=3) == rewrite(program, html)
+
+def test_stream_copies_untouched_markup():
+    html = '<!DOCTYPE html><p class="x">a &amp; b<!-- c --><br/></p>'
+    assert rewrite('(div,{},[]) = ()', html) == html
+
+def test_stream_buffered_candidate_replay():
+    # The outer div fails to match once its child opens; the inner one still has to be rewritten.
+    html = '<div><div>text</div></div><div></div>'
+    assert rewrite('(div,{},[]) = (hr,{},[])', html) == '<div><hr/></div><hr/>'
+
+def test_stream_attributes():
+    html = '<p><a href="/x?a=1&amp;b=2">link</a></p>'
+    assert rewrite('(a,Attrs,C) = (b,{Attrs, "title": "<b> & c"},C)', html) == '<p><b href="/x?a=1&amp;b=2" title="&lt;b&gt; &amp; c"></b></p>'
+
+def test_stream_implicit_close():
+    html = '<div><p>text</div>'
+    assert rewrite('(p,{},[]) = (b,{},[])', html) == '<div><b></b></div>'
+
+def test_stream_not_streamable():
+    with pytest.raises(stream.NotStreamableException):
+        stream.compile_stream(parse.parse_rules(lex.lex('(p,{},[(div,{},Children)]) = ()')))
+
+    with pytest.raises(stream.NotStreamableException):
+        stream.compile_stream(parse.parse_rules(lex.lex('(p,{},C) = (div,{},[(b,{},C),(i,{},C)])')))
+
+    with pytest.raises(stream.NotStreamableException):
+        stream.compile_stream(parse.parse_rules(lex.lex('(p,{},C) ..> (img,A,C) = (div,{},C)')))
+
+@pytest.mark.parametrize('program, html, expected', [
+    ('(b,{},C) = (_,{"class": "x"},C)', '<p><b><i>two</i></b></p>', '<p><b class="x"><i>two</i></b></p>'),
+    ('(b,{},C) = (mark,{},[(_,{},C)])', '<p><b><i>two</i></b></p>', '<p><mark><b><i>two</i></b></mark></p>'),
+    ('(b,{},_) = (mark,{},[(i,{},_)])', '<p><b><span>one</span></b></p>', '<p><mark><i><span>one</span></i></mark></p>'),
+])
+def test_stream_right_wildcard(program, html, expected):
+    assert rewrite(program, html) == expected
+
+def test_stream_right_wildcard_children_unbounded():
+    with pytest.raises(stream.NotStreamableException):
+        stream.compile_stream(parse.parse_rules(lex.lex('(p,{},[(b,{},[])]) = (div,{},_)')))
+
+def test_stream_options():
+    # Options the stream rewriter would ignore are rejected
+    result = subprocess.run(
+        [ sys.executable, '-m', 'tpml.main', '(img,A,C) = ()', '--html', 'tests/data/ask-hn-oct-24.html', '--stream', '--mode', 'fixpoint', '--stats' ],
+        capture_output=True, text=True)
+    assert result.returncode == 2
+    assert '--stream cannot be combined with --mode, --stats' in result.stderr
@@ -0,0 +1,173 @@
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+import os
+import tempfile
+import time
+
+import orjson
+
+import parser.ast as ast
+import runtime.matcher as matcher
+from runtime.backend import get_backend
+from runtime.stream import compile_stream, rewrite_stream
+from tpml.workers import worker_pool, worker_state
+
+@dataclass
+class BatchResult:
+    input: str
+    output: Optional[str]
+    ok: bool
+    seconds: float
+    error: Optional[str] = None
+
+@dataclass
+class BatchSummary:
+    succeeded: int = 0
+    failed: int = 0
+
+def setup_worker(rules: List[ast.NodeUnification], backend_name: str, stream: bool) -> Dict:
+    ''' The 'worker_state' of a batch worker. '''
+    backend = get_backend(backend_name)
+    program = compile_stream(rules) if stream else matcher.compile_rules(rules, backend)
+    return { 'backend': backend, 'stream': stream, 'program': program }
+
+def rewrite_file(input_path: str, output_path: str) -> BatchResult:
+    ''' Rewrite one document; failures are reported rather than raised.
+
+    The output is written to a temporary file next to it and renamed into place, so a worker that dies
+    half way through never leaves a truncated document behind. '''
+    start = time.perf_counter()
+    temporary_path = None
+    try:
+        output_parent = Path(output_path).parent
+        output_parent.mkdir(parents=True, exist_ok=True)
+        with open(input_path, 'r') as input, tempfile.NamedTemporaryFile('w', dir=output_parent, prefix=f'.{Path(output_path).name}.', suffix='.tmp', delete=False) as output:
+            temporary_path = output.name
+            if worker_state['stream']:
+                rewrite_stream(worker_state['program'], input=input, output=output)
+            else:
+                backend = worker_state['backend']
+                document = backend.parse(input.read())
+                matcher.unify_tree(worker_state['program'], root=document, soup=document)
+                output.write(backend.serialize(document, pretty=False))
+        os.replace(temporary_path, output_path)
+    except Exception as e:
+        if temporary_path is not None and os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        return BatchResult(input=input_path, output=None, ok=False, seconds=time.perf_counter() - start, error=f'{type(e).__name__}: {e}')
+
+    return BatchResult(input=input_path, output=output_path, ok=True, seconds=time.perf_counter() - start)
+
+def failure(input_path: str, error: BaseException) -> BatchResult:
+    return BatchResult(input=input_path, output=None, ok=False, seconds=0.0, error=f'{type(error).__name__}: {error}')
+
+def find_inputs(input_dir: str, glob: str) -> Iterator[Path]:
+    return ( path for path in sorted(Path(input_dir).glob(glob)) if path.is_file() )
+
+def run_batch(
+        rules: List[ast.NodeUnification],
+        input_dir: str,
+        output_dir: str,
+        glob: str = '**/*.html',
+        jobs: Optional[int] = None,
+        manifest: Optional[str] = None,
+        backend_name: str = 'html.parser',
+        stream: bool = False,
+        max_in_flight: Optional[int] = None) -> BatchSummary:
+    ''' Rewrite every file matching 'glob' below 'input_dir' into the same relative path below 'output_dir'.
+
+    Files are fed to a pool of 'jobs' processes with at most 'max_in_flight' outstanding at once.
+    One NDJSON line per file is appended to 'manifest' (default: output_dir/manifest.ndjson) as it completes. '''
+    # Fail early (in this process) on rules that can't be compiled
+    if stream:
+        compile_stream(rules)
+
+    output_root = Path(output_dir)
+    output_root.mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(manifest) if manifest else output_root / 'manifest.ndjson'
+
+    jobs = jobs or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 4 * jobs
+    new_executor = lambda: worker_pool(jobs, setup_worker, rules, backend_name, stream)
+    executor = new_executor()
+
+    summary = BatchSummary()
+    inputs = find_inputs(input_dir, glob)
+    # Future -> (input path, output path, whether it ran alone in the pool)
+    in_flight: Dict[Future, Tuple[str, str, bool]] = {}
+    # Files outstanding when a worker died. Any of them may have killed it, so each is retried alone:
+    # the one that dies again fails, the others are rewritten as usual.
+    suspects: Deque[Tuple[str, str]] = deque()
+
+    with open(manifest_path, 'wb') as manifest_file:
+        def record(result: BatchResult):
+            if result.ok:
+                summary.succeeded += 1
+            else:
+                summary.failed += 1
+            manifest_file.write(orjson.dumps(result) + b'\n')
+
+        def finished(future: Future, input_path: str, output_path: str, alone: bool, broken: BrokenProcessPool):
+            ''' Record a file whose future is done, or which was outstanding when the pool broke with 'broken'. '''
+            if future.done() and not isinstance(future.exception(), BrokenProcessPool):
+                record(future.result())
+            elif alone:
+                record(failure(input_path, broken))
+            else:
+                suspects.append((input_path, output_path))
+
+        def restart(broken: BrokenProcessPool):
+            # A worker died (e.g. killed by the OS) and the pool can't be reused, so start a new one.
+            # Files that finished first keep their results; the others become suspects.
+            nonlocal executor
+            for future, (input_path, output_path, alone) in in_flight.items():
+                finished(future, input_path, output_path, alone, broken)
+            in_flight.clear()
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = new_executor()
+
+        def submit(input_path: str, output_path: str, alone: bool):
+            try:
+                future = executor.submit(rewrite_file, input_path, output_path)
+            except BrokenProcessPool as e:
+                # The pool broke since the last wait; this file hasn't been sent yet, so send it to the new one
+                restart(e)
+                future = executor.submit(rewrite_file, input_path, output_path)
+            in_flight[future] = (input_path, output_path, alone)
+
+        try:
+            exhausted = False
+            while not exhausted or in_flight or suspects:
+                if suspects:
+                    # Once the pool is idle, retry the next suspect on its own
+                    if not in_flight:
+                        submit(*suspects.popleft(), alone=True)
+                else:
+                    while not exhausted and len(in_flight) < max_in_flight:
+                        path = next(inputs, None)
+                        if path is None:
+                            exhausted = True
+                            break
+                        submit(str(path), str(output_root / path.relative_to(input_dir)), alone=False)
+
+                if not in_flight:
+                    continue
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                broken = None
+                # Every finished file is recorded from its own result, even if the pool broke meanwhile
+                for future in done:
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        broken = future.exception()
+                    finished(future, *in_flight.pop(future), broken=future.exception())
+
+                if broken is not None:
+                    restart(broken)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    return summary
@@ -1,32 +1,148 @@
 import argparse
+import sys
 
-from bs4 import BeautifulSoup
+import orjson
 
 import parser.parse as parse
-import lexer.lex as lex
 import runtime.matcher as matcher
+from runtime.backend import BACKENDS, get_backend
+from runtime.index import build_index
+from runtime import edits, splice
+from runtime.stats import Stats, instrument
+from runtime.stream import compile_stream, rewrite_stream
+from runtime.traversal import Order
 from runtime.js import emitter
+from tpml.batch import run_batch
+from tpml import serve
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('tpml_program')
+    parser.add_argument('tpml_program', nargs='?')
+    parser.add_argument('-f', '--program-file', type=str, help='Read the tpml program from a file instead.')
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--html', type=str)
+    group.add_argument('--input-dir', type=str, help='Rewrite every file matching --glob below this directory (requires --output-dir).')
     group.add_argument('--bookmarklet', action='store_true', help='Generate a bookmarklet.')
     group.add_argument('--js', action='store_true', help='Generate bundled Javascript.')
+    group.add_argument('--serve', type=str, metavar='ADDRESS', help='Run as a daemon on a Unix socket path or HOST:PORT, answering NDJSON rewrite requests (see tpml/serve.py).')
+    parser.add_argument('--many', action='store_true', help='With --js/--bookmarklet: emit one bundle per line of the program (one rule per line), running esbuild once for all of them.')
+    parser.add_argument('--live', action='store_true', help='With --js/--bookmarklet: keep rewriting elements added to the page later.')
+    parser.add_argument('--no-cache', action='store_true', help='Always rebuild --js/--bookmarklet output instead of using the emit cache.')
+    parser.add_argument('--backend', choices=list(BACKENDS), default='html.parser', help='HTML parser and tree the rules run on.')
+    parser.add_argument('--index', action='store_true', help='Index elements by tag (and attributes, if the rules have attribute patterns) so the rules only visit their candidates. Without effect if a rule matches any tag and has no attribute pattern.')
+    parser.add_argument('--stream', action='store_true', help='Rewrite --html incrementally with bounded memory (output is not prettified).')
+    parser.add_argument('--glob', type=str, default='**/*.html', help='Files to rewrite below --input-dir.')
+    parser.add_argument('--output-dir', type=str, help='Where --input-dir files are written, at the same relative paths.')
+    parser.add_argument('--jobs', type=int, help='Worker processes for --input-dir and --serve (default: one per CPU; 0 for --serve rewrites in the daemon itself), or concurrent esbuild runs for --many.')
+    parser.add_argument('--manifest', type=str, help='Per-file NDJSON results for --input-dir (default: OUTPUT_DIR/manifest.ndjson).')
+    parser.add_argument('--stats', nargs='?', const='text', choices=['text', 'json'], help='With --html: print per rule counters and phase timings to stderr.')
+    parser.add_argument('--order', type=Order, choices=list(Order), default=Order.BREADTH_FIRST, help='Element visiting order.')
+    parser.add_argument('--mode', type=matcher.Mode, choices=list(matcher.Mode), default=matcher.Mode.SINGLE_PASS, help='With --html: rewrite once, or until nothing changes.')
+    parser.add_argument('--compact', action='store_true', help='With --html: write the document as parsed rather than prettified, in chunks.')
+    parser.add_argument('--splice', action='store_true', help='With --html and the html.parser backend: copy unchanged elements from the input verbatim and only serialize what was rewritten.')
+    parser.add_argument('-o', '--output', type=str, help='With --html: write the document here instead of stdout.')
+    parser.add_argument('--edits', action='store_true', help='With --html: write the edit script of the rewrite as NDJSON, as it runs, instead of the document.')
+    parser.add_argument('--apply', type=str, metavar='EDITS', help='With --html: replay an edit script written by --edits onto the document instead of running the program.')
+    parser.add_argument('--cache-size', type=int, default=serve.CACHE_SIZE, help='With --serve: compiled programs each worker keeps.')
+    parser.add_argument('--budget', type=int, help=f'With --html: fail after this many rewrites (default for fixpoints: {matcher.FIXPOINT_BUDGET}).')
 
     args = parser.parse_args()
 
-    if args.html:
-        uni = parse.parse_unification(lex.lex(args.tpml_program))
+    if args.program_file:
+        with open(args.program_file, 'r') as f:
+            args.tpml_program = f.read()
+
+    if args.serve:
+        serve.serve(args.serve, jobs=args.jobs, cache_size=args.cache_size)
+    elif args.tpml_program is None and not (args.html and args.apply):
+        parser.print_help()
+    elif args.input_dir:
+        if args.output_dir is None:
+            parser.error('--input-dir requires --output-dir')
+
+        rules = parse.parse_program(args.tpml_program)
+        summary = run_batch(
+            rules,
+            input_dir=args.input_dir,
+            output_dir=args.output_dir,
+            glob=args.glob,
+            jobs=args.jobs,
+            manifest=args.manifest,
+            backend_name=args.backend,
+            stream=args.stream)
+        print(f'{summary.succeeded} succeeded, {summary.failed} failed', file=sys.stderr)
+        sys.exit(1 if summary.failed else 0)
+    elif args.html and args.stream:
+        # The stream rewriter builds no tree: options about the tree, its rewrite or its output don't apply
+        ignored = [ f'--{name}' for name in ('backend', 'index', 'mode', 'order', 'budget', 'stats', 'splice', 'edits', 'apply', 'output')
+                    if getattr(args, name) != parser.get_default(name) ]
+        if ignored:
+            parser.error(f'--stream cannot be combined with {", ".join(ignored)}')
+
+        program = compile_stream(parse.parse_program(args.tpml_program))
         with open(args.html, 'r') as f:
-            soup = BeautifulSoup(f.read(), 'html.parser')
+            rewrite_stream(program, input=f, output=sys.stdout)
+    elif args.html:
+        backend = get_backend(args.backend)
+        if args.splice and backend is not BACKENDS['html.parser']:
+            parser.error('--splice requires the html.parser backend')
+        if args.edits and (args.splice or args.compact or args.apply):
+            parser.error('--edits writes no document and cannot be combined with --splice, --compact or --apply')
+
+        stats = Stats()
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            if args.apply is None:
+                # A program may hold several rules; all of them are applied in a single traversal.
+                rules = matcher.compile_rules(parse.parse_program(args.tpml_program), backend)
+                if args.stats:
+                    rules = instrument(rules, stats)
+                if args.edits:
+                    # Written as the rules rewrite the document
+                    rules = edits.record(rules, edits.ndjson(output))
+
+            source = None
+            with stats.phase('parse'), open(args.html, 'r') as f:
+                if args.splice:
+                    document, source = splice.parse(f.read())
+                else:
+                    document = backend.parse(f.read())
+
+            with stats.phase('match'):
+                if args.apply is not None:
+                    with open(args.apply, 'rb') as f:
+                        edits.apply(document, edits.read(f), backend)
+                else:
+                    attributes = any(program.attributes is not None for program in rules.programs)
+                    index = build_index(document, attributes=attributes) if args.index else None
+                    matcher.unify_tree(rules, root=document, soup=document, index=index, order=args.order, mode=args.mode, budget=args.budget)
+
+            with stats.phase('serialize'):
+                if args.splice:
+                    splice.write(document, output, source)
+                elif args.compact:
+                    backend.write(document, output)
+                elif not args.edits:
+                    output.write(backend.serialize(document).encode('utf-8') + b'\n')
+        finally:
+            if args.output:
+                output.close()
+            else:
+                output.flush()
 
-        print(matcher.unify_tree(uni, root=soup, soup=soup).prettify())
+        if args.stats == 'json':
+            print(orjson.dumps(stats.report()).decode('utf8'), file=sys.stderr)
+        elif args.stats:
+            print(stats.format(), file=sys.stderr)
+    elif args.many and (args.bookmarklet or args.js):
+        programs = [ line for line in args.tpml_program.splitlines() if line.strip() != '' ]
+        cache = None if args.no_cache else emitter.EMIT_CACHE
+        for bundle in emitter.emit_many(programs, prefix=args.bookmarklet, cache=cache, jobs=args.jobs or 1, live=args.live):
+            print(bundle)
     elif args.bookmarklet:
-        print(emitter.emit(args.tpml_program), end='')
+        print(emitter.emit(args.tpml_program, cache=None if args.no_cache else emitter.EMIT_CACHE, live=args.live), end='')
     elif args.js:
-        print(emitter.emit(args.tpml_program, prefix=False), end='')
+        print(emitter.emit(args.tpml_program, prefix=False, cache=None if args.no_cache else emitter.EMIT_CACHE, live=args.live), end='')
     else:
         parser.print_help()
\ No newline at end of file
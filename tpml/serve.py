@@ -0,0 +1,253 @@
+from typing import Dict, Optional, Tuple, Union
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+
+import orjson
+
+import parser.parse as parse
+import runtime.matcher as matcher
+from runtime import edits
+from runtime.backend import get_backend
+from runtime.traversal import Order
+from tpml.workers import init_worker, worker_pool, worker_state
+
+# A daemon that rewrites documents sent to it over a Unix socket or TCP, so callers don't pay for starting
+# an interpreter, importing the runtime and compiling the program on every document.
+#
+# Requests and responses are lines of JSON; each connection is answered in order, one request at a time:
+#
+#   {"id": 1, "program": "(img,A,C) = ()", "html": "<p><img/></p>"}
+#   {"id": 1, "ok": true, "html": "<p></p>", "seconds": 0.0002}
+#
+# Requests may also give "backend", "order", "mode" and "budget" as on the command line, and "edits": true to be
+# answered with the edit script of the rewrite (see runtime.edits) instead of the document. Failed requests are
+# answered with "ok": false and an "error". Documents are written compactly (not prettified).
+
+# Compiled programs kept per worker
+CACHE_SIZE = 128
+
+class ServeException(Exception):
+    ...
+
+class ProgramCache:
+    ''' The most recently used compiled programs, by program text and backend. '''
+
+    def __init__(self, capacity: int = CACHE_SIZE):
+        self.capacity = capacity
+        self.programs: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, program: str, backend_name: str) -> matcher.RuleSet:
+        key = (program, backend_name)
+        rules = self.programs.get(key)
+        if rules is not None:
+            self.hits += 1
+            self.programs.move_to_end(key)
+            return rules
+
+        self.misses += 1
+        rules = matcher.compile_rules(parse.parse_program(program), get_backend(backend_name))
+        self.programs[key] = rules
+        if len(self.programs) > self.capacity:
+            self.programs.popitem(last=False)
+        return rules
+
+def setup_worker(cache_size: int) -> Dict:
+    ''' The 'worker_state' of a daemon worker: its own cache of compiled programs. '''
+    return { 'cache': ProgramCache(cache_size) }
+
+def rewrite(request: Dict) -> Dict:
+    ''' The response to a parsed request (without its id). '''
+    program, html = request.get('program'), request.get('html')
+    if not isinstance(program, str) or not isinstance(html, str):
+        raise ServeException("A request needs a 'program' and an 'html' string.")
+
+    backend_name = request.get('backend', 'html.parser')
+    backend = get_backend(backend_name)
+    rules = worker_state['cache'].get(program, backend_name)
+    options = dict(order=Order(request.get('order', Order.BREADTH_FIRST)), mode=matcher.Mode(request.get('mode', matcher.Mode.SINGLE_PASS)), budget=request.get('budget'))
+
+    document = backend.parse(html)
+    if request.get('edits'):
+        script = []
+        matcher.unify_tree(edits.record(rules, script.append), root=document, soup=document, **options)
+        return { 'edits': script }
+
+    matcher.unify_tree(rules, root=document, soup=document, **options)
+    return { 'html': backend.serialize(document, pretty=False) }
+
+def request_id(line: bytes):
+    ''' The id of a request line, or None if it has none (or isn't a request). '''
+    try:
+        request = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return None
+    return request.get('id') if isinstance(request, dict) else None
+
+def handle_line(line: bytes) -> bytes:
+    ''' Answer one request line; failures are reported rather than raised. '''
+    start = time.perf_counter()
+    request_id = None
+    try:
+        request = orjson.loads(line)
+        if not isinstance(request, dict):
+            raise ServeException('A request is a JSON object.')
+        request_id = request.get('id')
+        response = { 'id': request_id, 'ok': True, **rewrite(request) }
+    except Exception as e:
+        response = { 'id': request_id, 'ok': False, 'error': f'{type(e).__name__}: {e}' }
+
+    response['seconds'] = time.perf_counter() - start
+    return orjson.dumps(response) + b'\n'
+
+class Daemon:
+    ''' Hands request lines to a pool of 'jobs' worker processes, or with no jobs answers them itself, one at a time. '''
+
+    def __init__(self, jobs: Optional[int] = None, cache_size: int = CACHE_SIZE):
+        self.jobs = (os.cpu_count() or 1) if jobs is None else jobs
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.executor = None
+        if self.jobs == 0:
+            init_worker(setup_worker, cache_size)
+        else:
+            self.executor = self.new_executor()
+
+    def new_executor(self) -> ProcessPoolExecutor:
+        return worker_pool(self.jobs, setup_worker, self.cache_size)
+
+    def answer(self, line: bytes) -> bytes:
+        if self.executor is None:
+            # Compiled programs keep per document state while they run, so they can't be shared between threads
+            with self.lock:
+                return handle_line(line)
+
+        executor = self.executor
+        try:
+            return executor.submit(handle_line, line).result()
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed by the OS); the pool can't be reused, so start a new one.
+            # The worker never answered, so the id is read here (only then, to not parse every request twice).
+            with self.lock:
+                if self.executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self.executor = self.new_executor()
+            return orjson.dumps({ 'id': request_id(line), 'ok': False, 'error': f'{type(e).__name__}: {e}' }) + b'\n'
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                self.wfile.write(self.server.daemon.answer(line))
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    ''' HOST:PORT for TCP, anything else is the path of a Unix socket. '''
+    host, _, port = address.rpartition(':')
+    if host != '' and port.isdigit():
+        return (host, int(port))
+    return address
+
+def remove_stale_socket(path: str):
+    ''' Remove the socket at 'path' if it's left over from a daemon that is gone. '''
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+        else:
+            raise ServeException(f'A daemon is already listening on {path}.')
+
+def make_server(address: str, daemon: Daemon) -> socketserver.BaseServer:
+    target = parse_address(address)
+    if isinstance(target, tuple):
+        server = TCPServer(target, Handler)
+    else:
+        remove_stale_socket(target)
+        server = UnixServer(target, Handler)
+    server.daemon = daemon
+    return server
+
+def server_address(server: socketserver.BaseServer) -> str:
+    if isinstance(server.server_address, tuple):
+        host, port = server.server_address[:2]
+        return f'{host}:{port}'
+    return server.server_address
+
+def serve(address: str, jobs: Optional[int] = None, cache_size: int = CACHE_SIZE):
+    ''' Answer requests on 'address' until interrupted. '''
+    daemon = Daemon(jobs, cache_size)
+    server = make_server(address, daemon)
+    if threading.current_thread() is threading.main_thread():
+        # Stopped like on ctrl-c, so the socket is removed
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    print(f'Serving on {server_address(server)}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, UnixServer):
+            os.unlink(server.server_address)
+        daemon.shutdown()
+
+class Client:
+    ''' A connection to a daemon. '''
+
+    def __init__(self, address: str):
+        target = parse_address(address)
+        if isinstance(target, tuple):
+            self.socket = socket.create_connection(target)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX)
+            self.socket.connect(target)
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, request: Dict) -> Dict:
+        self.file.write(orjson.dumps(request) + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ServeException('The daemon closed the connection.')
+        return orjson.loads(line)
+
+    def rewrite(self, program: str, html: str, **options) -> Dict:
+        return self.request({ 'program': program, 'html': html, **options })
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
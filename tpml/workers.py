@@ -0,0 +1,14 @@
+from typing import Any, Callable, Dict
+from concurrent.futures import ProcessPoolExecutor
+
+# Per worker process state, set up once per worker by 'init_worker' (see 'worker_pool').
+# Compiled programs are closures, which can't be sent to other processes, so workers receive what they
+# compile from (parsed rules, program text) and keep what they compiled here.
+worker_state: Dict = {}
+
+def init_worker(setup: Callable[..., Dict], *args: Any):
+    worker_state.update(setup(*args))
+
+def worker_pool(jobs: int, setup: Callable[..., Dict], *args: Any) -> ProcessPoolExecutor:
+    ''' A pool of 'jobs' processes whose 'worker_state' is what 'setup(*args)' returns (run in each worker). '''
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(setup, *args))